@@ -1,4 +1,6 @@
+import { useEffect, useState } from "react";
 import { FileText, ChevronLeft, ChevronRight, X } from "lucide-react";
+import { useSearch } from "@/context/SearchContext";
 
 interface ContextPanelProps {
 	currentHighlight: {
@@ -30,6 +32,38 @@ export default function ContextPanel({
 	pagesWithMatches,
 	totalPages,
 }: ContextPanelProps) {
+	const { fetchContext } = useSearch();
+	const [context, setContext] = useState<string | null>(null);
+
+	// Context is not part of the /search response; fetch it for the shown match only
+	useEffect(() => {
+		const matchGroup = currentHighlight?.matchGroup;
+		setContext(matchGroup?.context ?? null);
+		if (
+			!fileName ||
+			!matchGroup ||
+			matchGroup.context ||
+			matchGroup.word_index === undefined
+		)
+			return;
+
+		let cancelled = false;
+		fetchContext(
+			fileName,
+			currentHighlight.page,
+			matchGroup.word_index,
+			matchGroup.word_count
+		)
+			.then((text) => {
+				if (!cancelled) setContext(text);
+			})
+			.catch((err) => console.error("Failed to load context:", err));
+
+		return () => {
+			cancelled = true;
+		};
+	}, [currentHighlight, fileName]);
+
 	return (
 		<div className="bg-slate-500/10 rounded-lg shadow-xl p-4 text-white border border-white/20 backdrop-blur-md sticky top-8">
 			{/* File Stats Section */}
@@ -129,11 +163,11 @@ export default function ContextPanel({
 					)}
 
 					{/* Context */}
-					{currentHighlight.matchGroup.context && (
+					{context && (
 						<div className="bg-gray-900/50 rounded-lg p-3">
 							<div className="text-xs text-gray-400 mb-2">Context</div>
 							<div className="text-sm text-gray-300 leading-relaxed">
-								{currentHighlight.matchGroup.context
+								{context
 									.split(
 										new RegExp(
 											`(${currentHighlight.matchGroup.matched_text})`,
@@ -44,18 +44,28 @@ interface SearchContextType {
 		searchText: string,
 		onProgress?: (percent: number) => void
 	) => Promise<SearchResult>;
+	fetchContext: (
+		fileName: string,
+		page: number,
+		wordIndex: number,
+		wordCount: number
+	) => Promise<string>;
 }
 
 const SearchContext = createContext<SearchContextType | undefined>(undefined);
 
 const BASE_URL = process.env.NEXT_PUBLIC_API_BASE_URL!;
 
+// The viewer opens on the first page, so the server OCRs these pages first
+const INITIAL_VISIBLE_PAGES = "1-3";
+
 export function SearchProvider({ children }: { children: ReactNode }) {
 	const [file, setFile] = useState<File | null>(null);
 	const [searchText, setSearchText] = useState("");
 	const [results, setResults] = useState<SearchResult | null>(null);
 	const [uploadHistory, setUploadHistory] = useState<UploadHistoryItem[]>([]);
 	const cache = useRef<Record<string, SearchResult>>({});
+	const contextCache = useRef<Record<string, string>>({});
 
 	// --- Memory leak prevention ---
 	const cancelRef = useRef(false);
@@ -152,6 +162,7 @@ export function SearchProvider({ children }: { children: ReactNode }) {
 		const searchForm = new FormData();
 		searchForm.append("fileName", file.name);
 		searchForm.append("search_text", searchText);
+		searchForm.append("priority_pages", INITIAL_VISIBLE_PAGES);
 
 		const res = await fetch(`${BASE_URL}/search`, {
 			method: "POST",
@@ -217,6 +228,35 @@ export function SearchProvider({ children }: { children: ReactNode }) {
 		return data;
 	};
 
+	const fetchContext = async (
+		fileName: string,
+		page: number,
+		wordIndex: number,
+		wordCount: number
+	): Promise<string> => {
+		const contextKey = `${fileName}-${page}-${wordIndex}-${wordCount}`;
+		if (contextCache.current[contextKey] !== undefined) {
+			return contextCache.current[contextKey];
+		}
+
+		const contextForm = new FormData();
+		contextForm.append("fileName", fileName);
+		contextForm.append("page", page.toString());
+		contextForm.append("word_index", wordIndex.toString());
+		contextForm.append("word_count", wordCount.toString());
+
+		const res = await fetch(`${BASE_URL}/context`, {
+			method: "POST",
+			body: contextForm,
+		});
+		const data = await res.json();
+		if (!res.ok || !data.success)
+			throw new Error(data.error || "Context lookup failed");
+
+		contextCache.current[contextKey] = data.context;
+		return data.context as string;
+	};
+
 	return (
 		<SearchContext.Provider
 			value={{
@@ -230,6 +270,7 @@ export function SearchProvider({ children }: { children: ReactNode }) {
 				addToHistory,
 				clearHistory,
 				performSearch,
+				fetchContext,
 			}}
 		>
 			{children}
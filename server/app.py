@@ -3,7 +3,7 @@ Image PDF Text Search Backend with OCR and Chunked Upload
 WITH MULTI-LINE HIGHLIGHTING
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, send_file
 from flask_cors import CORS
 import fitz  # PyMuPDF
 import pytesseract
@@ -11,17 +11,36 @@ from PIL import Image
 import time
 from concurrent.futures import ProcessPoolExecutor, as_completed
 import os
-import multiprocessing
-import psutil
 from rapidfuzz import fuzz
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from response_format import make_search_response
+from preprocess import preprocess_page, empty_ocr_data, unrotate_ocr_boxes
+from cpu_budget import available_cpus, limit_ocr_threads, plan_ocr_workers
+from page_dedup import plan_document
+from scheduler import parse_page_range
+from phrase_matcher import boundary_spans, find_phrase_spans, seam_window
+from text_normalize import normalize_words, page_norms
+from profiling import current_profile, profile_authorized, profile_path, profiled, stage, submit_profiled
 
 # Configs
 UPLOAD_FOLDER = "tmp_uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 MAX_WORKERS = int(os.getenv("MAX_WORKERS", 8))
+# Most recent processes x threads plan, reported by /metrics
+LAST_CPU_PLAN = {}
 OCR_DPI = int(os.getenv("OCR_DPI", 300))
 MIN_CONFIDENCE = int(os.getenv("MIN_CONFIDENCE", 15))
+# Word texts of recently searched pages, read by /context (a few KB per page)
+CONTEXT_PAGE_CACHE_SIZE = int(os.getenv("CONTEXT_PAGE_CACHE_SIZE", 500))
+# Saved request profiles (see profiling)
+PROFILE_FOLDER = os.path.join(UPLOAD_FOLDER, "profiles")
+
+# {(pdf_path, mtime, page_num): [word text]} of the pages searched last
+SEARCHED_PAGE_TEXTS = OrderedDict()
+SEARCHED_PAGE_TEXTS_LOCK = threading.Lock()
 
 # Flask App
 app = Flask(__name__)
@@ -44,63 +63,118 @@ def fuzzy_match(word1, word2, threshold=80):
     ratio = fuzz.ratio(word1.lower(), word2.lower())
     return ratio >= threshold
     
-def get_optimal_workers(total_pages: int):
-    cpu_count = multiprocessing.cpu_count()
-    total_ram_gb = psutil.virtual_memory().total / (1024 ** 3)
+def get_ocr_plan(total_pages: int):
+    """Worker processes and Tesseract threads for OCRing total_pages pages (see cpu_budget)"""
+    plan = plan_ocr_workers(total_pages, MAX_WORKERS)
+    print(f"CPU budget: {plan['cpus']} CPUs ({plan['cpu_source']}) -> "
+          f"{plan['processes']} workers x {plan['threads']} Tesseract threads")
+    LAST_CPU_PLAN.update(plan)
+    return plan
 
-    # Each worker may consume ~500MB depending on DPI/resolution
-    max_by_ram = int(total_ram_gb // 0.5)
-    print(f"System has {cpu_count} CPUs and {total_ram_gb:.2f}GB RAM and {max_by_ram}" )
 
-    upper_limit = min(cpu_count - 1, max_by_ram, 8)
+def ocr_page(pdf, page_num):
+    """
+    Render a single page of an open PDF and run Tesseract on it
+    Returns the image_to_data dict, plus the normalized words as "norm"
+    """
+    page = pdf[page_num]
 
-    optimal = min(upper_limit, total_pages)
-    print(f"Optimal workers based on system resources: {optimal}")
+    with stage("render"):
+        pix = page.get_pixmap(dpi=OCR_DPI)
+        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+        img = img.convert('L')
+    with stage("preprocess"):
+        img, prep = preprocess_page(img, OCR_DPI)
+    if img is None:
+        return empty_ocr_data()
+    tesseract_config = '--psm 3 --oem 3'
 
-    return max(2, optimal)
+    with stage("tesseract"):
+        ocr_data = pytesseract.image_to_data(img,lang='eng',config=tesseract_config, output_type=pytesseract.Output.DICT)
+    with stage("normalize"):
+        ocr_data = unrotate_ocr_boxes(ocr_data, prep["skew"], pix.width, pix.height)
+        ocr_data["norm"] = normalize_words(ocr_data["text"])
+    return ocr_data
 
 
 def process_page(page_data):
     """
     Process a single PDF page with OCR
-    Returns list of matches found on this page
+    Returns (matches found on this page, page edges, word texts); the edges
+    are the first and last words of the page, used to find matches across
+    page breaks, and the texts let /context build snippets without OCR
     """
-    page_num, pdf_bytes, search_text = page_data
+    page_num, pdf_bytes, search_text, include_context = page_data
     try:
         pdf = fitz.open(stream=pdf_bytes, filetype="pdf")
-        page = pdf[page_num]
-
-        pix = page.get_pixmap(dpi=OCR_DPI)
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-        img = img.convert('L')
-        tesseract_config = '--psm 3 --oem 3'
-
-        ocr_data = pytesseract.image_to_data(img,lang='eng',config=tesseract_config, output_type=pytesseract.Output.DICT)
-        matches = find_text_in_page(ocr_data, search_text, page_num)
+        ocr_data = ocr_page(pdf, page_num)
+        with stage("match"):
+            matches = find_text_in_page(ocr_data, search_text, page_num, include_context)
         pdf.close()
 
+        with stage("edges"):
+            words = extract_words(ocr_data)
+            window = seam_window(search_text)
+            edges = {
+                "head": words[:window],
+                "tail": words[-window:],
+                "tail_offset": max(0, len(words) - window),
+            }
+
         print(f"✓ Page {page_num + 1} - Found {len(matches)} match(es)")
-        return matches
+        return matches, edges, [w["text"] for w in words]
     except Exception as e:
         print(f"✗ Error processing page {page_num + 1}: {str(e)}")
-        return []
+        return [], None, None
+
+
+def remember_page_texts(pdf_path, mtime, page_num, texts):
+    """Keeps the word texts of a searched page for /context, dropping the oldest pages"""
+    with SEARCHED_PAGE_TEXTS_LOCK:
+        SEARCHED_PAGE_TEXTS[(pdf_path, mtime, page_num)] = texts
+        SEARCHED_PAGE_TEXTS.move_to_end((pdf_path, mtime, page_num))
+        while len(SEARCHED_PAGE_TEXTS) > CONTEXT_PAGE_CACHE_SIZE:
+            SEARCHED_PAGE_TEXTS.popitem(last=False)
 
 
-def find_text_in_page(ocr_data, search_text, page_num):
+def get_page_texts(pdf_path, mtime, page_num):
     """
-    Finds matches in OCR data to find highlights .
-    Returns matches found on this page with .
+    Word texts of a page for context lookups, as the last search read them
+    Keyed on file mtime so a re-upload invalidates the entry; pages no
+    search kept (evicted, or a server restart) are OCRed again
+    """
+    with SEARCHED_PAGE_TEXTS_LOCK:
+        texts = SEARCHED_PAGE_TEXTS.get((pdf_path, mtime, page_num))
+    if texts is not None:
+        return texts
+    return ocr_page_texts(pdf_path, mtime, page_num)
+
+
+@lru_cache(maxsize=32)
+def ocr_page_texts(pdf_path, mtime, page_num):
+    """OCR a single page for context lookups"""
+    pdf = fitz.open(pdf_path)
+    try:
+        return [w["text"] for w in extract_words(ocr_page(pdf, page_num))]
+    finally:
+        pdf.close()
+
+
+def extract_words(ocr_data):
+    """
+    Filters OCR output down to confident, non-empty words with their boxes
     """
-    matches = []
-    search_lower = search_text.lower().strip()
     words = []
+    norms = page_norms(ocr_data)
 
     for i in range(len(ocr_data["text"])):
         if int(ocr_data["conf"][i]) > MIN_CONFIDENCE:
             word = ocr_data["text"][i].strip()
-            if word:
+            # Words that are only punctuation have an empty normalized form
+            if word and norms[i]:
                 words.append({
                     "text": word,
+                    "norm": norms[i],
                     "left": ocr_data["left"][i],
                     "top": ocr_data["top"][i],
                     "width": ocr_data["width"][i],
@@ -108,95 +182,131 @@ def find_text_in_page(ocr_data, search_text, page_num):
                     "index": i,
                 })
 
-    search_words = search_lower.split()
-
-    for i in range(len(words)):
-        match_length = 0
-        match_text = []
-        match_scores = []
-
-        for j, search_word in enumerate(search_words):
-            if i + j < len(words):
-                word_lower = words[i + j]["text"].lower()
-
-                score = fuzz.ratio(word_lower, search_word)
-                if score >= 80:
-                    match_length += 1
-                    match_text.append(words[i + j]["text"])
-                    match_scores.append(score)
-                else:
-                    break
-
-        if match_length == len(search_words):
-            matched_words = words[i : i + match_length]
-
-            # ---- Group words by line ----
-            lines = []
-            current_line = [matched_words[0]]
-            for word in matched_words[1:]:
-                prev_word = current_line[-1]
-                vertical_distance = abs(word["top"] - prev_word["top"])
-                avg_height = (word["height"] + prev_word["height"]) / 2
-                if vertical_distance > avg_height * 0.5:
-                    lines.append(current_line)
-                    current_line = [word]
-                else:
-                    current_line.append(word)
+    return words
+
+
+def build_context(texts, start, match_length):
+    """
+    Builds a sentence-aware context snippet around texts[start:start + match_length],
+    texts being the word texts of a page
+    """
+    CONTEXT_WINDOW = 15
+    context_start = max(0, start - CONTEXT_WINDOW)
+    context_end = min(len(texts), start + match_length + CONTEXT_WINDOW)
+
+    # Convert to text to find sentence boundaries
+    raw_context = " ".join(texts[context_start:context_end])
+
+    # Try to expand context to sentence boundaries
+    # Search backward for period/question/exclamation
+    before = " ".join(texts[max(0, context_start - 10):context_start])
+    after = " ".join(texts[context_end:min(len(texts), context_end + 10)])
+
+    # If punctuation exists nearby, extend to it
+    if "." in before or "!" in before or "?" in before:
+        first_punc = max(before.rfind("."), before.rfind("!"), before.rfind("?"))
+        if first_punc != -1:
+            raw_context = before[first_punc + 1:].strip() + " " + raw_context
+
+    if "." in after or "!" in after or "?" in after:
+        last_punc = min(
+            [p for p in [after.find("."), after.find("!"), after.find("?")] if p != -1],
+            default=-1
+        )
+        if last_punc != -1:
+            raw_context = raw_context + " " + after[:last_punc + 1].strip()
+
+    # Clean and truncate overly long context
+    context = raw_context.strip()
+    if len(context.split()) > 60:
+        context = " ".join(context.split()[:60]) + " …"
+
+    return context
+
+
+def find_text_in_page(ocr_data, search_text, page_num, include_context=False):
+    """
+    Finds matches in OCR data to find highlights .
+    Returns matches found on this page with .
+    Context snippets are only built when include_context is set, otherwise
+    word_index/word_count let /context build them on demand.
+    """
+    matches = []
+    words = extract_words(ocr_data)
+
+    for span in find_phrase_spans(words, search_text):
+        matches.append(build_page_match(words, span["start"], span["count"], page_num, include_context))
+
+    return matches
+
+
+def build_page_match(words, i, match_length, page_num, include_context=False):
+    """
+    One match over words[i : i + match_length], with a highlight box per line
+    """
+    matched_words = words[i : i + match_length]
+    match_text = [w["text"] for w in matched_words]
+
+    # ---- Group words by line ----
+    lines = []
+    current_line = [matched_words[0]]
+    for word in matched_words[1:]:
+        prev_word = current_line[-1]
+        vertical_distance = abs(word["top"] - prev_word["top"])
+        avg_height = (word["height"] + prev_word["height"]) / 2
+        if vertical_distance > avg_height * 0.5:
             lines.append(current_line)
+            current_line = [word]
+        else:
+            current_line.append(word)
+    lines.append(current_line)
+
+    # ---- Create highlight locations ----
+    locations = []
+    PADDING = 15
+    for line_words in lines:
+        left = min(w["left"] for w in line_words)
+        top = min(w["top"] for w in line_words)
+        right = max(w["left"] + w["width"] for w in line_words)
+        bottom = max(w["top"] + w["height"] for w in line_words)
+        locations.append({
+            "left": int(max(0, left - PADDING)),
+            "top": int(max(0, top - PADDING)),
+            "width": int(right - left + 2 * PADDING),
+            "height": int(bottom - top + 2 * PADDING),
+        })
+
+    match = {
+        "page": page_num + 1,
+        "locations": locations,
+        "matched_text": " ".join(match_text),
+        "word_index": i,
+        "word_count": match_length,
+    }
+    if include_context:
+        match["context"] = build_context([w["text"] for w in words], i, match_length)
+    return match
 
-            # ---- Create highlight locations ----
-            locations = []
-            PADDING = 15
-            for line_words in lines:
-                left = min(w["left"] for w in line_words)
-                top = min(w["top"] for w in line_words)
-                right = max(w["left"] + w["width"] for w in line_words)
-                bottom = max(w["top"] + w["height"] for w in line_words)
-                locations.append({
-                    "left": int(max(0, left - PADDING)),
-                    "top": int(max(0, top - PADDING)),
-                    "width": int(right - left + 2 * PADDING),
-                    "height": int(bottom - top + 2 * PADDING),
-                })
 
-            # ---- Build better context ----
-            CONTEXT_WINDOW = 15 
-            context_start = max(0, i - CONTEXT_WINDOW)
-            context_end = min(len(words), i + match_length + CONTEXT_WINDOW)
-
-            # Convert to text to find sentence boundaries
-            raw_context = " ".join([w["text"] for w in words[context_start:context_end]])
-
-            # Try to expand context to sentence boundaries
-            # Search backward for period/question/exclamation
-            before = " ".join(w["text"] for w in words[max(0, context_start - 10):context_start])
-            after = " ".join(w["text"] for w in words[context_end:min(len(words), context_end + 10)])
-
-            # If punctuation exists nearby, extend to it
-            if "." in before or "!" in before or "?" in before:
-                first_punc = max(before.rfind("."), before.rfind("!"), before.rfind("?"))
-                if first_punc != -1:
-                    raw_context = before[first_punc + 1:].strip() + " " + raw_context
-
-            if "." in after or "!" in after or "?" in after:
-                last_punc = min(
-                    [p for p in [after.find("."), after.find("!"), after.find("?")] if p != -1],
-                    default=-1
-                )
-                if last_punc != -1:
-                    raw_context = raw_context + " " + after[:last_punc + 1].strip()
-
-            # Clean and truncate overly long context
-            context = raw_context.strip()
-            if len(context.split()) > 60:
-                context = " ".join(context.split()[:60]) + " …"
-
-            matches.append({
-                "page": page_num + 1,
-                "locations": locations,
-                "matched_text": " ".join(match_text),
-                "context": context,
-            })
+def find_text_across_pages(prev_edges, edges, search_text, page_num, include_context=False):
+    """
+    Matches that start at the bottom of page_num - 1 and end at the top of
+    page_num, returned as one match on each page. Both halves carry the same
+    match_id, and the second is marked "continued" so it is not counted as
+    a match of its own.
+    """
+    matches = []
+    tail, head = prev_edges["tail"], edges["head"]
+
+    for span in boundary_spans(tail, head, search_text):
+        first = build_page_match(tail, span["tail_start"], span["tail_count"], page_num - 1, include_context)
+        first["word_index"] += prev_edges["tail_offset"]
+        first["match_id"] = f"{page_num}-{first['word_index']}"
+        second = build_page_match(head, 0, span["head_count"], page_num, include_context)
+        second["match_id"] = first["match_id"]
+        second["continued"] = True
+        matches.append(first)
+        matches.append(second)
 
     return matches
 
@@ -208,6 +318,12 @@ def health_check():
     return jsonify({"status": "ok", "tesseract_available": check_tesseract()})
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    cpus, source = available_cpus()
+    return jsonify({"cpus": cpus, "cpu_source": source, "last_cpu_plan": LAST_CPU_PLAN})
+
+
 @app.route("/upload-chunk", methods=["POST"])
 def upload_chunk():
     chunk = request.files.get("chunk")
@@ -251,9 +367,11 @@ def upload_complete():
 
 
 @app.route("/search", methods=["POST"])
+@profiled(PROFILE_FOLDER)
 def search_pdf():
     file_name = request.form.get("fileName")
     search_text = request.form.get("search_text")
+    include_context = request.form.get("include_context", "false").lower() == "true"
 
     if not file_name or not search_text:
         return jsonify({"error": "Missing fileName or search_text"}), 400
@@ -263,26 +381,60 @@ def search_pdf():
         return jsonify({"error": "File not found"}), 400
 
     start_time = time.time()
+    mtime = os.path.getmtime(pdf_path)
     pdf_bytes = open(pdf_path, "rb").read()
     pdf = fitz.open(stream=pdf_bytes, filetype="pdf")
     total_pages = len(pdf)
     pdf.close()
 
-    page_data = [(i, pdf_bytes, search_text) for i in range(total_pages)]
+    # Blank pages are skipped and duplicate pages are searched only once
+    with stage("plan"):
+        plan = plan_document(pdf_bytes)
+    # Pages the user is looking at (1-based, "1-3,7") are submitted first
+    priority_pages = parse_page_range(request.form.get("priority_pages"), total_pages)
+    page_nums = sorted(plan["to_ocr"], key=lambda page_num: page_num not in priority_pages)
+    page_data = [(i, pdf_bytes, search_text, include_context) for i in page_nums]
     all_matches = []
-
-    MAX_WORKERS = get_optimal_workers(total_pages)
-    print(f"Using {MAX_WORKERS} workers for {total_pages} pages")
-
-    with ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        future_to_page = {executor.submit(process_page, data): data[0] for data in page_data}
-        for future in as_completed(future_to_page):
-            page_num = future_to_page[future]
-            try:
-                matches = future.result()
-                all_matches.extend(matches)
-            except Exception as e:
-                print(f"✗ Error on page {page_num + 1}: {str(e)}")
+    page_edges = {}
+    page_texts = {}
+
+    if page_data:
+        cpu_plan = get_ocr_plan(len(page_data))
+        print(f"Using {cpu_plan['processes']} workers for {len(page_data)} of {total_pages} pages")
+
+        with ProcessPoolExecutor(
+            max_workers=cpu_plan["processes"], initializer=limit_ocr_threads, initargs=(cpu_plan["threads"],)
+        ) as executor:
+            profile = current_profile()
+            future_to_page = {
+                submit_profiled(executor, process_page, data, profile): data[0] for data in page_data
+            }
+            for future in as_completed(future_to_page):
+                page_num = future_to_page[future]
+                try:
+                    matches, page_edges[page_num], page_texts[page_num] = future.result()
+                    all_matches.extend(matches)
+                except Exception as e:
+                    print(f"✗ Error on page {page_num + 1}: {str(e)}")
+
+    # Duplicate pages get a copy of their representative page's matches
+    matches_by_page = {}
+    for match in all_matches:
+        matches_by_page.setdefault(match["page"] - 1, []).append(match)
+    for page_num, representative in plan["same_as"].items():
+        for match in matches_by_page.get(representative, []):
+            all_matches.append({**match, "page": page_num + 1})
+        page_edges[page_num] = page_edges.get(representative)
+        page_texts[page_num] = page_texts.get(representative)
+    for page_num, texts in page_texts.items():
+        if texts is not None:
+            remember_page_texts(pdf_path, mtime, page_num, texts)
+
+    # Phrases continued from one page onto the next
+    for page_num in range(1, total_pages):
+        prev_edges, edges = page_edges.get(page_num - 1), page_edges.get(page_num)
+        if prev_edges and edges:
+            all_matches.extend(find_text_across_pages(prev_edges, edges, search_text, page_num, include_context))
 
     # Build response with multi-line location support
     pages_with_matches = {}
@@ -292,28 +444,97 @@ def search_pdf():
             pages_with_matches[page_num] = []
         
         # Each match now has an array of locations (one per line)
-        pages_with_matches[page_num].append({
+        match_group = {
             "locations": match["locations"],  # Array of {left, top, width, height}
-            "context": match["context"],
             "matched_text": match["matched_text"],
-        })
+            "word_index": match["word_index"],
+            "word_count": match["word_count"],
+        }
+        if include_context:
+            match_group["context"] = match["context"]
+        # Matches across a page break: one group per page, counted once
+        for field in ("match_id", "continued"):
+            if field in match:
+                match_group[field] = match[field]
+        pages_with_matches[page_num].append(match_group)
 
     processing_time = time.time() - start_time
+    total_matches = sum(1 for match in all_matches if not match.get("continued"))
     results = {
         "success": True,
-        "total_matches": len(all_matches),
+        "total_matches": total_matches,
         "total_pages": total_pages,
         "pages_with_matches": len(pages_with_matches),
         "processing_time": f"{processing_time:.2f}s",
         "search_query": search_text,
         "matches": [
-            {"page": page_num, "occurrences": len(match_list), "locations": match_list}
+            {
+                "page": page_num,
+                "occurrences": sum(1 for match in match_list if not match.get("continued")),
+                "locations": match_list,
+            }
             for page_num, match_list in sorted(pages_with_matches.items())
         ],
     }
 
-    print(f"✓ Search complete: {len(all_matches)} matches in {len(pages_with_matches)} pages")
-    return jsonify(results)
+    print(f"✓ Search complete: {total_matches} matches in {len(pages_with_matches)} pages")
+    return make_search_response(results)
+
+
+@app.route("/profiles/<profile_id>", methods=["GET"])
+def download_profile(profile_id):
+    """A saved request profile: speedscope file, or ?format=stages for the stage timings"""
+    if not profile_authorized():
+        return jsonify({"error": "Profiling token required"}), 403
+    path = profile_path(PROFILE_FOLDER, profile_id, request.args.get("format", "speedscope"))
+    if path is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return send_file(path, mimetype="application/json", as_attachment=True,
+                     download_name=os.path.basename(path))
+
+
+@app.route("/context", methods=["POST"])
+def match_context():
+    """
+    Returns the context snippet for a single match, from the words the
+    search read on its page (OCRing only that page if they are gone).
+    Called lazily for the match currently shown in the ContextPanel.
+    """
+    file_name = request.form.get("fileName")
+    page = request.form.get("page")
+    word_index = request.form.get("word_index")
+    word_count = request.form.get("word_count")
+
+    if not file_name or not page or not word_index or not word_count:
+        return jsonify({"error": "Missing fileName, page, word_index, or word_count"}), 400
+
+    pdf_path = os.path.join(UPLOAD_FOLDER, file_name)
+    if not os.path.exists(pdf_path):
+        return jsonify({"error": "File not found"}), 400
+
+    try:
+        page_num = int(page) - 1
+        word_index = int(word_index)
+        word_count = int(word_count)
+    except ValueError:
+        return jsonify({"error": "page, word_index and word_count must be integers"}), 400
+    # A negative page number would count from the end of the document
+    if page_num < 0:
+        return jsonify({"error": "Invalid page"}), 400
+
+    try:
+        texts = get_page_texts(pdf_path, os.path.getmtime(pdf_path), page_num)
+    except (IndexError, ValueError):
+        return jsonify({"error": "Invalid page"}), 400
+
+    if word_index < 0 or word_count < 1 or word_index + word_count > len(texts):
+        return jsonify({"error": "Invalid word range"}), 400
+
+    return jsonify({
+        "success": True,
+        "page": page_num + 1,
+        "context": build_context(texts, word_index, word_count),
+    })
 
 
 # Main
@@ -5,14 +5,15 @@ PDF Text Search Backend with EasyOCR and Chunked Upload
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import fitz  # PyMuPDF
-import easyocr
 from PIL import Image
 import numpy as np
 import time
 from concurrent.futures import ProcessPoolExecutor, as_completed
 import os
 import multiprocessing
+import importlib.util
 import psutil
+from warmup import WarmupState, start_warmup
 
 # ---------------- Configuration ---------------- #
 UPLOAD_FOLDER = "tmp_uploads"
@@ -22,8 +23,12 @@ MAX_WORKERS = int(os.getenv("MAX_WORKERS", 5))
 OCR_DPI = int(os.getenv("OCR_DPI", 300))
 MIN_CONFIDENCE = int(os.getenv("MIN_CONFIDENCE", 30))  # Percent
 
-# Initialize EasyOCR reader globally
-reader = easyocr.Reader(['en'], gpu=False)  # Set gpu=True if GPU available
+# EasyOCR (and torch) take long to load, so each OCR worker creates its reader
+# once when it starts. Workers are spawned, not forked: a fork of a process
+# whose torch threads are running can deadlock in the child.
+READER = {"reader": None}
+MP_CONTEXT = multiprocessing.get_context("spawn")
+WARMUP_STATE = WarmupState()
 
 # ---------------- Flask App ---------------- #
 app = Flask(__name__)
@@ -35,11 +40,26 @@ CORS(
 
 # ---------------- Utility Functions ---------------- #
 def check_easyocr():
-    try:
-        _ = reader
-        return True
-    except:
-        return False
+    return importlib.util.find_spec("easyocr") is not None
+
+def create_reader():
+    import easyocr
+    return easyocr.Reader(['en'], gpu=False)  # Set gpu=True if GPU available
+
+def load_reader():
+    """Pool initializer: loads this worker's EasyOCR reader before its first page"""
+    if READER["reader"] is None:
+        READER["reader"] = create_reader()
+
+def get_reader():
+    """The worker's EasyOCR reader, loaded on first use if the initializer did not run"""
+    load_reader()
+    return READER["reader"]
+
+def warm_start():
+    # Downloads the model files and pulls them into the OS page cache so spawned
+    # workers load fast; the server process itself never OCRs, so it keeps no reader
+    return start_warmup(WARMUP_STATE, [("easyocr_model", lambda: create_reader() and None)])
 
 def get_optimal_workers(total_pages: int):
     cpu_count = multiprocessing.cpu_count()
@@ -62,7 +82,7 @@ def process_page(page_data):
         img_np = np.array(img)
 
         # OCR with EasyOCR
-        ocr_results = reader.readtext(img_np)
+        ocr_results = get_reader().readtext(img_np)
 
         matches = find_text_in_page_easyocr(ocr_results, search_text, page_num)
         pdf.close()
@@ -136,7 +156,14 @@ def find_text_in_page_easyocr(ocr_results, search_text, page_num):
 # ---------------- Routes ---------------- #
 @app.route("/health", methods=["GET"])
 def health_check():
-    return jsonify({"status": "ok", "easyocr_available": check_easyocr()})
+    warm_start()
+    ready = WARMUP_STATE.ready.is_set()
+    return jsonify({
+        "status": "ok" if ready else "warming",
+        "ready": ready,
+        "warmup": WARMUP_STATE.as_dict(),
+        "easyocr_available": check_easyocr(),
+    }), 200 if ready else 503
 
 @app.route("/upload-chunk", methods=["POST"])
 def upload_chunk():
@@ -194,7 +221,7 @@ def search_pdf():
     max_workers = get_optimal_workers(total_pages)
     print(f"Using {max_workers} workers for {total_pages} pages")
 
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=MP_CONTEXT, initializer=load_reader) as executor:
         future_to_page = {executor.submit(process_page, data): data[0] for data in page_data}
         for future in as_completed(future_to_page):
             page_num = future_to_page[future]
@@ -244,7 +271,7 @@ if __name__ == "__main__":
     if check_easyocr():
         print("✓ EasyOCR is available")
     else:
-        print("✗ EasyOCR not found or failed to initialize")
+        print("✗ EasyOCR not found")
         exit(1)
 
     print(f"OCR DPI: {OCR_DPI}")
@@ -252,4 +279,8 @@ if __name__ == "__main__":
     print("Server starting on http://localhost:8000")
     print("=" * 60 + "\n")
 
+    # The debug reloader runs this block twice, only warm the serving process
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        warm_start()
+
     app.run(debug=True, host="0.0.0.0", port=8000)
@@ -3,27 +3,54 @@ Image PDF Text Search Backend with OCR and Chunked Upload
 WITH SESSION-BASED OCR CACHING
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, send_file
 from flask_cors import CORS
 import fitz  # PyMuPDF
 import pytesseract
-from PIL import Image
 import time
-from concurrent.futures import ProcessPoolExecutor, as_completed
 import os
-import multiprocessing
-import psutil
-from rapidfuzz import fuzz
 import hashlib
+import threading
+import uuid
+from response_format import make_search_response
+from ocr_page import OCR_DPI, check_tesseract, process_page_ocr
+from cpu_budget import available_cpus, plan_ocr_workers
+from ocr_queue import OCR_QUEUE, open_queue
+from page_dedup import PageOcrIndex, plan_document, finish_document
+from ocr_store import OcrDocumentCache, open_store
+from ocr_index import index_path, write_index, open_index
+from corpus_index import CorpusIndex
+from phrase_matcher import MATCH_MODE, MATCH_THRESHOLD, boundary_spans, find_phrase_spans, seam_window
+from pattern_search import (
+    PATTERN_MODES, PATTERN_TIMEOUT, PatternError, compile_pattern, find_pattern_spans, literal_pieces
+)
+from result_cache import SearchResultCache, result_key
+from text_normalize import page_norms
+from searchable_pdf import SEARCHABLE_PDF, read_text_layer, searchable_path, write_searchable_pdf
+from warmup import WARM_DOCUMENTS, WarmupState, start_warmup, warm_ocr_engine
+from scheduler import parse_page_range
+from profiling import profile_authorized, profile_path, profiled, stage
 
 # Configs
 UPLOAD_FOLDER = "tmp_uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 MAX_WORKERS = int(os.getenv("MAX_WORKERS", 8))
-OCR_DPI = int(os.getenv("OCR_DPI", 300))
+# Most recent processes x threads plan, reported by /metrics
+LAST_CPU_PLAN = {}
 MIN_CONFIDENCE = int(os.getenv("MIN_CONFIDENCE", 15))
 
+# Documents with at least this many pages are cached as memory-mapped index files
+INDEX_FOLDER = os.path.join(UPLOAD_FOLDER, "indexes")
+os.makedirs(INDEX_FOLDER, exist_ok=True)
+INDEX_MIN_PAGES = int(os.getenv("INDEX_MIN_PAGES", 50))
+
+# Uploads with an OCR text layer (see searchable_pdf), named by file hash
+SEARCHABLE_FOLDER = os.path.join(UPLOAD_FOLDER, "searchable")
+# Saved request profiles (see profiling)
+PROFILE_FOLDER = os.path.join(UPLOAD_FOLDER, "profiles")
+os.makedirs(SEARCHABLE_FOLDER, exist_ok=True)
+
 # Flask App
 app = Flask(__name__)
 CORS(
@@ -33,117 +60,205 @@ CORS(
 )
 
 
-# Global dictionary to store OCR data per file
+# OCR data of the documents this process used last (see ocr_store.OcrDocumentCache)
 # Structure: {file_hash: {"pages": [ocr_data_per_page], "total_pages": int}}
-OCR_CACHE = {}
+OCR_CACHE = OcrDocumentCache()
+
+# Shared on-disk tier so every server process sees every cached document
+OCR_STORE = open_store(UPLOAD_FOLDER)
+
+# Inverted index over all cached documents for /corpus-search
+CORPUS = CorpusIndex(os.getenv("CORPUS_INDEX_PATH", os.path.join(UPLOAD_FOLDER, "corpus.sqlite3")))
+# Candidate pages matched per document, so one large document cannot crowd out the rest
+CORPUS_MAX_PAGES = int(os.getenv("CORPUS_MAX_PAGES", 500))
+# Candidate pages matched per corpus search, across all documents
+CORPUS_MAX_CANDIDATES = int(os.getenv("CORPUS_MAX_CANDIDATES", 2000))
+# Most documents one /corpus-search returns
+CORPUS_MAX_LIMIT = int(os.getenv("CORPUS_MAX_LIMIT", 100))
+
+# Search results by (document, normalized query, match params), see result_cache
+RESULT_CACHE = SearchResultCache()
+
+# OCR results by perceptual page hash, shared across documents (see page_dedup)
+PAGE_OCR_INDEX = PageOcrIndex()
 
 def get_file_cache_key(file_path, file_name):
     """Generate cache key based on filename and size"""
     file_size = os.path.getsize(file_path)
     cache_key = f"{file_name}_{file_size}"
-    
-    print(f"DEBUG Cache Key Generation:")
-    print(f"  - File Name: {file_name}")
-    print(f"  - File Size: {file_size} bytes")
-    print(f"  - Cache Key String: {cache_key}")
-    
-    hash_result = hashlib.md5(cache_key.encode()).hexdigest()
-    print(f"  - Hash Result: {hash_result}")
-    print(f"  - Current Cache Keys: {list(OCR_CACHE.keys())}")
-    
-    return hash_result
+    return hashlib.md5(cache_key.encode()).hexdigest()
 
-def get_ocr_from_cache(file_hash):
-    """Retrieve OCR data from cache if available"""
+def get_ocr_from_cache(file_hash, record_use=True):
+    """
+    Retrieve OCR data from cache if available
+    Checks this process first, then the shared on-disk store
+    Hits are recorded in the store so warm starts know the hot documents
+    """
 
     # print(f"Checking cache : {OCR_CACHE}")
-    if file_hash in OCR_CACHE:
+    cached = OCR_CACHE.get(file_hash)
+    is_current = getattr(cached["pages"], "is_current", None) if cached is not None else None
+    if is_current is not None and not is_current():
+        # Another process cleared or rewrote the cache, this handle reads pages that are gone
+        print(f"✗ Stale cache handle for file {file_hash[:8]}..., reopening")
+        OCR_CACHE.pop(file_hash, None)
+        RESULT_CACHE.invalidate(file_hash)
+        cached = None
+
+    if cached is not None:
         print(f"✓ Cache HIT for file {file_hash[:8]}...")
-        return OCR_CACHE[file_hash]
-    print(f"✗ Cache MISS for file {file_hash[:8]}...")
-    return None
-
-def store_ocr_in_cache(file_hash, ocr_data, total_pages):
-    """Store OCR data in cache"""
-    OCR_CACHE[file_hash] = {
-        "pages": ocr_data,
-        "total_pages": total_pages
-    }
+    else:
+        cached = open_index(index_path(INDEX_FOLDER, file_hash))
+        if cached is not None:
+            # Memory-mapped, only the pages a search reads become resident
+            OCR_CACHE[file_hash] = cached
+            print(f"✓ Index HIT for file {file_hash[:8]}...")
+        elif OCR_STORE is not None:
+            cached = OCR_STORE.get_document(file_hash)
+            if cached is not None:
+                # StoredPages reads rows lazily and decodes each page once
+                OCR_CACHE[file_hash] = cached
+                print(f"✓ Store HIT for file {file_hash[:8]}...")
+    if cached is None:
+        print(f"✗ Cache MISS for file {file_hash[:8]}...")
+    elif record_use and OCR_STORE is not None:
+        OCR_STORE.touch(file_hash)
+    return cached
+
+def store_ocr_in_cache(file_hash, ocr_data, total_pages, file_name=None):
+    """
+    Store OCR data in cache
+    Large documents go to a memory-mapped index file, others to the shared store
+    When file_name is given the document is also added to the corpus index
+    """
+    if total_pages >= INDEX_MIN_PAGES:
+        path = index_path(INDEX_FOLDER, file_hash)
+        write_index(path, ocr_data)
+        OCR_CACHE[file_hash] = open_index(path)
+    elif OCR_STORE is not None:
+        OCR_STORE.put_document(file_hash, ocr_data)
+        OCR_CACHE[file_hash] = OCR_STORE.get_document(file_hash)
+    else:
+        OCR_CACHE[file_hash] = {
+            "pages": ocr_data,
+            "total_pages": total_pages
+        }
+    if OCR_STORE is not None:
+        OCR_STORE.touch(file_hash)
+    RESULT_CACHE.invalidate(file_hash)
+    if file_name is not None:
+        CORPUS.add_document(file_hash, file_name, ocr_data, MIN_CONFIDENCE)
     print(f"✓ Cached OCR data for file {file_hash[:8]}... ({total_pages} pages)")
 
-def clear_cache():
-    """Clear the OCR cache"""
-    global OCR_CACHE
-    count = len(OCR_CACHE)
-    OCR_CACHE.clear()
-    return count
-# ================================
+def load_text_layer(file_hash, total_pages):
+    """OCR data stored with the document's searchable PDF, or None if there is none"""
+    path = searchable_path(SEARCHABLE_FOLDER, file_hash)
+    if not os.path.exists(path):
+        return None
+    ocr_pages = read_text_layer(path, OCR_DPI)
+    if ocr_pages is None or len(ocr_pages) != total_pages:
+        return None
+    print(f"✓ Text layer HIT for file {file_hash[:8]}..., OCR skipped")
+    return ocr_pages
 
-# Utility Functions
-def check_tesseract():
-    try:
-        _ = pytesseract.get_tesseract_version()
-        return True
-    except:
-        return False
 
-def get_optimal_workers(total_pages: int):
-    cpu_count = multiprocessing.cpu_count()
-    total_ram_gb = psutil.virtual_memory().total / (1024 ** 3)
-    max_by_ram = int(total_ram_gb // 0.5)
-    print(f"System has {cpu_count} CPUs and {total_ram_gb:.2f}GB RAM and {max_by_ram}")
-    upper_limit = min(cpu_count - 1, max_by_ram, 8)
-    optimal = min(upper_limit, total_pages)
-    print(f"Optimal workers based on system resources: {optimal}")
-    return max(2, optimal)
+def save_searchable_pdf(file_hash, pdf_bytes, ocr_pages):
+    """Stores the upload with its OCR as an invisible text layer, returns the path"""
+    path = searchable_path(SEARCHABLE_FOLDER, file_hash)
+    write_searchable_pdf(pdf_bytes, ocr_pages, path, OCR_DPI, MIN_CONFIDENCE)
+    return path
 
 
-def process_page_ocr(page_data):
+def rehydrate_hot_documents(limit=WARM_DOCUMENTS):
     """
-    Process a single PDF page with OCR
-    Returns OCR data for this page
+    Reopens the most recently used cached documents into OCR_CACHE and reads
+    them into the OS page cache, so their first search after a restart is warm
+    Returns how many documents were loaded
     """
-    page_num, pdf_bytes = page_data
-    try:
-        pdf = fitz.open(stream=pdf_bytes, filetype="pdf")
-        page = pdf[page_num]
-
-        pix = page.get_pixmap(dpi=OCR_DPI)
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-        img = img.convert('L')
-        tesseract_config = '--psm 3 --oem 3'
-
-        ocr_data = pytesseract.image_to_data(
-            img,
-            lang='eng',
-            config=tesseract_config,
-            output_type=pytesseract.Output.DICT
-        )
-        pdf.close()
-
-        print(f"✓ OCR Page {page_num + 1} completed")
-        return (page_num, ocr_data)
-    except Exception as e:
-        print(f"✗ Error OCR processing page {page_num + 1}: {str(e)}")
-        return (page_num, None)
+    if OCR_STORE is None:
+        return 0
+    count = 0
+    for file_hash in OCR_STORE.hot_documents(limit):
+        cached = get_ocr_from_cache(file_hash, record_use=False)
+        if cached is None:
+            continue
+        prefetch = getattr(cached["pages"], "prefetch", None)
+        if prefetch is not None:
+            prefetch()
+        count += 1
+    return count
 
 
-def find_text_in_ocr_data(ocr_data, search_text, page_num):
+def clear_cache():
+    """Clear the OCR cache"""
+    global OCR_CACHE
+    count = len(OCR_CACHE)
+    OCR_CACHE.clear()
+    RESULT_CACHE.clear()
+    if OCR_STORE is not None:
+        count = max(count, OCR_STORE.clear())
+    CORPUS.clear()
+    index_files = [name for name in os.listdir(INDEX_FOLDER) if name.endswith(".ocridx")]
+    for name in index_files:
+        os.remove(os.path.join(INDEX_FOLDER, name))
+    # The text layer would otherwise rebuild the cleared OCR without Tesseract
+    for name in os.listdir(SEARCHABLE_FOLDER):
+        os.remove(os.path.join(SEARCHABLE_FOLDER, name))
+    return max(count, len(index_files))
+
+def drop_cached_document(file_hash):
     """
-    Finds matches in pre-processed OCR data
-    Returns matches found on this page
+    Forget everything cached for one document, in every tier
+    Called when a file is replaced, since its cache key only covers name and size
     """
-    matches = []
-    search_lower = search_text.lower().strip()
+    OCR_CACHE.pop(file_hash, None)
+    RESULT_CACHE.invalidate(file_hash)
+    if OCR_STORE is not None:
+        OCR_STORE.delete_document(file_hash)
+    CORPUS.remove_document(file_hash)
+    # Open handles in other processes notice the removed file (IndexedPages.is_current)
+    for path in (index_path(INDEX_FOLDER, file_hash), searchable_path(SEARCHABLE_FOLDER, file_hash)):
+        if os.path.exists(path):
+            os.remove(path)
+
+def cache_stats():
+    """Cached document and page counts, across all processes when the store is on"""
+    if OCR_STORE is not None:
+        stats = OCR_STORE.stats()
+    else:
+        stats = {
+            "cached_files": len(OCR_CACHE),
+            "total_cached_pages": sum(data["total_pages"] for data in OCR_CACHE.values())
+        }
+    stats["index_files"] = len([name for name in os.listdir(INDEX_FOLDER) if name.endswith(".ocridx")])
+    stats["result_cache"] = RESULT_CACHE.stats()
+    return stats
+# ================================
+
+# Utility Functions
+def get_ocr_plan(total_pages: int):
+    """Worker processes and Tesseract threads for OCRing total_pages pages (see cpu_budget)"""
+    plan = plan_ocr_workers(total_pages, MAX_WORKERS)
+    print(f"CPU budget: {plan['cpus']} CPUs ({plan['cpu_source']}) -> "
+          f"{plan['processes']} workers x {plan['threads']} Tesseract threads")
+    LAST_CPU_PLAN.update(plan)
+    return plan
+
+
+def extract_ocr_words(ocr_data):
+    """Confident, non-empty words of a page in reading order"""
     words = []
-    
+    norms = page_norms(ocr_data)
+
     for i in range(len(ocr_data["text"])):
         if int(ocr_data["conf"][i]) > MIN_CONFIDENCE:
             word = ocr_data["text"][i].strip()
-            if word:
+            # Words that are only punctuation have an empty normalized form
+            if word and norms[i]:
                 words.append(
                     {
                         "text": word,
+                        "norm": norms[i],
                         "left": ocr_data["left"][i],
                         "top": ocr_data["top"][i],
                         "width": ocr_data["width"][i],
@@ -152,76 +267,631 @@ def find_text_in_ocr_data(ocr_data, search_text, page_num):
                     }
                 )
 
-    search_words = search_lower.split()
-
-    for i in range(len(words)):
-        match_length = 0
-        match_text = []
-        match_scores = []
-
-        for j, search_word in enumerate(search_words):
-            if i + j < len(words):
-                word_lower = words[i + j]["text"].lower()
-                score = fuzz.ratio(word_lower, search_word)
-                is_match = (score >= 80)
-                
-                if is_match:
-                    match_length += 1
-                    match_text.append(words[i + j]["text"])
-                    match_scores.append(score)
-                else:
-                    break
-
-        if match_length == len(search_words):
-            matched_words = words[i : i + match_length]
-            
-            left = min(w["left"] for w in matched_words)
-            top = min(w["top"] for w in matched_words)
-            right = max(w["left"] + w["width"] for w in matched_words)
-            bottom = max(w["top"] + w["height"] for w in matched_words)
-
-            PADDING = 15
-            left = max(0, left - PADDING)
-            top = max(0, top - PADDING)
-            right = right + PADDING
-            bottom = bottom + PADDING
-
-            context_start = max(0, i - 5)
-            context_end = min(len(words), i + match_length + 5)
-            context = " ".join([words[k]["text"] for k in range(context_start, context_end)])
-
-            avg_score = sum(match_scores) / len(match_scores) if match_scores else 100
-            confidence = "high" if avg_score >= 90 else "medium" if avg_score >= 80 else "low"
-
-            matches.append(
-                {
-                    "page": page_num + 1,
-                    "left": int(left),
-                    "top": int(top),
-                    "width": int(right - left),
-                    "height": int(bottom - top),
-                    "matched_text": " ".join(match_text),
-                    "context": context,
-                    "confidence": confidence,
-                    "match_score": round(avg_score, 1),
-                }
-            )
+    return words
+
+
+def build_ocr_match(words, i, match_length, score, page_num):
+    """One highlight box around words[i : i + match_length]"""
+    matched_words = words[i : i + match_length]
+    match_text = [w["text"] for w in matched_words]
+
+    left = min(w["left"] for w in matched_words)
+    top = min(w["top"] for w in matched_words)
+    right = max(w["left"] + w["width"] for w in matched_words)
+    bottom = max(w["top"] + w["height"] for w in matched_words)
+
+    PADDING = 15
+    left = max(0, left - PADDING)
+    top = max(0, top - PADDING)
+    right = right + PADDING
+    bottom = bottom + PADDING
+
+    confidence = "high" if score >= 90 else "medium" if score >= 80 else "low"
+
+    return {
+        "page": page_num + 1,
+        "left": int(left),
+        "top": int(top),
+        "width": int(right - left),
+        "height": int(bottom - top),
+        "matched_text": " ".join(match_text),
+        "context": build_context(words, i, match_length),
+        "confidence": confidence,
+        "match_score": round(score, 1),
+        "word_index": i,
+        "word_count": match_length,
+    }
+
+
+def build_context(words, i, match_length):
+    """The matched words with up to five words either side"""
+    context_start = max(0, i - 5)
+    context_end = min(len(words), i + match_length + 5)
+    return " ".join([words[k]["text"] for k in range(context_start, context_end)])
+
+
+def cached_match_context(file_hash, page_num, word_index, word_count):
+    """
+    Context snippet of one match, read from the cached OCR of its page (0-based)
+    None when the document is not cached; ValueError for a page or word
+    range outside it
+    """
+    cached = get_ocr_from_cache(file_hash, record_use=False)
+    if cached is None:
+        return None
+    if not 0 <= page_num < cached["total_pages"]:
+        raise ValueError("Invalid page")
+    ocr_data = cached["pages"][page_num]
+    words = extract_ocr_words(ocr_data) if ocr_data else []
+    if word_index < 0 or word_count < 1 or word_index + word_count > len(words):
+        raise ValueError("Invalid word range")
+    return build_context(words, word_index, word_count)
+
+
+def find_text_in_ocr_data(ocr_data, search_text, page_num, words=None):
+    """
+    Finds matches in pre-processed OCR data
+    Returns matches found on this page
+    """
+    if words is None:
+        words = extract_ocr_words(ocr_data)
+    return [
+        build_ocr_match(words, span["start"], span["count"], span["score"], page_num)
+        for span in find_phrase_spans(words, search_text)
+    ]
+
+
+def find_text_across_pages(prev_words, words, search_text, page_num):
+    """
+    Matches that start at the bottom of page_num - 1 and end at the top of
+    page_num, returned as one highlight on each page. Both halves carry the
+    same match_id, and the second is marked "continued" so it is not
+    counted as a match of its own.
+    """
+    window = seam_window(search_text)
+    tail_offset = max(0, len(prev_words) - window)
+    matches = []
+
+    for span in boundary_spans(prev_words[tail_offset:], words[:window], search_text):
+        first = tail_offset + span["tail_start"]
+        match_id = f"{page_num}-{prev_words[first]['index']}"
+        head = build_ocr_match(prev_words, first, span["tail_count"], span["score"], page_num - 1)
+        tail = build_ocr_match(words, 0, span["head_count"], span["score"], page_num)
+        matches.append({**head, "match_id": match_id})
+        matches.append({**tail, "match_id": match_id, "continued": True})
 
     return matches
 
 
+def read_pdf(pdf_path):
+    """Read a PDF from disk, returning its bytes and page count"""
+    with open(pdf_path, "rb") as f:
+        pdf_bytes = f.read()
+    pdf = fitz.open(stream=pdf_bytes, filetype="pdf")
+    total_pages = len(pdf)
+    pdf.close()
+    return pdf_bytes, total_pages
+
+
+# Where pages are OCRed: a process pool here, or a broker's worker fleet (see ocr_queue)
+OCR_PAGE_QUEUE = open_queue(OCR_QUEUE, process_page_ocr, get_ocr_plan)
+
+
+def ocr_document(pdf_bytes, total_pages, job=None, priority_pages=()):
+    """
+    OCR every page of a document through OCR_PAGE_QUEUE
+    Returns OCR data per page (None for pages that failed)
+    Blank and duplicate pages are resolved without OCR (see page_dedup).
+    When a job is given, progress is recorded on it and the run is
+    exposed so cancel_job can stop it. priority_pages (0-based) are queued
+    ahead of the rest.
+    """
+    plan = plan_document(pdf_bytes, PAGE_OCR_INDEX)
+    page_nums = sorted(plan["to_ocr"], key=lambda page_num: page_num not in priority_pages)
+    ocr_pages = [None] * total_pages
+    if job is not None:
+        job["completed_pages"] = total_pages - len(page_nums)
+
+    if not page_nums:
+        return finish_document(ocr_pages, plan, PAGE_OCR_INDEX)
+
+    print(f"OCR of {len(page_nums)} of {total_pages} pages via {OCR_PAGE_QUEUE.name} queue")
+    run = OCR_PAGE_QUEUE.start(pdf_bytes, page_nums)
+    if job is not None:
+        job["ocr_run"] = run
+    try:
+        # A cancel may land before the run existed for cancel_job to stop
+        if job is not None and job["status"] == "cancelled":
+            return ocr_pages
+        for page_num, ocr_data in run.results():
+            if job is not None and job["status"] == "cancelled":
+                break
+            ocr_pages[page_num] = ocr_data
+            if job is not None:
+                job["completed_pages"] += 1
+    finally:
+        run.close(wait=job is None or job["status"] != "cancelled")
+        if job is not None:
+            job["ocr_run"] = None
+
+    return finish_document(ocr_pages, plan, PAGE_OCR_INDEX)
+
+
+# In-flight OCR runs, so concurrent cache misses on one document share a single OCR
+# Structure: {file_hash: {"done": threading.Event, "error": str | None}}
+INFLIGHT_OCR = {}
+INFLIGHT_LOCK = threading.Lock()
+
+
+def get_document_ocr(pdf_path, file_hash, job=None, priority_pages=()):
+    """
+    Returns (ocr_pages, total_pages, from_cache) for a document.
+    On a cache miss the first caller runs the OCR and every concurrent caller
+    for the same file_hash waits for that run instead of starting its own.
+    Returns (None, None, False) if the given job is cancelled meanwhile.
+    """
+    while True:
+        cached_data = get_ocr_from_cache(file_hash)
+        if cached_data:
+            return cached_data["pages"], cached_data["total_pages"], True
+
+        with INFLIGHT_LOCK:
+            flight = INFLIGHT_OCR.get(file_hash)
+            # Re-check under the lock: a leader stores its result before leaving
+            is_leader = flight is None and file_hash not in OCR_CACHE
+            if is_leader:
+                flight = {"done": threading.Event(), "error": None}
+                INFLIGHT_OCR[file_hash] = flight
+
+        if flight is None:
+            continue
+
+        if not is_leader:
+            print(f"⏳ Waiting for in-flight OCR of {file_hash[:8]}...")
+            while not flight["done"].wait(timeout=1):
+                if job is not None and job["status"] == "cancelled":
+                    return None, None, False
+            if flight["error"]:
+                raise RuntimeError(flight["error"])
+            # Either the cache is filled now, or the leader was cancelled and we retry
+            continue
+
+        try:
+            pdf_bytes, total_pages = read_pdf(pdf_path)
+            if job is not None:
+                job["total_pages"] = total_pages
+            ocr_pages = load_text_layer(file_hash, total_pages)
+            if ocr_pages is None:
+                ocr_pages = ocr_document(pdf_bytes, total_pages, job, priority_pages)
+                if job is not None and job["status"] == "cancelled":
+                    return None, None, False
+                if SEARCHABLE_PDF:
+                    save_searchable_pdf(file_hash, pdf_bytes, ocr_pages)
+            store_ocr_in_cache(file_hash, ocr_pages, total_pages, os.path.basename(pdf_path))
+            return ocr_pages, total_pages, False
+        except Exception as e:
+            flight["error"] = str(e)
+            raise
+        finally:
+            with INFLIGHT_LOCK:
+                del INFLIGHT_OCR[file_hash]
+            flight["done"].set()
+
+
+def search_ocr_pages(ocr_pages, search_text):
+    """
+    Run the matcher over every OCRed page, and over each page break so a
+    phrase continued on the next page is still found
+    """
+    all_matches = []
+    prev_words = []
+
+    for page_num, ocr_data in enumerate(ocr_pages):
+        words = extract_ocr_words(ocr_data) if ocr_data else []
+        if words:
+            matches = find_text_in_ocr_data(ocr_data, search_text, page_num, words)
+            if prev_words:
+                matches.extend(find_text_across_pages(prev_words, words, search_text, page_num))
+            all_matches.extend(matches)
+            if matches:
+                print(f"✓ Page {page_num + 1} - Found {len(matches)} match(es)")
+        prev_words = words
+
+    # Matches continued from the previous page are appended after it
+    all_matches.sort(key=lambda match: match["page"])
+    return all_matches
+
+
+def search_ocr_pages_pattern(file_hash, ocr_pages, search_text, search_mode):
+    """
+    Regex or wildcard search (see pattern_search.py), only on the pages that
+    contain the pattern's literal pieces
+    """
+    pattern = compile_pattern(search_text, search_mode)
+    pieces = literal_pieces(search_text, search_mode, pattern)
+    deadline = time.time() + PATTERN_TIMEOUT
+    page_nums = range(len(ocr_pages))
+    if pieces and CORPUS.has_document(file_hash):
+        page_nums = sorted(page_num for page_num in CORPUS.pages_containing(file_hash, pieces)
+                           if page_num < len(ocr_pages))
+        print(f"✓ Corpus index narrowed pattern search to {len(page_nums)}/{len(ocr_pages)} pages")
+
+    all_matches = []
+    for page_num in page_nums:
+        ocr_data = ocr_pages[page_num]
+        words = extract_ocr_words(ocr_data) if ocr_data else []
+        matches = [
+            build_ocr_match(words, span["start"], span["count"], span["score"], page_num)
+            for span in find_pattern_spans(words, pattern, pieces, deadline)
+        ]
+        all_matches.extend(matches)
+        if matches:
+            print(f"✓ Page {page_num + 1} - Found {len(matches)} match(es)")
+    return all_matches
+
+
+def search_document(file_hash, ocr_pages, search_text, search_mode="phrase"):
+    """
+    search_ocr_pages (or the pattern search for search_mode "regex" and
+    "wildcard") through the result cache
+    Returns (matches, whether they came from the result cache)
+    """
+    if search_mode in PATTERN_MODES:
+        # Kept verbatim, normalizing would strip the pattern syntax
+        key = (file_hash, search_mode, search_text, MIN_CONFIDENCE)
+    else:
+        key = result_key(file_hash, search_text, MATCH_MODE, MATCH_THRESHOLD, MIN_CONFIDENCE)
+    pages = RESULT_CACHE.get(key)
+    if pages is not None:
+        print(f"✓ Result cache HIT for file {file_hash[:8]}...")
+        return [match for page_num in sorted(pages) for match in pages[page_num]], True
+
+    if search_mode in PATTERN_MODES:
+        all_matches = search_ocr_pages_pattern(file_hash, ocr_pages, search_text, search_mode)
+    else:
+        all_matches = search_ocr_pages(ocr_pages, search_text)
+    pages = {}
+    for match in all_matches:
+        pages.setdefault(match["page"], []).append(match)
+    RESULT_CACHE.put(key, pages)
+    return all_matches, False
+
+
+def build_search_results(all_matches, total_pages, search_text, total_time, ocr_time, search_time, from_cache,
+                         result_cache_hit=False):
+    """
+    Group matches by page into the /search response shape
+    A match across a page break is one location on each page but counts
+    once, on the page where it starts.
+    """
+    pages_with_matches = {}
+    for match in all_matches:
+        page_num = match["page"]
+        if page_num not in pages_with_matches:
+            pages_with_matches[page_num] = []
+        location = {
+            "left": match["left"],
+            "top": match["top"],
+            "width": match["width"],
+            "height": match["height"],
+            "context": match["context"],
+            "matched_text": match["matched_text"],
+            "word_index": match["word_index"],
+            "word_count": match["word_count"],
+        }
+        for field in ("match_id", "continued"):
+            if field in match:
+                location[field] = match[field]
+        pages_with_matches[page_num].append(location)
+
+    return {
+        "success": True,
+        "total_matches": sum(1 for match in all_matches if not match.get("continued")),
+        "total_pages": total_pages,
+        "pages_with_matches": len(pages_with_matches),
+        "processing_time": f"{total_time:.2f}s",
+        "ocr_time": f"{ocr_time:.2f}s" if ocr_time > 0 else "0.00s (cached)",
+        "search_time": f"{search_time:.2f}s",
+        "from_cache": from_cache,
+        "result_cache_hit": result_cache_hit,
+        "search_query": search_text,
+        "matches": [
+            {"page": page_num, "occurrences": sum(1 for loc in locs if not loc.get("continued")), "locations": locs}
+            for page_num, locs in sorted(pages_with_matches.items())
+        ],
+    }
+
+
+def parse_search_mode(text, search_text):
+    """
+    The `search_mode` field of a search: "phrase" (default), "regex" or
+    "wildcard". Patterns are compiled here so a bad one fails before any OCR.
+    """
+    search_mode = (text or "phrase").strip().lower()
+    if search_mode != "phrase":
+        compile_pattern(search_text, search_mode)
+    return search_mode
+
+
+def parse_corpus_limit(text):
+    """
+    The `limit` field of a corpus search: documents to return, default 20
+    ValueError unless it is a positive integer; capped at CORPUS_MAX_LIMIT
+    """
+    if text is None:
+        return min(20, CORPUS_MAX_LIMIT)
+    try:
+        limit = int(text)
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+    return min(limit, CORPUS_MAX_LIMIT)
+
+
+def parse_context_request(form):
+    """
+    (page_num, word_index, word_count) of a /context request, page_num 0-based
+    ValueError for a missing or malformed field
+    """
+    fields = [form.get(name) for name in ("page", "word_index", "word_count")]
+    if not all(fields):
+        raise ValueError("Missing page, word_index, or word_count")
+    try:
+        page, word_index, word_count = (int(field) for field in fields)
+    except ValueError:
+        raise ValueError("page, word_index and word_count must be integers")
+    return page - 1, word_index, word_count
+
+
+def parse_page_window(text, total_pages):
+    """
+    The `pages` field of a search: None for the full response, else the set of
+    1-based pages to return locations for ("none" for per-page counts only)
+    ValueError for a malformed field; pages past the end are dropped
+    """
+    if text is None:
+        return None
+    if text.strip().lower() == "none":
+        return set()
+    return {page_num + 1 for page_num in parse_page_range(text, total_pages, strict=True)}
+
+
+def window_search_results(results, window):
+    """
+    Restricts a /search response to the locations of the pages in window
+    Totals stay those of the whole document and page_counts lists every page
+    with matches, so the client can lay out the result list before fetching
+    the locations of the pages it shows.
+    """
+    if window is None:
+        return results
+    paged = {key: value for key, value in results.items() if key != "matches"}
+    paged["page_counts"] = [
+        {"page": page_entry["page"], "occurrences": page_entry["occurrences"]}
+        for page_entry in results["matches"]
+    ]
+    paged["window"] = sorted(window)
+    paged["matches"] = [page_entry for page_entry in results["matches"] if page_entry["page"] in window]
+    after = max(window) if window else 0
+    later = [entry["page"] for entry in paged["page_counts"] if entry["page"] > after]
+    paged["next_page_with_matches"] = later[0] if later else None
+    return paged
+
+
+def sync_corpus():
+    """
+    Adds every uploaded document with cached OCR to the corpus index
+    Returns the number of documents newly indexed
+    """
+    added = 0
+    for file_name in sorted(os.listdir(UPLOAD_FOLDER)):
+        pdf_path = os.path.join(UPLOAD_FOLDER, file_name)
+        if not file_name.lower().endswith(".pdf") or not os.path.isfile(pdf_path):
+            continue
+        file_hash = get_file_cache_key(pdf_path, file_name)
+        if CORPUS.has_document(file_hash):
+            continue
+        # Indexing is not a use, it must not make every document look hot
+        cached_data = get_ocr_from_cache(file_hash, record_use=False)
+        if cached_data:
+            CORPUS.add_document(file_hash, file_name, cached_data["pages"], MIN_CONFIDENCE)
+            added += 1
+    return added
+
+
+def search_corpus(search_text, limit):
+    """
+    Ranked search over every indexed document
+    The index picks candidate pages, the regular matcher confirms them
+    Returns (documents, candidate pages matched, whether candidates were
+    cut short by CORPUS_MAX_PAGES per document or CORPUS_MAX_CANDIDATES)
+    """
+    candidates, truncated = CORPUS.candidate_pages(search_text, CORPUS_MAX_PAGES, CORPUS_MAX_CANDIDATES)
+    file_names = CORPUS.documents()
+
+    documents = {}
+    for file_hash, page_num, score in candidates:
+        # Recorded once per returned document below, not once per candidate page
+        cached_data = get_ocr_from_cache(file_hash, record_use=False)
+        if not cached_data:
+            continue
+        ocr_data = cached_data["pages"][page_num]
+        if not ocr_data:
+            continue
+        matches = find_text_in_ocr_data(ocr_data, search_text, page_num)
+        if not matches:
+            continue
+        doc = documents.setdefault(file_hash, {"matches": [], "score": 0.0})
+        doc["matches"].extend(matches)
+        doc["score"] += score * len(matches)
+
+    ranked = sorted(documents.items(), key=lambda item: -item[1]["score"])[:limit]
+    results = []
+    for file_hash, doc in ranked:
+        if OCR_STORE is not None:
+            OCR_STORE.touch(file_hash)
+        pages = build_search_results(doc["matches"], None, search_text, 0, 0, 0, True)
+        results.append({
+            "fileName": file_names.get(file_hash),
+            "file_hash": file_hash,
+            "score": round(doc["score"], 3),
+            "total_matches": pages["total_matches"],
+            "pages_with_matches": pages["pages_with_matches"],
+            "matches": pages["matches"],
+        })
+    return results, len(candidates), truncated
+
+
+# Search Jobs
+# Long searches can run as background jobs that outlive the HTTP request.
+# Structure: {job_id: {"status": str, "completed_pages": int, "total_pages": int,
+#                      "results": dict | None, "error": str | None, "finished_at": float | None, ...}}
+JOBS = {}
+JOBS_LOCK = threading.Lock()
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", 600))
+
+
+def purge_expired_jobs():
+    """Drop finished jobs whose results are older than JOB_RESULT_TTL"""
+    now = time.time()
+    with JOBS_LOCK:
+        expired = [
+            job_id for job_id, job in JOBS.items()
+            if job["finished_at"] is not None and now - job["finished_at"] > JOB_RESULT_TTL
+        ]
+        for job_id in expired:
+            del JOBS[job_id]
+    if expired:
+        print(f"✓ Purged {len(expired)} expired job(s)")
+
+
+def run_search_job(job_id, pdf_path, file_name, search_text, search_mode, priority_pages=()):
+    """Background thread body for a search job"""
+    job = JOBS[job_id]
+    start_time = time.time()
+    try:
+        file_hash = get_file_cache_key(pdf_path, file_name)
+        ocr_start = time.time()
+        ocr_pages, total_pages, from_cache = get_document_ocr(pdf_path, file_hash, job, priority_pages)
+        if job["status"] == "cancelled":
+            print(f"✗ Job {job_id[:8]} cancelled")
+            return
+        job["total_pages"] = total_pages
+        job["completed_pages"] = total_pages
+        ocr_time = 0 if from_cache else time.time() - ocr_start
+
+        search_start = time.time()
+        all_matches, result_cache_hit = search_document(file_hash, ocr_pages, search_text, search_mode)
+        search_time = time.time() - search_start
+
+        total_time = time.time() - start_time
+        job["results"] = build_search_results(
+            all_matches, total_pages, search_text, total_time, ocr_time, search_time, from_cache, result_cache_hit
+        )
+        if job["status"] == "cancelled":
+            return
+        job["status"] = "done"
+        print(f"✓ Job {job_id[:8]} done: {len(all_matches)} matches")
+    except Exception as e:
+        job["status"] = "failed"
+        job["error"] = str(e)
+        print(f"✗ Job {job_id[:8]} failed: {str(e)}")
+    finally:
+        job["finished_at"] = time.time()
+
+
+def start_search_job(pdf_path, file_name, search_text, search_mode="phrase", priority_pages=()):
+    """Register a search job and start it on a background thread"""
+    purge_expired_jobs()
+    job_id = uuid.uuid4().hex
+    with JOBS_LOCK:
+        JOBS[job_id] = {
+            "status": "running",
+            "file_name": file_name,
+            "search_text": search_text,
+            "search_mode": search_mode,
+            "completed_pages": 0,
+            "total_pages": None,
+            "results": None,
+            "error": None,
+            "created_at": time.time(),
+            "finished_at": None,
+            "ocr_run": None,
+        }
+    threading.Thread(
+        target=run_search_job,
+        args=(job_id, pdf_path, file_name, search_text, search_mode, priority_pages),
+        daemon=True,
+    ).start()
+    print(f"✓ Started job {job_id[:8]} for {file_name}")
+    return job_id
+
+
+def cancel_job(job):
+    """
+    Stop a running job: drop its queued pages and, for local runs, kill busy
+    workers so the CPUs are freed right away instead of after the current pages.
+    """
+    job["status"] = "cancelled"
+    run = job["ocr_run"]
+    if run is not None:
+        run.cancel()
+
+
+def job_status(job_id, job):
+    """Public view of a job (never exposes the OCR run or results)"""
+    return {
+        "job_id": job_id,
+        "status": job["status"],
+        "file_name": job["file_name"],
+        "search_query": job["search_text"],
+        "search_mode": job["search_mode"],
+        "completed_pages": job["completed_pages"],
+        "total_pages": job["total_pages"],
+        "error": job["error"],
+    }
+
+
+# Warm start, /health reports ready once it has finished
+WARMUP_STATE = WarmupState()
+
+
+def warm_start():
+    """
+    Loads Tesseract's data and the hottest cached documents in the background
+    Started on boot when run directly, otherwise by the first /health probe
+    """
+    return start_warmup(WARMUP_STATE, [
+        ("ocr_engine", warm_ocr_engine),
+        ("hot_documents", rehydrate_hot_documents),
+    ])
+
+
 # Routes
 
 @app.route("/health", methods=["GET"])
 def health_check():
-    cache_info = {
-        "cached_files": len(OCR_CACHE),
-        "total_cached_pages": sum(data["total_pages"] for data in OCR_CACHE.values())
-    }
+    warm_start()
+    cache_info = cache_stats()
+    ready = WARMUP_STATE.ready.is_set()
     return jsonify({
-        "status": "ok",
+        "status": "ok" if ready else "warming",
+        "ready": ready,
+        "warmup": WARMUP_STATE.as_dict(),
         "tesseract_available": check_tesseract(),
         "cache": cache_info
+    }), 200 if ready else 503
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    cpus, source = available_cpus()
+    return jsonify({
+        "cpus": cpus,
+        "cpu_source": source,
+        "last_cpu_plan": LAST_CPU_PLAN,
+        "ocr_queue": OCR_PAGE_QUEUE.stats(),
     })
 
 
@@ -257,11 +927,14 @@ def upload_complete():
     if not os.path.exists(final_path):
         return jsonify({"error": "File not found"}), 400
 
+    # A re-uploaded file may have changed while keeping its name and size
+    drop_cached_document(get_file_cache_key(final_path, file_name))
     print(f"Upload complete for {file_name}")
     return jsonify({"status": "ok", "fileName": file_name})
 
 
 @app.route("/search", methods=["POST"])
+@profiled(PROFILE_FOLDER)
 def search_pdf():
     file_name = request.form.get("fileName")
     search_text = request.form.get("search_text")
@@ -273,6 +946,21 @@ def search_pdf():
     if not os.path.exists(pdf_path):
         return jsonify({"error": "File not found"}), 400
 
+    try:
+        search_mode = parse_search_mode(request.form.get("search_mode"), search_text)
+        # Checked before any OCR, applied once the page count is known
+        parse_page_window(request.form.get("pages"), None)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Pages the user is looking at (1-based, "1-3,7") are OCRed first
+    priority_pages = parse_page_range(request.form.get("priority_pages"))
+
+    # Run as a background job and let the client poll /jobs/<job_id>
+    if request.form.get("mode") == "job":
+        job_id = start_search_job(pdf_path, file_name, search_text, search_mode, priority_pages)
+        return jsonify({"success": True, "job_id": job_id, "status": "running"}), 202
+
     start_time = time.time()
     
     # Generate file hash for caching
@@ -280,96 +968,170 @@ def search_pdf():
     print(file_hash)
 
     
-    # Check if OCR data is cached
-    cached_data = get_ocr_from_cache(file_hash)
-    
-    if cached_data:
-        # Use cached OCR data
-        ocr_pages = cached_data["pages"]
-        total_pages = cached_data["total_pages"]
+    # Use cached OCR data, or OCR once (shared with concurrent requests)
+    ocr_start = time.time()
+    with stage("ocr"):
+        ocr_pages, total_pages, from_cache = get_document_ocr(pdf_path, file_hash, priority_pages=priority_pages)
+    if from_cache:
         ocr_time = 0
         print(f"✓ Using cached OCR data ({total_pages} pages)")
     else:
-        # Perform OCR (cache miss)
-        print(f"⚡ Performing OCR (not cached)")
-        ocr_start = time.time()
-        
-        pdf_bytes = open(pdf_path, "rb").read()
-        pdf = fitz.open(stream=pdf_bytes, filetype="pdf")
-        total_pages = len(pdf)
-        pdf.close()
-
-        page_data = [(i, pdf_bytes) for i in range(total_pages)]
-        ocr_pages = [None] * total_pages
-
-        MAX_WORKERS = get_optimal_workers(total_pages)
-        print(f"Using {MAX_WORKERS} workers for {total_pages} pages")
-
-        with ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            future_to_page = {executor.submit(process_page_ocr, data): data[0] for data in page_data}
-            for future in as_completed(future_to_page):
-                page_num = future_to_page[future]
-                try:
-                    result_page_num, ocr_data = future.result()
-                    ocr_pages[result_page_num] = ocr_data
-                except Exception as e:
-                    print(f"✗ Error on page {page_num + 1}: {str(e)}")
-
-        # Store in cache
-        store_ocr_in_cache(file_hash, ocr_pages, total_pages)
         ocr_time = time.time() - ocr_start
         print(f"✓ OCR completed in {ocr_time:.2f}s")
 
     # Now perform search on OCR data
     search_start = time.time()
-    all_matches = []
-    
-    for page_num, ocr_data in enumerate(ocr_pages):
-        if ocr_data:
-            matches = find_text_in_ocr_data(ocr_data, search_text, page_num)
-            all_matches.extend(matches)
-            if matches:
-                print(f"✓ Page {page_num + 1} - Found {len(matches)} match(es)")
-
+    try:
+        with stage("search"):
+            all_matches, result_cache_hit = search_document(file_hash, ocr_pages, search_text, search_mode)
+    except PatternError as e:
+        return jsonify({"error": str(e)}), 400
     search_time = time.time() - search_start
 
     # Build response
-    pages_with_matches = {}
-    for match in all_matches:
-        page_num = match["page"]
-        if page_num not in pages_with_matches:
-            pages_with_matches[page_num] = []
-        pages_with_matches[page_num].append(
-            {
-                "left": match["left"],
-                "top": match["top"],
-                "width": match["width"],
-                "height": match["height"],
-                "context": match["context"],
-                "matched_text": match["matched_text"],
-            }
-        )
+    total_time = time.time() - start_time
+    results = build_search_results(
+        all_matches, total_pages, search_text, total_time, ocr_time, search_time, from_cache, result_cache_hit
+    )
+
+    print(f"✓ Search complete: {results['total_matches']} matches in {results['pages_with_matches']} pages")
+    print(f"  Total time: {total_time:.2f}s | Search time: {search_time:.2f}s")
+    # With `pages`, only those pages carry locations (see window_search_results)
+    window = parse_page_window(request.form.get("pages"), total_pages)
+    return make_search_response(window_search_results(results, window))
+
+
+@app.route("/searchable-pdf", methods=["GET"])
+def searchable_pdf():
+    """The upload with an invisible OCR text layer, built from the cache on first request"""
+    file_name = request.args.get("fileName")
+    if not file_name:
+        return jsonify({"error": "Missing fileName"}), 400
+
+    pdf_path = os.path.join(UPLOAD_FOLDER, file_name)
+    if not os.path.exists(pdf_path):
+        return jsonify({"error": "File not found"}), 400
+
+    file_hash = get_file_cache_key(pdf_path, file_name)
+    path = searchable_path(SEARCHABLE_FOLDER, file_hash)
+    if not os.path.exists(path):
+        ocr_pages, total_pages, _ = get_document_ocr(pdf_path, file_hash)
+        pdf_bytes, _ = read_pdf(pdf_path)
+        path = save_searchable_pdf(file_hash, pdf_bytes, list(ocr_pages))
+
+    download_name = f"{os.path.splitext(file_name)[0]}_searchable.pdf"
+    return send_file(path, mimetype="application/pdf", download_name=download_name)
+
+
+@app.route("/context", methods=["POST"])
+def match_context():
+    """
+    Returns the context snippet for a single match, read from the cached
+    OCR of its page. The document must have been searched before.
+    """
+    file_name = request.form.get("fileName")
+    if not file_name:
+        return jsonify({"error": "Missing fileName"}), 400
+
+    pdf_path = os.path.join(UPLOAD_FOLDER, file_name)
+    if not os.path.exists(pdf_path):
+        return jsonify({"error": "File not found"}), 400
+
+    try:
+        page_num, word_index, word_count = parse_context_request(request.form)
+        context = cached_match_context(get_file_cache_key(pdf_path, file_name), page_num, word_index, word_count)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if context is None:
+        return jsonify({"error": "File has not been searched yet"}), 404
+
+    return jsonify({"success": True, "page": page_num + 1, "context": context})
+
+
+@app.route("/profiles/<profile_id>", methods=["GET"])
+def download_profile(profile_id):
+    """A saved request profile: speedscope file, or ?format=stages for the stage timings"""
+    if not profile_authorized():
+        return jsonify({"error": "Profiling token required"}), 403
+    path = profile_path(PROFILE_FOLDER, profile_id, request.args.get("format", "speedscope"))
+    if path is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return send_file(path, mimetype="application/json", as_attachment=True,
+                     download_name=os.path.basename(path))
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    purge_expired_jobs()
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job_status(job_id, job))
+
+
+@app.route("/jobs/<job_id>/results", methods=["GET"])
+def get_job_results(job_id):
+    purge_expired_jobs()
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if job["status"] == "failed":
+        return jsonify({"error": job["error"] or "Search failed"}), 500
+    if job["status"] != "done":
+        return jsonify(job_status(job_id, job)), 409
+    results = job["results"]
+    try:
+        window = parse_page_window(request.args.get("pages"), results["total_pages"])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return make_search_response(window_search_results(results, window))
+
+
+@app.route("/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_job_endpoint(job_id):
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if job["status"] == "running":
+        cancel_job(job)
+        print(f"✓ Cancelled job {job_id[:8]}")
+    return jsonify(job_status(job_id, job))
+
+
+@app.route("/corpus-search", methods=["POST"])
+def corpus_search():
+    """Search every indexed document at once"""
+    search_text = request.form.get("search_text")
+    if not search_text:
+        return jsonify({"error": "Missing search_text"}), 400
+    try:
+        limit = parse_corpus_limit(request.form.get("limit"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
+    start_time = time.time()
+    documents, candidate_pages, truncated = search_corpus(search_text, limit)
     total_time = time.time() - start_time
-    results = {
+
+    print(f"✓ Corpus search: {len(documents)} document(s) from {candidate_pages} candidate page(s)")
+    return jsonify({
         "success": True,
-        "total_matches": len(all_matches),
-        "total_pages": total_pages,
-        "pages_with_matches": len(pages_with_matches),
-        "processing_time": f"{total_time:.2f}s",
-        "ocr_time": f"{ocr_time:.2f}s" if ocr_time > 0 else "0.00s (cached)",
-        "search_time": f"{search_time:.2f}s",
-        "from_cache": cached_data is not None,
         "search_query": search_text,
-        "matches": [
-            {"page": page_num, "occurrences": len(locs), "locations": locs}
-            for page_num, locs in sorted(pages_with_matches.items())
-        ],
-    }
+        "total_documents": len(documents),
+        "total_matches": sum(doc["total_matches"] for doc in documents),
+        "candidate_pages": candidate_pages,
+        "truncated": truncated,
+        "processing_time": f"{total_time:.2f}s",
+        "documents": documents,
+    })
 
-    print(f"✓ Search complete: {len(all_matches)} matches in {len(pages_with_matches)} pages")
-    print(f"  Total time: {total_time:.2f}s | Search time: {search_time:.2f}s")
-    return jsonify(results)
+
+@app.route("/corpus/reindex", methods=["POST"])
+def corpus_reindex():
+    """Index cached documents in UPLOAD_FOLDER that the corpus does not know yet"""
+    added = sync_corpus()
+    print(f"✓ Corpus reindex added {added} document(s)")
+    return jsonify({"success": True, "added_documents": added, "total_documents": len(CORPUS.documents())})
 
 
 @app.route("/clear-cache", methods=["POST"])
@@ -403,4 +1165,8 @@ if __name__ == "__main__":
     print("Server starting on http://localhost:8000")
     print("=" * 60 + "\n")
 
+    # The debug reloader runs this block twice, only warm the serving process
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        warm_start()
+
     app.run(debug=True, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,420 @@
+"""
+Image PDF Text Search Backend - ASYNC SERVING MODE
+Serves the upload, /search, /context, /searchable-pdf, /clear-cache, /health and
+/metrics endpoints of app3.py through Quart on an ASGI server so that long
+OCR searches do not hold a thread. Background jobs, /corpus-search and
+/profiles are only served by app3.py. Page OCR runs in one long-lived process
+pool shared by all requests; handlers await its futures.
+
+Run with:  hypercorn app_async:app --bind 0.0.0.0:8000
+"""
+
+import asyncio
+import os
+import time
+
+import pytesseract
+from quart import Quart, Response, request, jsonify, send_file
+from quart_cors import cors
+
+from app3 import (
+    UPLOAD_FOLDER,
+    MAX_WORKERS,
+    MIN_CONFIDENCE,
+    PAGE_OCR_INDEX,
+    get_file_cache_key,
+    get_ocr_from_cache,
+    store_ocr_in_cache,
+    clear_cache,
+    cache_stats,
+    read_pdf,
+    search_document,
+    build_search_results,
+    parse_search_mode,
+    parse_page_window,
+    window_search_results,
+    rehydrate_hot_documents,
+    SEARCHABLE_FOLDER,
+    load_text_layer,
+    save_searchable_pdf,
+    drop_cached_document,
+    parse_context_request,
+    cached_match_context,
+)
+from ocr_page import OCR_DPI, check_tesseract, process_page_ocr
+from response_format import encode_search_results
+from page_dedup import plan_document, finish_document
+from searchable_pdf import SEARCHABLE_PDF, searchable_path
+from pattern_search import PatternError
+from warmup import WarmupState, start_warmup, warm_pool
+from worker_pool import RecyclingPool
+from cpu_budget import limit_ocr_threads, plan_ocr_workers
+from scheduler import BACKGROUND, INTERACTIVE, SEARCH, PageScheduler, parse_page_range
+
+UPLOAD_BUFFER_SIZE = 1024 * 1024
+# OCR each upload at background priority so its first search is served from cache
+PREFETCH_UPLOADS = os.getenv("PREFETCH_UPLOADS", "on") != "off"
+
+# Quart App
+app = Quart(__name__)
+app = cors(app, allow_origin=["http://localhost:3000"], allow_credentials=True)
+
+# Shared by every request, created when the server starts; pages reach the
+# pool through SCHEDULER so visible pages and small users are not stuck
+# behind one large document
+OCR_POOL = None
+SCHEDULER = None
+# The pool serves pages of many searches at once, so plan for MAX_WORKERS
+# concurrent pages; spare CPUs become Tesseract threads
+POOL_PLAN = plan_ocr_workers(MAX_WORKERS, MAX_WORKERS)
+POOL_SIZE = POOL_PLAN["processes"]
+
+# Warm start, /health reports ready once the pool and hot documents are loaded
+WARMUP_STATE = WarmupState()
+
+# In-flight OCR runs keyed by file hash, shared by concurrent cache misses
+INFLIGHT_OCR = {}
+
+# Counters reported by /metrics
+METRICS = {
+    "active_searches": 0,
+    "queued_pages": 0,
+    "completed_pages": 0,
+    "failed_pages": 0,
+    "coalesced_searches": 0,
+}
+
+
+@app.before_serving
+async def start_pool():
+    global OCR_POOL, SCHEDULER
+    OCR_POOL = RecyclingPool(
+        max_workers=POOL_SIZE, initializer=limit_ocr_threads, initargs=(POOL_PLAN["threads"],)
+    )
+    SCHEDULER = PageScheduler(OCR_POOL, POOL_SIZE)
+    print(f"✓ OCR pool started with {POOL_SIZE} workers x {POOL_PLAN['threads']} Tesseract threads")
+    start_warmup(WARMUP_STATE, [
+        ("worker_pool", lambda: warm_pool(OCR_POOL, POOL_SIZE)),
+        ("hot_documents", rehydrate_hot_documents),
+    ])
+
+
+@app.after_serving
+async def stop_pool():
+    OCR_POOL.shutdown(wait=False, cancel_futures=True)
+    print("✓ OCR pool stopped")
+
+
+async def ocr_page_async(page_num, pdf_bytes, file_hash, user, priority=SEARCH):
+    """Run one page through the scheduler and shared pool without blocking the event loop"""
+    METRICS["queued_pages"] += 1
+    try:
+        result_page_num, ocr_data = await SCHEDULER.submit(
+            priority, user, file_hash, page_num, process_page_ocr, (page_num, pdf_bytes)
+        )
+        METRICS["completed_pages"] += 1
+        return result_page_num, ocr_data
+    except Exception as e:
+        METRICS["failed_pages"] += 1
+        print(f"✗ Error on page {page_num + 1}: {str(e)}")
+        return page_num, None
+    finally:
+        METRICS["queued_pages"] -= 1
+
+
+async def ocr_document_async(pdf_bytes, total_pages, file_hash, user, priority_pages=(), priority=SEARCH):
+    """
+    OCR every page concurrently on the shared pool, skipping blank and duplicate pages
+    priority_pages (0-based) are scheduled as interactive, the rest at priority
+    """
+    plan = await asyncio.to_thread(plan_document, pdf_bytes, PAGE_OCR_INDEX)
+    results = await asyncio.gather(*(
+        ocr_page_async(i, pdf_bytes, file_hash, user, INTERACTIVE if i in priority_pages else priority)
+        for i in plan["to_ocr"]
+    ))
+    ocr_pages = [None] * total_pages
+    for page_num, ocr_data in results:
+        ocr_pages[page_num] = ocr_data
+    return finish_document(ocr_pages, plan, PAGE_OCR_INDEX)
+
+
+async def get_document_ocr_async(pdf_path, file_hash, user, priority_pages=(), priority=SEARCH):
+    """
+    Returns (ocr_pages, total_pages, from_cache) for a document.
+    Concurrent cache misses await the same OCR task instead of starting their own,
+    after moving their priority pages, and any pages queued at a lower
+    priority (a background prefetch), up the queue.
+    """
+    cached_data = await asyncio.to_thread(get_ocr_from_cache, file_hash)
+    if cached_data:
+        return cached_data["pages"], cached_data["total_pages"], True
+
+    task = INFLIGHT_OCR.get(file_hash)
+    if task is not None:
+        METRICS["coalesced_searches"] += 1
+        print(f"⏳ Waiting for in-flight OCR of {file_hash[:8]}...")
+        SCHEDULER.promote(file_hash, priority_pages)
+        SCHEDULER.promote(file_hash, None, priority)
+        ocr_pages, total_pages = await asyncio.shield(task)
+        return ocr_pages, total_pages, False
+
+    async def run_ocr():
+        pdf_bytes, total_pages = await asyncio.to_thread(read_pdf, pdf_path)
+        ocr_pages = await asyncio.to_thread(load_text_layer, file_hash, total_pages)
+        if ocr_pages is None:
+            ocr_pages = await ocr_document_async(
+                pdf_bytes, total_pages, file_hash, user, priority_pages, priority
+            )
+            if SEARCHABLE_PDF:
+                await asyncio.to_thread(save_searchable_pdf, file_hash, pdf_bytes, ocr_pages)
+        await asyncio.to_thread(store_ocr_in_cache, file_hash, ocr_pages, total_pages, os.path.basename(pdf_path))
+        return ocr_pages, total_pages
+
+    task = asyncio.ensure_future(run_ocr())
+    INFLIGHT_OCR[file_hash] = task
+    task.add_done_callback(lambda _: INFLIGHT_OCR.pop(file_hash, None))
+    ocr_pages, total_pages = await asyncio.shield(task)
+    return ocr_pages, total_pages, False
+
+
+async def prefetch_document(pdf_path, file_hash, user):
+    """OCRs a document at background priority, searches arriving meanwhile promote its pages"""
+    try:
+        await get_document_ocr_async(pdf_path, file_hash, user, priority=BACKGROUND)
+    except Exception as e:
+        print(f"✗ Prefetch of {os.path.basename(pdf_path)} failed: {str(e)}")
+
+
+def make_search_response(results):
+    """Quart counterpart of response_format.make_search_response"""
+    encoded = encode_search_results(
+        results, request.accept_mimetypes, request.headers.get("Accept-Encoding", "")
+    )
+    if encoded is None:
+        response = jsonify(results)
+    else:
+        body, mimetype, headers = encoded
+        response = Response(body, mimetype=mimetype, headers=headers)
+
+    response.headers["Vary"] = "Accept, Accept-Encoding"
+    return response
+
+
+def write_chunk(temp_path, mode, stream):
+    """Copy an uploaded chunk to disk in fixed-size blocks"""
+    with open(temp_path, mode) as f:
+        while True:
+            block = stream.read(UPLOAD_BUFFER_SIZE)
+            if not block:
+                break
+            f.write(block)
+
+
+# Routes
+
+@app.route("/health", methods=["GET"])
+async def health_check():
+    cache_info = await asyncio.to_thread(cache_stats)
+    ready = WARMUP_STATE.ready.is_set()
+    return jsonify({
+        "status": "ok" if ready else "warming",
+        "ready": ready,
+        "warmup": WARMUP_STATE.as_dict(),
+        "tesseract_available": await asyncio.to_thread(check_tesseract),
+        "cache": cache_info
+    }), 200 if ready else 503
+
+
+@app.route("/metrics", methods=["GET"])
+async def metrics():
+    return jsonify({
+        "pool_workers": POOL_SIZE,
+        "cpu_plan": POOL_PLAN,
+        "scheduler": SCHEDULER.stats(),
+        "pool": OCR_POOL.stats,
+        **METRICS,
+    })
+
+
+@app.route("/upload-chunk", methods=["POST"])
+async def upload_chunk():
+    form = await request.form
+    files = await request.files
+    chunk = files.get("chunk")
+    index = form.get("index")
+    file_name = form.get("fileName")
+    total = form.get("total")
+
+    if not chunk or not index or not file_name or not total:
+        return jsonify({"error": "Missing chunk, index, total, or fileName"}), 400
+
+    index = int(index)
+    total = int(total)
+    temp_path = os.path.join(UPLOAD_FOLDER, file_name)
+
+    mode = "ab" if os.path.exists(temp_path) else "wb"
+    await asyncio.to_thread(write_chunk, temp_path, mode, chunk.stream)
+
+    print(f"Uploaded chunk {index + 1}/{total} for {file_name}")
+    return jsonify({"status": "ok"})
+
+
+@app.route("/upload-complete", methods=["POST"])
+async def upload_complete():
+    form = await request.form
+    file_name = form.get("fileName")
+    if not file_name:
+        return jsonify({"error": "Missing fileName"}), 400
+
+    final_path = os.path.join(UPLOAD_FOLDER, file_name)
+    if not os.path.exists(final_path):
+        return jsonify({"error": "File not found"}), 400
+
+    # A re-uploaded file may have changed while keeping its name and size
+    file_hash = get_file_cache_key(final_path, file_name)
+    await asyncio.to_thread(drop_cached_document, file_hash)
+    if PREFETCH_UPLOADS:
+        user = request.headers.get("X-User-Id") or request.remote_addr
+        asyncio.ensure_future(prefetch_document(final_path, file_hash, user))
+    print(f"Upload complete for {file_name}")
+    return jsonify({"status": "ok", "fileName": file_name})
+
+
+@app.route("/search", methods=["POST"])
+async def search_pdf():
+    form = await request.form
+    file_name = form.get("fileName")
+    search_text = form.get("search_text")
+
+    if not file_name or not search_text:
+        return jsonify({"error": "Missing fileName or search_text"}), 400
+
+    pdf_path = os.path.join(UPLOAD_FOLDER, file_name)
+    if not os.path.exists(pdf_path):
+        return jsonify({"error": "File not found"}), 400
+
+    try:
+        search_mode = parse_search_mode(form.get("search_mode"), search_text)
+        # Checked before any OCR, applied once the page count is known
+        parse_page_window(form.get("pages"), None)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Pages the user is looking at (1-based, "1-3,7") are OCRed first; users
+    # are told apart by X-User-Id, falling back to the client address
+    priority_pages = parse_page_range(form.get("priority_pages"))
+    user = request.headers.get("X-User-Id") or request.remote_addr
+
+    start_time = time.time()
+    METRICS["active_searches"] += 1
+    try:
+        file_hash = get_file_cache_key(pdf_path, file_name)
+        ocr_start = time.time()
+        ocr_pages, total_pages, from_cache = await get_document_ocr_async(pdf_path, file_hash, user, priority_pages)
+        ocr_time = 0 if from_cache else time.time() - ocr_start
+        if not from_cache:
+            print(f"✓ OCR completed in {ocr_time:.2f}s")
+
+        search_start = time.time()
+        try:
+            all_matches, result_cache_hit = await asyncio.to_thread(
+                search_document, file_hash, ocr_pages, search_text, search_mode
+            )
+        except PatternError as e:
+            return jsonify({"error": str(e)}), 400
+        search_time = time.time() - search_start
+    finally:
+        METRICS["active_searches"] -= 1
+
+    total_time = time.time() - start_time
+    results = build_search_results(
+        all_matches, total_pages, search_text, total_time, ocr_time, search_time, from_cache, result_cache_hit
+    )
+
+    print(f"✓ Search complete: {results['total_matches']} matches in {results['pages_with_matches']} pages")
+    window = parse_page_window(form.get("pages"), total_pages)
+    return make_search_response(window_search_results(results, window))
+
+
+@app.route("/searchable-pdf", methods=["GET"])
+async def searchable_pdf():
+    """The upload with an invisible OCR text layer, built from the cache on first request"""
+    file_name = request.args.get("fileName")
+    if not file_name:
+        return jsonify({"error": "Missing fileName"}), 400
+
+    pdf_path = os.path.join(UPLOAD_FOLDER, file_name)
+    if not os.path.exists(pdf_path):
+        return jsonify({"error": "File not found"}), 400
+
+    file_hash = get_file_cache_key(pdf_path, file_name)
+    path = searchable_path(SEARCHABLE_FOLDER, file_hash)
+    if not os.path.exists(path):
+        user = request.headers.get("X-User-Id") or request.remote_addr
+        ocr_pages, _, _ = await get_document_ocr_async(pdf_path, file_hash, user)
+        pdf_bytes, _ = await asyncio.to_thread(read_pdf, pdf_path)
+        path = await asyncio.to_thread(save_searchable_pdf, file_hash, pdf_bytes, list(ocr_pages))
+
+    response = await send_file(path, mimetype="application/pdf")
+    download_name = f"{os.path.splitext(file_name)[0]}_searchable.pdf"
+    response.headers["Content-Disposition"] = f'inline; filename="{download_name}"'
+    return response
+
+
+@app.route("/context", methods=["POST"])
+async def match_context():
+    """Context snippet for a single match, read from the cached OCR of its page"""
+    form = await request.form
+    file_name = form.get("fileName")
+    if not file_name:
+        return jsonify({"error": "Missing fileName"}), 400
+
+    pdf_path = os.path.join(UPLOAD_FOLDER, file_name)
+    if not os.path.exists(pdf_path):
+        return jsonify({"error": "File not found"}), 400
+
+    try:
+        page_num, word_index, word_count = parse_context_request(form)
+        context = await asyncio.to_thread(
+            cached_match_context, get_file_cache_key(pdf_path, file_name), page_num, word_index, word_count
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if context is None:
+        return jsonify({"error": "File has not been searched yet"}), 404
+
+    return jsonify({"success": True, "page": page_num + 1, "context": context})
+
+
+@app.route("/clear-cache", methods=["POST"])
+async def clear_cache_endpoint():
+    """Clear the OCR cache to free memory"""
+    count = clear_cache()
+    print(f"✓ Cleared cache ({count} files)")
+    return jsonify({
+        "success": True,
+        "cleared_files": count,
+        "message": f"Cache cleared ({count} files removed)"
+    })
+
+
+# Main
+if __name__ == "__main__":
+    print("\n" + "=" * 60)
+    print("PDF Text Search Backend Server (ASYNC MODE)")
+    print("=" * 60)
+
+    if check_tesseract():
+        version = pytesseract.get_tesseract_version()
+        print(f"✓ Tesseract OCR installed: {version}")
+    else:
+        print("✗ Tesseract OCR not found. Install it before running.")
+        exit(1)
+
+    print(f"OCR DPI: {OCR_DPI}")
+    print(f"Min Confidence: {MIN_CONFIDENCE}%")
+    print(f"OCR pool workers: {POOL_SIZE}")
+    print("Server starting on http://localhost:8000")
+    print("=" * 60 + "\n")
+
+    app.run(host="0.0.0.0", port=8000)
@@ -0,0 +1,76 @@
+"""
+Benchmark OCR time per page with and without preprocessing
+
+Usage:  python bench_preprocess.py path/to/scanned.pdf [max_pages]
+
+For every page it renders once, then times Tesseract on the raw grayscale
+render and on the preprocessed image (preprocessing time included), and
+prints the words kept above MIN_CONFIDENCE for each.
+"""
+
+import sys
+import time
+
+import fitz  # PyMuPDF
+import pytesseract
+from PIL import Image
+
+from preprocess import preprocess_page, PREPROCESS_STEPS
+
+OCR_DPI = 300
+MIN_CONFIDENCE = 15
+TESSERACT_CONFIG = '--psm 3 --oem 3'
+
+
+def confident_words(ocr_data):
+    return sum(
+        1 for text, conf in zip(ocr_data["text"], ocr_data["conf"])
+        if int(conf) > MIN_CONFIDENCE and text.strip()
+    )
+
+
+def time_ocr(img):
+    start = time.time()
+    ocr_data = pytesseract.image_to_data(img, lang='eng', config=TESSERACT_CONFIG, output_type=pytesseract.Output.DICT)
+    return time.time() - start, confident_words(ocr_data)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    pdf = fitz.open(sys.argv[1])
+    max_pages = int(sys.argv[2]) if len(sys.argv) > 2 else len(pdf)
+    print(f"Preprocessing steps: {', '.join(sorted(PREPROCESS_STEPS)) or 'off'}")
+    print(f"{'page':>5} {'raw s':>8} {'raw words':>10} {'prep s':>8} {'prep words':>11} {'skew':>6}  note")
+
+    raw_total = prep_total = 0.0
+    for page_num in range(min(max_pages, len(pdf))):
+        pix = pdf[page_num].get_pixmap(dpi=OCR_DPI)
+        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples).convert('L')
+
+        raw_time, raw_words = time_ocr(img)
+
+        start = time.time()
+        prepped, info = preprocess_page(img, OCR_DPI)
+        if prepped is None:
+            prep_time, prep_words, note = time.time() - start, 0, "blank, OCR skipped"
+        else:
+            _, prep_words = time_ocr(prepped)
+            prep_time, note = time.time() - start, ""
+
+        raw_total += raw_time
+        prep_total += prep_time
+        print(f"{page_num + 1:>5} {raw_time:>8.2f} {raw_words:>10} {prep_time:>8.2f} {prep_words:>11} {info['skew']:>6.2f}  {note}")
+
+    pages = min(max_pages, len(pdf))
+    pdf.close()
+    if pages:
+        saved = raw_total - prep_total
+        print(f"\nRaw: {raw_total:.2f}s | Preprocessed: {prep_total:.2f}s | "
+              f"Saved: {saved:.2f}s ({saved / pages:.2f}s/page, {100 * saved / max(raw_total, 1e-9):.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""
+Inverted index over every cached document, for cross-document search
+
+Postings live in SQLite next to the OCR store:
+
+    corpus_docs(file_hash, file_name, total_pages)
+    vocab(token, length)                    distinct normalized OCR words,
+                                            only those some posting uses
+    vocab_grams(gram, token)                the distinct bigrams of each token
+    postings(token, file_hash, page_num, tf)
+
+A query word matches every vocabulary token the matcher would accept
+(RapidFuzz ratio >= FUZZY_THRESHOLD), so the index prunes pages without
+losing fuzzy hits. An edit removes at most two of a word's distinct
+bigrams, so a token within the edit budget shares at least
+min_shared_grams() bigrams with the query word; vocab_grams finds those
+tokens without scoring the whole vocabulary. Candidate pages are ranked
+and capped per document in one SQL query. Only the candidate pages are then run through the real
+matcher to produce highlight locations. Pruning is per OCR word, so hits
+that only the aligned matcher finds across split or merged words (see
+phrase_matcher.py) are not candidates here.
+
+Pattern searches (pattern_search.py) use the postings of one document to
+find the pages whose tokens contain the literal pieces of a pattern.
+"""
+
+import math
+import sqlite3
+import threading
+from collections import Counter
+
+from rapidfuzz import fuzz, process
+
+from text_normalize import normalize_text, page_norms
+
+FUZZY_THRESHOLD = 80
+
+
+def bigrams(token):
+    return {token[i:i + 2] for i in range(len(token) - 1)}
+
+
+def min_shared_grams(word, length):
+    """
+    Fewest distinct bigrams of word a token of this length shares with it
+    when their ratio reaches FUZZY_THRESHOLD (ratio = 1 - indel edits / total length)
+    Deleting a character of word breaks at most two of its bigrams, inserting one
+    breaks at most one, and the length difference fixes how the edits split.
+    """
+    max_edits = (100 - FUZZY_THRESHOLD) * (len(word) + length) // 100
+    deletions = max(0, (max_edits + len(word) - length) // 2)
+    insertions = deletions + length - len(word)
+    return len(bigrams(word)) - 2 * deletions - insertions
+
+
+def page_tokens(ocr_data, min_confidence):
+    """Normalized confident words of a page, as the matcher sees them"""
+    tokens = []
+    for norm, conf in zip(page_norms(ocr_data), ocr_data["conf"]):
+        if int(float(conf)) > min_confidence and norm:
+            tokens.append(norm)
+    return tokens
+
+
+def length_bounds(length):
+    """Token lengths that can reach FUZZY_THRESHOLD against a word of this length"""
+    # ratio = 2 * common / (a + b) and common <= min(a, b); integer maths, so
+    # bounds that are whole numbers are not lost to float rounding
+    return -(-length * FUZZY_THRESHOLD // (200 - FUZZY_THRESHOLD)), length * (200 - FUZZY_THRESHOLD) // FUZZY_THRESHOLD
+
+
+def document_tokens(conn, file_hash):
+    """Distinct tokens in one document's postings"""
+    return [row[0] for row in conn.execute(
+        "SELECT DISTINCT token FROM postings WHERE file_hash = ?", (file_hash,)
+    )]
+
+
+def add_vocab(conn, tokens):
+    conn.executemany(
+        "INSERT OR IGNORE INTO vocab (token, length) VALUES (?, ?)", ((token, len(token)) for token in tokens)
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO vocab_grams (gram, token) VALUES (?, ?)",
+        ((gram, token) for token in tokens for gram in bigrams(token)),
+    )
+
+
+def prune_vocab(conn, tokens):
+    """Drops the given tokens from vocab once no posting uses them"""
+    conn.executemany(
+        "DELETE FROM vocab WHERE token = ? AND NOT EXISTS (SELECT 1 FROM postings WHERE token = ?)",
+        ((token, token) for token in tokens),
+    )
+    conn.executemany(
+        "DELETE FROM vocab_grams WHERE token = ? AND NOT EXISTS (SELECT 1 FROM vocab WHERE token = ?)",
+        ((token, token) for token in tokens),
+    )
+
+
+class CorpusIndex:
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        with self.connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS corpus_docs (
+                    file_hash TEXT PRIMARY KEY,
+                    file_name TEXT NOT NULL,
+                    total_pages INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS vocab (
+                    token TEXT PRIMARY KEY,
+                    length INTEGER NOT NULL
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS vocab_length ON vocab (length);
+                CREATE TABLE IF NOT EXISTS vocab_grams (
+                    gram TEXT NOT NULL,
+                    token TEXT NOT NULL,
+                    PRIMARY KEY (gram, token)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS vocab_grams_token ON vocab_grams (token);
+                CREATE TABLE IF NOT EXISTS postings (
+                    token TEXT NOT NULL,
+                    file_hash TEXT NOT NULL,
+                    page_num INTEGER NOT NULL,
+                    tf INTEGER NOT NULL,
+                    PRIMARY KEY (token, file_hash, page_num)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS postings_doc ON postings (file_hash);
+            """)
+            # Indexes built before vocab_grams existed
+            if conn.execute("SELECT 1 FROM vocab_grams LIMIT 1").fetchone() is None:
+                add_vocab(conn, [row[0] for row in conn.execute("SELECT token FROM vocab")])
+
+    def connect(self):
+        """One connection per thread; sqlite3 connections must not be shared"""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.create_function("ln", 1, math.log)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def has_document(self, file_hash):
+        return self.connect().execute(
+            "SELECT 1 FROM corpus_docs WHERE file_hash = ?", (file_hash,)
+        ).fetchone() is not None
+
+    def add_document(self, file_hash, file_name, ocr_pages, min_confidence):
+        """(Re)indexes one document's pages"""
+        rows = []
+        for page_num, ocr_data in enumerate(ocr_pages):
+            if ocr_data:
+                for token, tf in Counter(page_tokens(ocr_data, min_confidence)).items():
+                    rows.append((token, file_hash, page_num, tf))
+
+        conn = self.connect()
+        with conn:
+            old_tokens = document_tokens(conn, file_hash)
+            conn.execute("DELETE FROM postings WHERE file_hash = ?", (file_hash,))
+            add_vocab(conn, {row[0] for row in rows})
+            conn.executemany(
+                "INSERT INTO postings (token, file_hash, page_num, tf) VALUES (?, ?, ?, ?)", rows
+            )
+            prune_vocab(conn, old_tokens)
+            conn.execute(
+                "INSERT OR REPLACE INTO corpus_docs (file_hash, file_name, total_pages) VALUES (?, ?, ?)",
+                (file_hash, file_name, len(ocr_pages)),
+            )
+        print(f"✓ Corpus indexed {file_name} ({len(ocr_pages)} pages, {len(rows)} postings)")
+
+    def remove_document(self, file_hash):
+        conn = self.connect()
+        with conn:
+            old_tokens = document_tokens(conn, file_hash)
+            conn.execute("DELETE FROM postings WHERE file_hash = ?", (file_hash,))
+            conn.execute("DELETE FROM corpus_docs WHERE file_hash = ?", (file_hash,))
+            prune_vocab(conn, old_tokens)
+
+    def clear(self):
+        conn = self.connect()
+        with conn:
+            conn.execute("DELETE FROM postings")
+            conn.execute("DELETE FROM vocab")
+            conn.execute("DELETE FROM vocab_grams")
+            conn.execute("DELETE FROM corpus_docs")
+
+    def documents(self):
+        """{file_hash: file_name} for every indexed document"""
+        return dict(self.connect().execute("SELECT file_hash, file_name FROM corpus_docs"))
+
+    def similar_tokens(self, word):
+        """Vocabulary tokens the matcher would accept for this query word"""
+        low, high = length_bounds(len(word))
+        # Lengths where a token may share no bigram with the word are scanned whole
+        scanned = [length for length in range(low, high + 1) if min_shared_grams(word, length) <= 0]
+        conn = self.connect()
+        vocab = [row[0] for row in conn.execute(
+            f"SELECT token FROM vocab WHERE length IN ({','.join('?' * len(scanned))})", scanned
+        )] if scanned else []
+        grams = sorted(bigrams(word))
+        if len(scanned) < high - low + 1 and grams:
+            rows = conn.execute(
+                f"SELECT g.token, v.length, COUNT(*) FROM vocab_grams g JOIN vocab v ON v.token = g.token "
+                f"WHERE g.gram IN ({','.join('?' * len(grams))}) AND v.length BETWEEN ? AND ? "
+                f"GROUP BY g.token",
+                (*grams, low, high),
+            )
+            vocab.extend(
+                token for token, length, shared in rows
+                if length not in scanned and shared >= min_shared_grams(word, length)
+            )
+        return [
+            token for token, _, _ in
+            process.extract(word, vocab, scorer=fuzz.ratio, score_cutoff=FUZZY_THRESHOLD, limit=None)
+        ]
+
+    def candidate_pages(self, search_text, per_document, limit):
+        """
+        Pages that contain a fuzzy match for every query word, scored by tf-idf
+        Returns ([(file_hash, page_num, score)] best first, truncated): at most
+        per_document pages of each document and limit pages in all;
+        truncated is set when either cap left pages out
+        """
+        words = list(dict.fromkeys(normalize_text(search_text).split()))
+        if not words:
+            return [], False
+
+        query = []
+        for word in words:
+            tokens = self.similar_tokens(word)
+            if not tokens:
+                return [], False
+            query.extend((token, word) for token in tokens)
+
+        conn = self.connect()
+        total_docs = conn.execute("SELECT COUNT(*) FROM corpus_docs").fetchone()[0] or 1
+        rows = conn.execute(f"""
+            WITH query (token, word) AS (VALUES {",".join(["(?, ?)"] * len(query))}),
+            hits AS (
+                SELECT query.word, postings.file_hash, postings.page_num, postings.tf
+                FROM query JOIN postings ON postings.token = query.token
+            ),
+            idf AS (
+                SELECT word, ln(1 + ? / COUNT(DISTINCT file_hash)) AS idf FROM hits GROUP BY word
+            ),
+            pages AS (
+                SELECT file_hash, page_num, SUM((1 + ln(tf)) * idf) AS score
+                FROM hits JOIN idf USING (word)
+                GROUP BY file_hash, page_num
+                HAVING COUNT(DISTINCT word) = ?
+            ),
+            ranked AS (
+                SELECT file_hash, page_num, score,
+                       ROW_NUMBER() OVER (PARTITION BY file_hash ORDER BY score DESC, page_num) AS doc_rank,
+                       COUNT(*) OVER (PARTITION BY file_hash) AS doc_pages
+                FROM pages
+            )
+            SELECT file_hash, page_num, score, doc_pages FROM ranked
+            WHERE doc_rank <= ?
+            ORDER BY score DESC, file_hash, page_num
+            LIMIT ?
+        """, (*(value for row in query for value in row), float(total_docs), len(words), per_document, limit + 1)
+        ).fetchall()
+
+        truncated = len(rows) > limit or any(doc_pages > per_document for _, _, _, doc_pages in rows)
+        return [(file_hash, page_num, score) for file_hash, page_num, score, _ in rows[:limit]], truncated
+
+    def pages_containing(self, file_hash, pieces):
+        """Pages of one document where every piece is a substring of some normalized token"""
+        conn = self.connect()
+        pages = None
+        for piece in pieces:
+            found = {row[0] for row in conn.execute(
+                "SELECT DISTINCT page_num FROM postings WHERE file_hash = ? AND instr(token, ?) > 0",
+                (file_hash, piece),
+            )}
+            pages = found if pages is None else pages & found
+            if not pages:
+                return set()
+        return pages
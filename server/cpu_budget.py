@@ -0,0 +1,85 @@
+"""
+CPU budget for OCR: processes x Tesseract threads
+
+Tesseract parallelizes with OpenMP, by default over every core it sees, and
+every OCR worker process runs its own Tesseract. Without a limit N workers
+start N x cores threads and spend their time context switching. The budget
+splits the CPUs actually available to this container (cgroup quota and CPU
+affinity, not os.cpu_count()) between processes and threads per process:
+
+  - processes: one per page, up to one per CPU, since page-level
+    parallelism scales better than Tesseract's own; fewer when max_workers
+    or RAM (WORKER_RAM_GB per worker) allow fewer
+  - threads: whatever CPUs those processes leave over are shared out as
+    OpenMP threads (at most MAX_OCR_THREADS, beyond which Tesseract stops
+    getting faster), whether the cap came from few pages, max_workers or RAM
+
+Workers apply their thread count through OMP_THREAD_LIMIT, which the
+tesseract subprocesses inherit (limit_ocr_threads as pool initializer).
+"""
+
+import math
+import os
+
+import psutil
+
+MAX_OCR_THREADS = int(os.getenv("MAX_OCR_THREADS", 4))
+WORKER_RAM_GB = 0.5
+
+
+def cgroup_cpu_limit():
+    """CPUs allowed by the cgroup CPU quota, or None when unlimited"""
+    try:
+        # cgroup v2: "max 100000" or "<quota> <period>"
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        # cgroup v1
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def available_cpus():
+    """Returns (cpus, what limited them)"""
+    try:
+        cpus, source = len(os.sched_getaffinity(0)), "affinity"
+    except AttributeError:
+        cpus, source = os.cpu_count() or 1, "cpu_count"
+    quota = cgroup_cpu_limit()
+    if quota is not None and quota < cpus:
+        cpus, source = max(1, math.floor(quota)), "cgroup quota"
+    return cpus, source
+
+
+def plan_ocr_workers(pages, max_workers):
+    """
+    Processes and threads per process for OCRing `pages` pages at once
+    Returns {"processes", "threads", "cpus", "cpu_source", "pages"}
+    """
+    cpus, source = available_cpus()
+    # Leave one CPU for the web server when there is more than one
+    budget = max(1, cpus - 1) if cpus > 2 else cpus
+    total_ram_gb = psutil.virtual_memory().total / (1024 ** 3)
+    max_by_ram = max(1, int(total_ram_gb // WORKER_RAM_GB))
+
+    processes = max(1, min(budget, max_workers, max_by_ram, max(1, pages)))
+    threads = max(1, min(MAX_OCR_THREADS, budget // processes))
+
+    return {"processes": processes, "threads": threads, "cpus": cpus, "cpu_source": source, "pages": pages}
+
+
+def limit_ocr_threads(threads):
+    """Process pool initializer: caps OpenMP threads of every Tesseract this worker runs"""
+    os.environ["OMP_THREAD_LIMIT"] = str(threads)
@@ -0,0 +1,317 @@
+"""
+Bulk OCR ingestion for directories of PDFs
+
+Usage:  python ingest.py PATH [PATH ...] [--workers N] [--replace]
+
+PATH is a PDF, a directory (searched recursively for *.pdf) or @list.txt
+with one path per line. Each document is copied into the upload folder and
+its OCR stored in the server's cache (SQLite store or index file, plus the
+corpus index), exactly as a /search would, so the server answers searches
+on it from cache right away.
+
+One process pool OCRs pages of several documents at once: rendering and
+Tesseract run in the workers (process_page_ocr), while this process plans
+the next documents and writes finished ones to the cache (and, with
+SEARCHABLE_PDF=on, their searchable PDFs). Every OCRed page
+is also appended to a journal, so an interrupted run picks up where it
+stopped; documents already in the cache are skipped.
+
+A page that keeps crashing its worker fails its document only: the rest
+of that document is not OCRed or cached, its journal is kept, and the run
+goes on with the next documents.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from app3 import (
+    UPLOAD_FOLDER,
+    PAGE_OCR_INDEX,
+    get_file_cache_key,
+    get_ocr_from_cache,
+    store_ocr_in_cache,
+    read_pdf,
+    load_text_layer,
+    save_searchable_pdf,
+    drop_cached_document,
+)
+from ocr_page import process_page_ocr
+from page_dedup import plan_document, finish_document
+from searchable_pdf import SEARCHABLE_PDF
+from worker_pool import RecyclingPool
+from cpu_budget import available_cpus, limit_ocr_threads, plan_ocr_workers
+
+JOURNAL_FOLDER = os.path.join(UPLOAD_FOLDER, "ingest_journal")
+
+
+def find_pdfs(paths):
+    """Expands files, directories and @list files into PDF paths, in order"""
+    for path in paths:
+        if path.startswith("@"):
+            with open(path[1:], encoding="utf-8") as f:
+                yield from find_pdfs([line.strip() for line in f if line.strip()])
+        elif os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(".pdf"):
+                        yield os.path.join(root, name)
+        elif path.lower().endswith(".pdf") and os.path.isfile(path):
+            yield path
+        else:
+            print(f"✗ Skipping {path}: not a PDF or directory")
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def same_content(path, dest):
+    """Whether dest holds the same bytes as path, hashing only when size and mtime cannot tell"""
+    source, target = os.stat(path), os.stat(dest)
+    if source.st_size != target.st_size:
+        return False
+    # copy2 keeps the modification time, so an earlier run's copy matches it
+    if source.st_mtime_ns == target.st_mtime_ns:
+        return True
+    return file_digest(path) == file_digest(dest)
+
+
+def copy_to_uploads(path, replace):
+    """
+    Places the PDF where the server looks for uploads
+    Returns (its path there, whether it replaced different content), or
+    (None, False) when it is skipped. With replace an existing upload of the
+    same name is overwritten when its content differs.
+    """
+    file_name = os.path.basename(path)
+    dest = os.path.join(UPLOAD_FOLDER, file_name)
+    changed = False
+    if os.path.exists(dest):
+        if os.path.samefile(path, dest):
+            return dest, False
+        if not replace and os.path.getsize(path) == os.path.getsize(dest):
+            # Cached under this name and size: skipped either way, no need to hash
+            if get_ocr_from_cache(get_file_cache_key(dest, file_name), record_use=False) is not None:
+                return dest, False
+        if same_content(path, dest):
+            return dest, False
+        if not replace:
+            print(f"✗ Skipping {path}: a different {file_name} is already uploaded (use --replace)")
+            return None, False
+        changed = True
+    shutil.copy2(path, dest)
+    return dest, changed
+
+
+def journal_path(file_hash):
+    return os.path.join(JOURNAL_FOLDER, f"{file_hash}.jsonl")
+
+
+def load_journal(file_hash):
+    """Pages OCRed by an earlier, interrupted run: {page_num: ocr_data}"""
+    pages = {}
+    path = journal_path(file_hash)
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # torn last line from the interruption
+                pages[entry["page"]] = entry["data"]
+    return pages
+
+
+class Document:
+    def __init__(self, path, file_hash, pdf_bytes, total_pages, plan, done):
+        self.path = path
+        self.file_hash = file_hash
+        self.pdf_bytes = pdf_bytes
+        self.total_pages = total_pages
+        self.plan = plan
+        self.ocr_pages = [None] * total_pages
+        for page_num, ocr_data in done.items():
+            self.ocr_pages[page_num] = ocr_data
+        self.remaining = [page_num for page_num in plan["to_ocr"] if page_num not in done]
+        self.outstanding = len(self.remaining)
+        self.resumed = len(done)
+        self.failed = None
+        self.started_at = time.time()
+        self.journal = open(journal_path(file_hash), "a", encoding="utf-8")
+
+    def record(self, page_num, ocr_data):
+        self.ocr_pages[page_num] = ocr_data
+        self.outstanding -= 1
+        if ocr_data is not None:
+            self.journal.write(json.dumps({"page": page_num, "data": ocr_data}, separators=(",", ":")) + "\n")
+            self.journal.flush()
+
+
+def prepare(path, replace):
+    """Copies, hashes and plans one PDF; None if it is skipped or already cached"""
+    upload_path, changed = copy_to_uploads(path, replace)
+    if upload_path is None:
+        return None
+    file_hash = get_file_cache_key(upload_path, os.path.basename(upload_path))
+    if changed:
+        # Cache keys are name and size, so what is cached under this key is the old content's;
+        # running servers see the store generation change and drop their handles
+        print(f"⟳ {os.path.basename(path)} replaced, OCRing it again")
+        drop_cached_document(file_hash)
+        if os.path.exists(journal_path(file_hash)):
+            os.remove(journal_path(file_hash))
+    elif get_ocr_from_cache(file_hash, record_use=False) is not None:
+        print(f"✓ {os.path.basename(path)} already cached")
+        return None
+    pdf_bytes, total_pages = read_pdf(upload_path)
+    text_layer = None if changed else load_text_layer(file_hash, total_pages)
+    if text_layer is not None:
+        store_ocr_in_cache(file_hash, text_layer, total_pages, os.path.basename(upload_path))
+        return None
+    plan = plan_document(pdf_bytes, PAGE_OCR_INDEX)
+    return Document(upload_path, file_hash, pdf_bytes, total_pages, plan, load_journal(file_hash))
+
+
+def finish(doc, stats):
+    """Writes a completed document to the cache and drops its journal"""
+    doc.journal.close()
+    finish_document(doc.ocr_pages, doc.plan, PAGE_OCR_INDEX)
+    store_ocr_in_cache(doc.file_hash, doc.ocr_pages, doc.total_pages, os.path.basename(doc.path))
+    if SEARCHABLE_PDF:
+        save_searchable_pdf(doc.file_hash, doc.pdf_bytes, doc.ocr_pages)
+    os.remove(journal_path(doc.file_hash))
+
+    elapsed = time.time() - doc.started_at
+    ocred = len(doc.plan["to_ocr"]) - doc.resumed
+    failed = sum(1 for page_num in doc.plan["to_ocr"] if doc.ocr_pages[page_num] is None)
+    stats["documents"] += 1
+    stats["pages"] += doc.total_pages
+    stats["failed"] += failed
+    print(f"✓ {os.path.basename(doc.path)}: {doc.total_pages} pages ({ocred} OCRed, "
+          f"{doc.resumed} resumed, {failed} failed) in {elapsed:.1f}s "
+          f"({doc.total_pages / max(elapsed, 1e-9):.2f} pages/s)")
+
+
+def abandon(doc, stats):
+    """Gives up on a document whose page crashed the pool; its journal stays for the next run"""
+    doc.journal.close()
+    stats["failed_documents"] += 1
+    print(f"✗ {os.path.basename(doc.path)}: not cached, {doc.failed}")
+
+
+def settle(doc, stats):
+    """Finishes or abandons a document once none of its pages are outstanding"""
+    if doc.failed is None:
+        try:
+            finish(doc, stats)
+            return
+        except Exception as e:
+            doc.failed = str(e)
+    abandon(doc, stats)
+
+
+def page_tasks(paths, replace, stats):
+    """Yields (document, page_num) to OCR, preparing documents only as they are reached"""
+    seen = set()
+    for path in paths:
+        # Uploads are keyed by file name, so the first file of a name wins
+        name = os.path.basename(path)
+        if name in seen:
+            print(f"✗ Skipping {path}: another {name} is already in this run")
+            continue
+        seen.add(name)
+        try:
+            doc = prepare(path, replace)
+        except Exception as e:
+            print(f"✗ {path}: {str(e)}")
+            continue
+        if doc is None:
+            continue
+        if not doc.remaining:
+            settle(doc, stats)
+            continue
+        for page_num in doc.remaining:
+            yield doc, page_num
+
+
+def ingest(paths, workers, replace=False):
+    os.makedirs(JOURNAL_FOLDER, exist_ok=True)
+    stats = {"documents": 0, "pages": 0, "failed": 0, "ocred": 0, "failed_documents": 0}
+    start_time = time.time()
+    tasks = page_tasks(find_pdfs(paths), replace, stats)
+    pending = {}
+
+    # Whole documents keep every worker busy, so plan for more pages than workers
+    cpu_plan = plan_ocr_workers(workers * 2, workers)
+    print(f"Using {cpu_plan['processes']} workers x {cpu_plan['threads']} Tesseract threads "
+          f"({cpu_plan['cpus']} CPUs, {cpu_plan['cpu_source']})")
+
+    # Recycled workers keep memory bounded over long runs, crashed ones retry their page
+    with RecyclingPool(
+        max_workers=cpu_plan["processes"], initializer=limit_ocr_threads, initargs=(cpu_plan["threads"],)
+    ) as executor:
+        while True:
+            # Keep every worker busy with a short queue behind it, across document boundaries
+            while len(pending) < cpu_plan["processes"] * 2:
+                task = next(tasks, None)
+                if task is None:
+                    break
+                doc, page_num = task
+                if doc.failed is not None:
+                    # The rest of a failed document is not worth OCRing
+                    doc.outstanding -= 1
+                    if doc.outstanding == 0:
+                        settle(doc, stats)
+                    continue
+                pending[executor.submit(process_page_ocr, (page_num, doc.pdf_bytes))] = (doc, page_num)
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                doc, page_num = pending.pop(future)
+                try:
+                    _, ocr_data = future.result()
+                except BrokenProcessPool:
+                    doc.failed = f"page {page_num + 1} crashed the OCR worker"
+                    ocr_data = None
+                except Exception as e:
+                    print(f"✗ {os.path.basename(doc.path)} page {page_num + 1}: {str(e)}")
+                    ocr_data = None
+                doc.record(page_num, ocr_data)
+                stats["ocred"] += 1
+                if doc.outstanding == 0:
+                    settle(doc, stats)
+
+    elapsed = time.time() - start_time
+    print(f"\nIngested {stats['documents']} documents ({stats['failed_documents']} failed), {stats['pages']} pages "
+          f"({stats['ocred']} OCRed, {stats['failed']} failed) in {elapsed:.1f}s | "
+          f"{stats['pages'] / max(elapsed, 1e-9):.2f} pages/s, "
+          f"{stats['ocred'] / max(elapsed, 1e-9):.2f} OCRed pages/s")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR PDFs into the search server's cache")
+    parser.add_argument("paths", nargs="+", help="PDF files, directories, or @file with one path per line")
+    parser.add_argument("--workers", type=int, default=available_cpus()[0],
+                        help="most OCR worker processes (default: CPUs available)")
+    parser.add_argument("--replace", action="store_true",
+                        help="overwrite uploads that have the same name but different content")
+    args = parser.parse_args()
+    ingest(args.paths, args.workers, args.replace)
+
+
+if __name__ == "__main__":
+    main()
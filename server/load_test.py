@@ -0,0 +1,431 @@
+"""
+Load test with concurrent simulated reviewers
+
+Usage:  python load_test.py [--url http://localhost:8000] [--reviewers 50] [--duration 60]
+                            [--server-pid PID | --spawn "python app3.py"] [--json report.json]
+
+Every reviewer is a thread that loops over the real endpoints, like the web
+client does:
+
+  - upload (--upload-ratio of iterations): a new synthetic scanned PDF
+    (text pages rendered to noisy, slightly rotated images) sent through
+    /upload-chunk and /upload-complete, then searched (an OCR cache miss)
+  - search: a query on a document already uploaded by any reviewer, either
+    one asked before (result cache hit) or a new one (OCR cache hit)
+
+with a random think time between iterations. Every document is uploaded by
+exactly one reviewer under its own name, since /upload-chunk appends to an
+existing file.
+
+The report has latency percentiles and throughput per operation (searches
+are split by the server's from_cache / result_cache_hit flags), errors, and
+the server's RSS and CPU over time: the process given by --server-pid or
+started with --spawn, including its worker processes.
+
+For CI, --spawn starts the server, waits for /health and stops it at the
+end; --max-error-rate and --max-p95 make the exit status fail on regressions.
+"""
+
+import argparse
+import io
+import json
+import math
+import os
+import random
+import shlex
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+import fitz  # PyMuPDF
+import psutil
+from PIL import Image, ImageFilter
+
+WORDS = (
+    "agreement party shall payment invoice delivery services period notice termination "
+    "liability clause section schedule amount total contract supplier customer order "
+    "date terms conditions confidential information obligations warranty review approval"
+).split()
+PHRASES = [
+    "payment terms and conditions",
+    "limitation of liability",
+    "termination for convenience",
+    "confidential information",
+    "delivery schedule",
+]
+SCAN_DPI = 150
+
+
+def synthetic_scan(pages, rng):
+    """A PDF of scanned-looking pages: rendered text, slightly rotated, blurred and noisy"""
+    source = fitz.open()
+    for page_num in range(pages):
+        page = source.new_page()
+        lines = []
+        for line_num in range(38):
+            words = rng.choices(WORDS, k=rng.randint(6, 11))
+            if line_num % 9 == 4:
+                words[rng.randrange(len(words))] = rng.choice(PHRASES)
+            if line_num % 13 == 7:
+                words.append(f"INV-{rng.randint(0, 999999):06d}")
+            lines.append(" ".join(words).capitalize() + ".")
+        page.insert_textbox(fitz.Rect(60, 60, 552, 760), "\n".join(lines), fontsize=10)
+
+    scan = fitz.open()
+    for page in source:
+        pix = page.get_pixmap(dpi=SCAN_DPI)
+        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples).convert("L")
+        img = img.rotate(rng.uniform(-1.5, 1.5), fillcolor=255, expand=False)
+        img = img.filter(ImageFilter.GaussianBlur(0.6))
+        noise = Image.effect_noise(img.size, 25)
+        img = Image.blend(img, noise, 0.08)
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=70)
+        out = scan.new_page(width=page.rect.width, height=page.rect.height)
+        out.insert_image(out.rect, stream=buffer.getvalue())
+    source.close()
+    pdf_bytes = scan.tobytes(garbage=3, deflate=True)
+    scan.close()
+    return pdf_bytes
+
+
+def multipart(fields, files=None):
+    """(body, content type) for a multipart/form-data POST"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (file_name, data) in (files or {}).items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{file_name}"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n".encode() + data + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def post(url, fields, files=None, timeout=600):
+    """Returns (status, parsed JSON or None)"""
+    body, content_type = multipart(fields, files)
+    req = urllib.request.Request(url, data=body, headers={"Content-Type": content_type}, method="POST")
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return response.status, json.loads(response.read() or b"null")
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Recorder:
+    """Latencies and errors per operation, shared by all reviewer threads"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, operation, seconds, ok=True):
+        with self.lock:
+            if ok:
+                self.latencies.setdefault(operation, []).append(seconds)
+            else:
+                self.errors[operation] = self.errors.get(operation, 0) + 1
+
+    def summary(self, elapsed):
+        rows = {}
+        with self.lock:
+            for operation in sorted(set(self.latencies) | set(self.errors)):
+                values = sorted(self.latencies.get(operation, []))
+                rows[operation] = {
+                    "count": len(values),
+                    "errors": self.errors.get(operation, 0),
+                    "per_second": round(len(values) / max(elapsed, 1e-9), 2),
+                    "p50": round(percentile(values, 50), 3),
+                    "p90": round(percentile(values, 90), 3),
+                    "p95": round(percentile(values, 95), 3),
+                    "p99": round(percentile(values, 99), 3),
+                    "max": round(values[-1], 3) if values else 0.0,
+                }
+        return rows
+
+
+class ServerMonitor:
+    """Samples RSS and CPU of a server process and its children every `interval` seconds"""
+
+    def __init__(self, pid, interval=1.0):
+        self.root = psutil.Process(pid)
+        self.interval = interval
+        self.processes = {}
+        self.samples = []
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.started_at = None
+
+    def start(self):
+        self.started_at = time.time()
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                current = [self.root] + self.root.children(recursive=True)
+            except psutil.NoSuchProcess:
+                return
+            rss = cpu = 0.0
+            for process in current:
+                # cpu_percent measures since the previous call on the same object
+                process = self.processes.setdefault(process.pid, process)
+                try:
+                    rss += process.memory_info().rss
+                    cpu += process.cpu_percent(None)
+                except psutil.Error:
+                    continue
+            self.samples.append({
+                "t": round(time.time() - self.started_at, 1),
+                "rss_mb": round(rss / (1024 * 1024), 1),
+                "cpu_percent": round(cpu, 1),
+                "processes": len(current),
+            })
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        return self.samples
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.base_url = args.url.rstrip("/")
+        self.recorder = Recorder()
+        self.lock = threading.Lock()
+        # Uploaded documents: [{"name", "queries": set of queries searched so far}]
+        self.documents = []
+        self.deadline = None
+        self.run_id = uuid.uuid4().hex[:8]
+
+    def timed(self, operation, fn):
+        start = time.time()
+        try:
+            status, data = fn()
+        except (OSError, urllib.error.URLError) as e:
+            self.recorder.record(operation, time.time() - start, ok=False)
+            print(f"✗ {operation}: {str(e)}")
+            return None
+        elapsed = time.time() - start
+        ok = 200 <= status < 300
+        self.recorder.record(operation, elapsed, ok)
+        if not ok:
+            print(f"✗ {operation}: HTTP {status}")
+        return data if ok else None
+
+    def upload(self, reviewer, rng):
+        pdf_bytes = synthetic_scan(rng.randint(self.args.min_pages, self.args.max_pages), rng)
+        file_name = f"loadtest_{self.run_id}_{reviewer}_{uuid.uuid4().hex[:6]}.pdf"
+        chunk_size = self.args.chunk_kb * 1024
+        chunks = max(1, -(-len(pdf_bytes) // chunk_size))
+        for index in range(chunks):
+            chunk = pdf_bytes[index * chunk_size:(index + 1) * chunk_size]
+            fields = {"index": index, "total": chunks, "fileName": file_name}
+            if self.timed("upload_chunk", lambda: post(f"{self.base_url}/upload-chunk", fields,
+                                                       {"chunk": ("blob", chunk)})) is None:
+                return None
+        if self.timed("upload_complete", lambda: post(f"{self.base_url}/upload-complete",
+                                                      {"fileName": file_name})) is None:
+            return None
+        return file_name
+
+    def search(self, file_name, query):
+        start = time.time()
+        try:
+            status, data = post(f"{self.base_url}/search", {"fileName": file_name, "search_text": query})
+        except (OSError, urllib.error.URLError) as e:
+            self.recorder.record("search", time.time() - start, ok=False)
+            print(f"✗ search: {str(e)}")
+            return
+        elapsed = time.time() - start
+        if not (200 <= status < 300) or not data or not data.get("success"):
+            self.recorder.record("search", elapsed, ok=False)
+            print(f"✗ search on {file_name}: HTTP {status}")
+            return
+        if data.get("result_cache_hit"):
+            operation = "search (result cache)"
+        elif data.get("from_cache"):
+            operation = "search (ocr cache)"
+        elif "from_cache" in data:
+            operation = "search (ocr)"
+        else:
+            operation = "search"
+        self.recorder.record(operation, elapsed)
+
+    def reviewer(self, reviewer):
+        rng = random.Random(self.args.seed * 1000 + reviewer)
+        iterations = 0
+        while time.time() < self.deadline:
+            if self.args.iterations and iterations >= self.args.iterations:
+                return
+            iterations += 1
+            with self.lock:
+                documents = list(self.documents)
+            if not documents or rng.random() < self.args.upload_ratio:
+                file_name = self.upload(reviewer, rng)
+                if file_name is not None:
+                    query = rng.choice(PHRASES)
+                    self.search(file_name, query)
+                    with self.lock:
+                        self.documents.append({"name": file_name, "queries": {query}})
+            else:
+                document = rng.choice(documents)
+                with self.lock:
+                    asked = sorted(document["queries"])
+                if rng.random() < self.args.repeat_ratio:
+                    query = rng.choice(asked)
+                else:
+                    query = rng.choice(PHRASES + [" ".join(rng.choices(WORDS, k=2))])
+                self.search(document["name"], query)
+                with self.lock:
+                    document["queries"].add(query)
+            time.sleep(rng.uniform(0, self.args.think_time))
+
+    def run(self):
+        self.deadline = time.time() + self.args.duration
+        threads = [
+            threading.Thread(target=self.reviewer, args=(reviewer,), daemon=True)
+            for reviewer in range(self.args.reviewers)
+        ]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+            # Ramp up instead of 50 simultaneous first uploads
+            time.sleep(self.args.ramp_up / max(1, len(threads)))
+        for thread in threads:
+            thread.join()
+        return time.time() - start
+
+
+def wait_for_health(base_url, timeout, server=None):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server is not None and server.poll() is not None:
+            return False
+        try:
+            with urllib.request.urlopen(f"{base_url}/health", timeout=5) as response:
+                if response.status == 200:
+                    return True
+        except (OSError, urllib.error.URLError):
+            pass
+        time.sleep(1)
+    return False
+
+
+def stop_server(server):
+    try:
+        children = psutil.Process(server.pid).children(recursive=True)
+    except psutil.Error:
+        children = []
+    server.terminate()
+    try:
+        server.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        server.kill()
+    for child in children:
+        try:
+            child.kill()
+        except psutil.Error:
+            pass
+
+
+def print_report(summary, elapsed, server_samples):
+    print(f"\n{'operation':<24} {'count':>6} {'err':>5} {'req/s':>7} {'p50':>7} {'p90':>7} "
+          f"{'p95':>7} {'p99':>7} {'max':>7}")
+    for operation, row in summary.items():
+        print(f"{operation:<24} {row['count']:>6} {row['errors']:>5} {row['per_second']:>7.2f} "
+              f"{row['p50']:>7.3f} {row['p90']:>7.3f} {row['p95']:>7.3f} {row['p99']:>7.3f} {row['max']:>7.3f}")
+    total = sum(row["count"] for row in summary.values())
+    print(f"\n{total} requests in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.2f} req/s)")
+
+    if server_samples:
+        step = max(1, len(server_samples) // 10)
+        print(f"\n{'t (s)':>7} {'RSS MB':>9} {'CPU %':>7} {'procs':>6}")
+        for sample in server_samples[::step]:
+            print(f"{sample['t']:>7.1f} {sample['rss_mb']:>9.1f} {sample['cpu_percent']:>7.1f} {sample['processes']:>6}")
+        print(f"Peak RSS {max(s['rss_mb'] for s in server_samples):.1f} MB, "
+              f"mean CPU {sum(s['cpu_percent'] for s in server_samples) / len(server_samples):.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate concurrent reviewers against the search server")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--reviewers", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=60, help="seconds to keep starting iterations")
+    parser.add_argument("--iterations", type=int, default=0, help="per reviewer; 0 = until --duration")
+    parser.add_argument("--ramp-up", type=float, default=10, help="seconds over which reviewers start")
+    parser.add_argument("--upload-ratio", type=float, default=0.2, help="share of iterations that upload")
+    parser.add_argument("--repeat-ratio", type=float, default=0.5,
+                        help="share of searches that repeat a query already asked on the document")
+    parser.add_argument("--think-time", type=float, default=2.0, help="max seconds between iterations")
+    parser.add_argument("--min-pages", type=int, default=2)
+    parser.add_argument("--max-pages", type=int, default=8)
+    parser.add_argument("--chunk-kb", type=int, default=2048, help="upload chunk size (the client uses 2 MB)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--server-pid", type=int, help="sample RSS/CPU of this server process")
+    parser.add_argument("--spawn", help='start the server with this command, e.g. "python app3.py"')
+    parser.add_argument("--startup-timeout", type=float, default=180)
+    parser.add_argument("--json", help="write the full report to this file")
+    parser.add_argument("--max-error-rate", type=float, help="fail when more than this share of requests fail")
+    parser.add_argument("--max-p95", type=float, help="fail when any operation's p95 exceeds this many seconds")
+    args = parser.parse_args()
+
+    server = None
+    if args.spawn:
+        server = subprocess.Popen(shlex.split(args.spawn), cwd=os.path.dirname(os.path.abspath(__file__)))
+        args.server_pid = server.pid
+    try:
+        if not wait_for_health(args.url.rstrip("/"), args.startup_timeout if server else 10, server):
+            print(f"✗ Server at {args.url} is not healthy")
+            return 2
+
+        monitor = ServerMonitor(args.server_pid).start() if args.server_pid else None
+        print(f"Running {args.reviewers} reviewers against {args.url} for {args.duration:.0f}s")
+        test = LoadTest(args)
+        elapsed = test.run()
+        server_samples = monitor.stop() if monitor else []
+    finally:
+        if server is not None:
+            stop_server(server)
+
+    summary = test.recorder.summary(elapsed)
+    print_report(summary, elapsed, server_samples)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"elapsed": elapsed, "args": vars(args), "operations": summary, "server": server_samples}, f,
+                      indent=2)
+
+    requests = sum(row["count"] + row["errors"] for row in summary.values())
+    errors = sum(row["errors"] for row in summary.values())
+    failed = False
+    if args.max_error_rate is not None and errors > args.max_error_rate * max(requests, 1):
+        print(f"✗ Error rate {errors / max(requests, 1):.1%} above {args.max_error_rate:.1%}")
+        failed = True
+    if args.max_p95 is not None:
+        for operation, row in summary.items():
+            if row["p95"] > args.max_p95:
+                print(f"✗ {operation} p95 {row['p95']:.2f}s above {args.max_p95:.2f}s")
+                failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,298 @@
+"""
+OCR job broker for a fleet of ocr_worker.py processes
+
+Usage:  OCR_QUEUE_TOKEN=secret python ocr_broker.py [--host 127.0.0.1] [--port 7070]
+
+Servers started with OCR_QUEUE=tcp://broker-host:7070 submit runs (one PDF
+plus the pages to OCR) and poll for results; workers take page jobs and post
+results back (see ocr_queue for the protocol). The broker only keeps state
+in memory: queued pages, each run's PDF and its results not yet collected.
+
+Runs take turns page by page, so one large document does not hold the
+whole fleet. A job taken by a worker is leased for OCR_JOB_LEASE seconds;
+if no result comes back by then (worker crashed or lost its connection)
+the page is queued again, up to PAGE_RETRIES times, then reported as
+failed (ocr_data None). Workers renew the lease of a page while they are
+still OCRing it, so a slow page is not handed to a second worker.
+
+A run lives until its server drops it, closes the connection it was
+submitted on, or leaves it without leases and requests for OCR_RUN_TTL
+seconds (a server that crashed), so abandoned PDFs do not pile up.
+
+The broker hands out confidential PDFs and its results end up in the shared
+OCR store, so every message must carry the shared secret OCR_QUEUE_TOKEN
+(servers and workers send it from the same variable). It listens on
+127.0.0.1 unless --host says otherwise; the token travels in clear text, so
+keep the port on a private network.
+
+Ops: submit, take, renew, document, result, results, drop, stats.
+"""
+
+import argparse
+import hmac
+import os
+import socketserver
+import threading
+import time
+from collections import OrderedDict, deque
+
+from ocr_queue import DEFAULT_BROKER_PORT, OCR_QUEUE_TOKEN, read_message, send_message
+from worker_pool import PAGE_RETRIES
+
+OCR_JOB_LEASE = int(os.getenv("OCR_JOB_LEASE", 300))
+# Runs nobody touched for this long are dropped
+OCR_RUN_TTL = int(os.getenv("OCR_RUN_TTL", 900))
+# Workers count as live in stats when they asked for work this recently
+WORKER_SEEN_SECONDS = 60
+MAX_WAIT = 30
+
+
+class Broker:
+    def __init__(self, lease_seconds=OCR_JOB_LEASE, retries=PAGE_RETRIES, run_ttl=OCR_RUN_TTL):
+        self.lease_seconds = lease_seconds
+        self.retries = retries
+        self.run_ttl = run_ttl
+        self.cond = threading.Condition()
+        # {run_id: {"pdf": bytes, "queue": deque of (page, attempt), "pending": set,
+        #           "leases": {page: (deadline, attempt, worker)}, "results": [dict],
+        #           "touched": time of the last request about the run}}
+        # Dict order is the round-robin order for take
+        self.runs = OrderedDict()
+        self.workers = {}
+        self.counters = {"submitted": 0, "completed": 0, "requeued": 0, "failed": 0}
+
+    def handle(self, header, body):
+        """Returns (reply, reply_body) for one request"""
+        self.expire_runs(time.time())
+        op = header.get("op")
+        if op == "submit":
+            return self.submit(header["run"], header["pages"], body), b""
+        if op == "take":
+            return self.take(header.get("worker", "?"), min(header.get("timeout", 5), MAX_WAIT)), b""
+        if op == "renew":
+            return self.renew(header["run"], header["page"], header.get("worker", "?")), b""
+        if op == "document":
+            return self.document(header["run"])
+        if op == "result":
+            return self.result(header["run"], header["page"], header.get("data")), b""
+        if op == "results":
+            return self.collect(header["run"], min(header.get("timeout", 1), MAX_WAIT)), b""
+        if op == "drop":
+            return self.drop(header["run"]), b""
+        if op == "stats":
+            return self.stats(), b""
+        return {"error": f"unknown op {op!r}"}, b""
+
+    def submit(self, run_id, pages, pdf_bytes):
+        with self.cond:
+            self.runs[run_id] = {
+                "pdf": pdf_bytes,
+                "queue": deque((page, 0) for page in pages),
+                "pending": set(pages),
+                "leases": {},
+                "results": [],
+                "touched": time.time(),
+            }
+            self.counters["submitted"] += len(pages)
+            self.cond.notify_all()
+        print(f"✓ Run {run_id[:8]}: {len(pages)} pages queued")
+        return {"ok": True}
+
+    def expire_leases(self, now):
+        """Requeues (or fails) pages whose worker never answered; call with the lock held"""
+        for run_id, run in self.runs.items():
+            for page, (deadline, attempt, _) in list(run["leases"].items()):
+                if deadline > now:
+                    continue
+                del run["leases"][page]
+                if attempt < self.retries:
+                    run["queue"].append((page, attempt + 1))
+                    self.counters["requeued"] += 1
+                    print(f"⟳ Run {run_id[:8]} page {page + 1}: lease expired, requeued")
+                else:
+                    run["pending"].discard(page)
+                    run["results"].append({"page": page, "data": None})
+                    self.counters["failed"] += 1
+                    print(f"✗ Run {run_id[:8]} page {page + 1}: lease expired, giving up")
+                    self.cond.notify_all()
+
+    def expire_runs(self, now):
+        """Drops runs without leases that nobody asked about for run_ttl seconds"""
+        with self.cond:
+            expired = [
+                run_id for run_id, run in self.runs.items()
+                if not run["leases"] and now - run["touched"] > self.run_ttl
+            ]
+            for run_id in expired:
+                del self.runs[run_id]
+        for run_id in expired:
+            print(f"✗ Run {run_id[:8]} expired after {self.run_ttl}s without activity")
+
+    def next_job(self, worker):
+        """Takes from the first run with queued pages, then rotates it to the back"""
+        for run_id, run in self.runs.items():
+            while run["queue"]:
+                page, attempt = run["queue"].popleft()
+                # A page can still be queued after a late result for its earlier lease
+                if page not in run["pending"]:
+                    continue
+                run["leases"][page] = (time.time() + self.lease_seconds, attempt, worker)
+                run["touched"] = time.time()
+                self.runs.move_to_end(run_id)
+                return run_id, page
+        return None
+
+    def take(self, worker, timeout):
+        deadline = time.time() + timeout
+        with self.cond:
+            self.workers[worker] = time.time()
+            while True:
+                self.expire_leases(time.time())
+                job = self.next_job(worker)
+                if job is not None:
+                    return {"run": job[0], "page": job[1], "lease": self.lease_seconds}
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return {}
+                # Wake up in time for the nearest lease to expire
+                self.cond.wait(min(remaining, self.lease_seconds))
+
+    def renew(self, run_id, page, worker):
+        """Extends the lease of a page the worker is still OCRing"""
+        with self.cond:
+            self.workers[worker] = time.time()
+            run = self.runs.get(run_id)
+            lease = run["leases"].get(page) if run is not None else None
+            # Expired and requeued, or taken over by another worker since
+            if lease is None or lease[2] != worker:
+                return {"renewed": False}
+            run["leases"][page] = (time.time() + self.lease_seconds, lease[1], worker)
+            run["touched"] = time.time()
+        return {"renewed": True}
+
+    def document(self, run_id):
+        with self.cond:
+            run = self.runs.get(run_id)
+        if run is None:
+            return {"missing": True}, b""
+        return {"run": run_id}, run["pdf"]
+
+    def result(self, run_id, page, data):
+        with self.cond:
+            run = self.runs.get(run_id)
+            # Late results for a requeued page or a dropped run are ignored
+            if run is None or page not in run["pending"]:
+                return {"accepted": False}
+            run["pending"].discard(page)
+            run["leases"].pop(page, None)
+            run["results"].append({"page": page, "data": data})
+            run["touched"] = time.time()
+            self.counters["completed"] += 1
+            self.cond.notify_all()
+        return {"accepted": True}
+
+    def collect(self, run_id, timeout):
+        deadline = time.time() + timeout
+        with self.cond:
+            while True:
+                # Also expire here, so pages of dead workers fail even when no worker asks for work
+                self.expire_leases(time.time())
+                run = self.runs.get(run_id)
+                if run is None:
+                    return {"error": f"unknown run {run_id}"}
+                run["touched"] = time.time()
+                if run["results"] or not run["pending"]:
+                    results, run["results"] = run["results"], []
+                    return {"results": results}
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return {"results": []}
+                self.cond.wait(remaining)
+
+    def drop(self, run_id):
+        with self.cond:
+            run = self.runs.pop(run_id, None)
+        if run is not None and run["pending"]:
+            print(f"✗ Run {run_id[:8]} dropped with {len(run['pending'])} pages outstanding")
+        return {"ok": True}
+
+    def stats(self):
+        now = time.time()
+        with self.cond:
+            return {
+                "runs": len(self.runs),
+                "queued": sum(len(run["queue"]) for run in self.runs.values()),
+                "leased": sum(len(run["leases"]) for run in self.runs.values()),
+                "workers": sum(1 for seen in self.workers.values() if now - seen < WORKER_SEEN_SECONDS),
+                **self.counters,
+            }
+
+
+class BrokerHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # Runs submitted on this connection die with it
+        owned = set()
+        try:
+            self.serve(owned)
+        finally:
+            for run_id in owned:
+                self.server.broker.drop(run_id)
+
+    def serve(self, owned):
+        while True:
+            try:
+                header, body = read_message(self.rfile)
+            except (ConnectionError, OSError, ValueError):
+                return
+            token = str(header.get("token", ""))
+            if not hmac.compare_digest(token.encode("utf-8"), self.server.token.encode("utf-8")):
+                print(f"✗ Rejected a message from {self.client_address[0]}: bad token")
+                try:
+                    send_message(self.wfile, {"error": "unauthorized"})
+                except OSError:
+                    pass
+                return
+            try:
+                reply, reply_body = self.server.broker.handle(header, body)
+            except (KeyError, TypeError) as e:
+                reply, reply_body = {"error": f"bad request: {str(e)}"}, b""
+            if header.get("op") == "submit" and reply.get("ok"):
+                owned.add(header["run"])
+            elif header.get("op") == "drop":
+                owned.discard(header.get("run"))
+            try:
+                send_message(self.wfile, reply, reply_body)
+            except OSError:
+                return
+
+
+class BrokerServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, token, broker=None):
+        if not token:
+            raise ValueError("the OCR broker needs a shared secret, set OCR_QUEUE_TOKEN")
+        self.token = token
+        self.broker = broker or Broker()
+        super().__init__(address, BrokerHandler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Queue page OCR jobs for ocr_worker.py processes")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="interface to listen on (default: 127.0.0.1, use 0.0.0.0 for remote workers)")
+    parser.add_argument("--port", type=int, default=DEFAULT_BROKER_PORT)
+    args = parser.parse_args()
+    if not OCR_QUEUE_TOKEN:
+        parser.error("set OCR_QUEUE_TOKEN to the shared secret of the servers and workers")
+    with BrokerServer((args.host, args.port), OCR_QUEUE_TOKEN) as server:
+        print(f"✓ OCR broker listening on {args.host}:{args.port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Memory-mapped per-document OCR index files
+
+For very large documents even the SQLite store (ocr_store.py) means
+decoding JSON for every page on every search. Here a document's words are
+written once to a fixed-layout binary file and read back through mmap, so
+opening a cached document is O(1) and only the pages a search touches are
+paged into memory (and shared between processes by the OS page cache).
+
+File layout, all little-endian:
+
+    header        magic "OCRIDX02", total_pages u32, total_words u32,
+                  text_bytes u32, norm_bytes u32
+    page_status   u8[total_pages]        1 = OCRed, 0 = OCR failed
+    page_offsets  u32[total_pages + 1]   word range of each page
+    text_offsets  u32[total_words + 1]   byte range of each word in the text table
+    left, top, width, height, conf       int32[total_words] each
+    text table    utf-8 bytes of every word, concatenated
+    norm_offsets  u32[total_words + 1]   byte range of each normalized word
+    norm table    utf-8 bytes of every normalized word (text_normalize.py)
+
+Version 1 files ("OCRIDX01") end after the text table and have no
+normalized words; they are still read, the matcher normalizes on the fly.
+"""
+
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from text_normalize import page_norms
+
+MAGIC = b"OCRIDX02"
+MAGIC_V1 = b"OCRIDX01"
+HEADER = struct.Struct("<8sIIII")
+HEADER_V1 = struct.Struct("<8sIII")
+BOX_FIELDS = ("left", "top", "width", "height", "conf")
+
+
+def index_path(index_folder, file_hash):
+    return os.path.join(index_folder, f"{file_hash}.ocridx")
+
+
+def write_index(path, ocr_pages):
+    """
+    Serializes OCR data per page into an index file
+    Written to a temp file and renamed, so readers never see a partial file
+    """
+    page_status = np.zeros(len(ocr_pages), dtype=np.uint8)
+    page_offsets = [0]
+    texts = []
+    norms = []
+    columns = {field: [] for field in BOX_FIELDS}
+
+    for page_num, ocr_data in enumerate(ocr_pages):
+        if ocr_data is not None:
+            page_status[page_num] = 1
+            page_norm = page_norms(ocr_data)
+            for i, text in enumerate(ocr_data["text"]):
+                text = str(text).strip()
+                if not text:
+                    continue
+                texts.append(text.encode("utf-8"))
+                norms.append(page_norm[i].encode("utf-8"))
+                for field in BOX_FIELDS:
+                    columns[field].append(int(float(ocr_data[field][i])))
+        page_offsets.append(len(texts))
+
+    text_offsets = byte_offsets(texts)
+    text_table = b"".join(texts)
+    norm_offsets = byte_offsets(norms)
+    norm_table = b"".join(norms)
+
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(ocr_pages), len(texts), len(text_table), len(norm_table)))
+        f.write(page_status.tobytes())
+        f.write(np.asarray(page_offsets, dtype="<u4").tobytes())
+        f.write(text_offsets.tobytes())
+        for field in BOX_FIELDS:
+            f.write(np.asarray(columns[field], dtype="<i4").tobytes())
+        f.write(text_table)
+        f.write(norm_offsets.tobytes())
+        f.write(norm_table)
+    os.replace(tmp_path, path)
+
+
+def byte_offsets(chunks):
+    offsets = np.zeros(len(chunks) + 1, dtype="<u4")
+    offsets[1:] = np.cumsum([len(c) for c in chunks], dtype=np.int64)
+    return offsets
+
+
+class IndexedPages:
+    """
+    Read-only list-like view over a memory-mapped index file
+    Each item is an image_to_data style dict for one page (None if OCR failed)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            # Identifies this file; clearing the cache deletes it, a rewrite replaces it
+            self.inode = os.fstat(f.fileno()).st_ino
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic = self.mm[:len(MAGIC)]
+        if magic == MAGIC:
+            _, total_pages, total_words, text_bytes, _ = HEADER.unpack_from(self.mm, 0)
+            offset = HEADER.size
+        elif magic == MAGIC_V1:
+            _, total_pages, total_words, text_bytes = HEADER_V1.unpack_from(self.mm, 0)
+            offset = HEADER_V1.size
+        else:
+            raise ValueError(f"Not an OCR index file: {path}")
+        self.total_pages = total_pages
+
+        self.page_status = np.frombuffer(self.mm, dtype=np.uint8, count=total_pages, offset=offset)
+        offset += total_pages
+        self.page_offsets = np.frombuffer(self.mm, dtype="<u4", count=total_pages + 1, offset=offset)
+        offset += 4 * (total_pages + 1)
+        self.text_offsets = np.frombuffer(self.mm, dtype="<u4", count=total_words + 1, offset=offset)
+        offset += 4 * (total_words + 1)
+        self.columns = {}
+        for field in BOX_FIELDS:
+            self.columns[field] = np.frombuffer(self.mm, dtype="<i4", count=total_words, offset=offset)
+            offset += 4 * total_words
+        self.text_start = offset
+        offset += text_bytes
+
+        self.norm_offsets = None
+        if magic == MAGIC:
+            self.norm_offsets = np.frombuffer(self.mm, dtype="<u4", count=total_words + 1, offset=offset)
+            self.norm_start = offset + 4 * (total_words + 1)
+
+    def __len__(self):
+        return self.total_pages
+
+    def is_current(self):
+        """False once the file was deleted or replaced after this handle was opened"""
+        try:
+            return os.stat(self.path).st_ino == self.inode
+        except OSError:
+            return False
+
+    def __getitem__(self, page_num):
+        if page_num < 0:
+            page_num += self.total_pages
+        if not 0 <= page_num < self.total_pages:
+            raise IndexError(page_num)
+        if not self.page_status[page_num]:
+            return None
+
+        start, end = int(self.page_offsets[page_num]), int(self.page_offsets[page_num + 1])
+        ocr_data = {"text": self.read_strings(self.text_offsets, self.text_start, start, end)}
+        if self.norm_offsets is not None:
+            ocr_data["norm"] = self.read_strings(self.norm_offsets, self.norm_start, start, end)
+        for field in BOX_FIELDS:
+            ocr_data[field] = self.columns[field][start:end].tolist()
+        return ocr_data
+
+    def prefetch(self):
+        """Asks the OS to read the whole file into the page cache ahead of use"""
+        if hasattr(self.mm, "madvise") and hasattr(mmap, "MADV_WILLNEED"):
+            self.mm.madvise(mmap.MADV_WILLNEED)
+
+    def read_strings(self, offsets, base, start, end):
+        bounds = offsets[start:end + 1].tolist()
+        return [
+            self.mm[base + bounds[i]:base + bounds[i + 1]].decode("utf-8")
+            for i in range(end - start)
+        ]
+
+    def __iter__(self):
+        for page_num in range(self.total_pages):
+            yield self[page_num]
+
+
+def open_index(path):
+    """Returns {"pages": IndexedPages, "total_pages": int}, or None if there is no index"""
+    if not os.path.exists(path):
+        return None
+    pages = IndexedPages(path)
+    return {"pages": pages, "total_pages": pages.total_pages}
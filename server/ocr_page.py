@@ -0,0 +1,70 @@
+"""
+OCR of a single PDF page, as run inside the worker processes
+
+Kept free of server state (no upload folders, stores or app objects), so
+pool workers and remote ocr_worker.py hosts can import it without a
+server tree. process_page_ocr renders the page at OCR_DPI, preprocesses
+it (see preprocess.py) and runs Tesseract on it.
+"""
+
+import os
+
+import fitz  # PyMuPDF
+import pytesseract
+from PIL import Image
+
+from preprocess import preprocess_page, empty_ocr_data, unrotate_ocr_boxes
+from profiling import stage
+from text_normalize import normalize_words
+
+OCR_DPI = int(os.getenv("OCR_DPI", 300))
+
+
+def check_tesseract():
+    try:
+        _ = pytesseract.get_tesseract_version()
+        return True
+    except:
+        return False
+
+
+def process_page_ocr(page_data):
+    """
+    Process a single PDF page with OCR
+    Returns OCR data for this page
+    """
+    page_num, pdf_bytes = page_data
+    try:
+        pdf = fitz.open(stream=pdf_bytes, filetype="pdf")
+        page = pdf[page_num]
+
+        with stage("render"):
+            pix = page.get_pixmap(dpi=OCR_DPI)
+            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+            img = img.convert('L')
+        pdf.close()
+
+        with stage("preprocess"):
+            img, prep = preprocess_page(img, OCR_DPI)
+        if img is None:
+            print(f"✓ OCR Page {page_num + 1} skipped (blank)")
+            return (page_num, empty_ocr_data())
+
+        tesseract_config = '--psm 3 --oem 3'
+
+        with stage("tesseract"):
+            ocr_data = pytesseract.image_to_data(
+                img,
+                lang='eng',
+                config=tesseract_config,
+                output_type=pytesseract.Output.DICT
+            )
+        with stage("normalize"):
+            ocr_data = unrotate_ocr_boxes(ocr_data, prep["skew"], pix.width, pix.height)
+            ocr_data["norm"] = normalize_words(ocr_data["text"])
+
+        print(f"✓ OCR Page {page_num + 1} completed")
+        return (page_num, ocr_data)
+    except Exception as e:
+        print(f"✗ Error OCR processing page {page_num + 1}: {str(e)}")
+        return (page_num, None)
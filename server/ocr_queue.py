@@ -0,0 +1,233 @@
+"""
+Queue backends for page OCR
+
+ocr_document hands the pages it needs OCRed to a queue backend and reads
+the results back as they finish, in any order. Both backends start pages
+in the order given, which is how a search's priority pages go first. The
+backend is chosen with
+OCR_QUEUE:
+
+  - "local" (default): LocalQueue, a process pool per run on this machine,
+    sized by cpu_budget
+  - "tcp://host:port": BrokerQueue, pages go to an ocr_broker.py process and
+    are OCRed by ocr_worker.py processes on any number of hosts
+
+Workers are stateless: they take a page job from the broker, fetch the PDF
+of its run, OCR the page and post the ocr_data back. The server that
+submitted the run collects the pages and writes the document to its cache
+and the shared OCR store as before, so dedup, text layers and the corpus
+index work the same with either backend.
+
+The broker protocol is one JSON line per message, followed by `size` raw
+bytes when the header has a "size" (PDF documents). Every request gets
+exactly one reply on the same connection, and carries the shared secret
+OCR_QUEUE_TOKEN as "token"; the broker closes connections that do not.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+import psutil
+
+from cpu_budget import limit_ocr_threads
+from profiling import current_profile, submit_profiled
+from worker_pool import WorkerTracker, announce_worker
+
+OCR_QUEUE = os.getenv("OCR_QUEUE", "local")
+# A broker run fails when no page result arrives for this long (no live workers)
+OCR_QUEUE_TIMEOUT = int(os.getenv("OCR_QUEUE_TIMEOUT", 600))
+OCR_QUEUE_TOKEN = os.getenv("OCR_QUEUE_TOKEN", "")
+DEFAULT_BROKER_PORT = 7070
+
+
+def parse_address(address):
+    """"tcp://host:port" or "host:port" -> (host, port)"""
+    parsed = urlparse(address if "://" in address else f"tcp://{address}")
+    if parsed.scheme != "tcp":
+        raise ValueError(f"unsupported OCR queue: {address}")
+    return parsed.hostname or "localhost", parsed.port or DEFAULT_BROKER_PORT
+
+
+def send_message(stream, header, body=b""):
+    if body:
+        header = {**header, "size": len(body)}
+    stream.write(json.dumps(header, separators=(",", ":")).encode("utf-8") + b"\n")
+    if body:
+        stream.write(body)
+    stream.flush()
+
+
+def read_message(stream):
+    """Returns (header, body); raises ConnectionError when the peer is gone"""
+    line = stream.readline()
+    if not line:
+        raise ConnectionError("connection closed")
+    header = json.loads(line)
+    body = b""
+    if header.get("size"):
+        body = stream.read(header["size"])
+        if len(body) != header["size"]:
+            raise ConnectionError("connection closed mid-message")
+    return header, body
+
+
+class BrokerClient:
+    """One connection to the broker, safe to share between threads"""
+
+    def __init__(self, address, connect_timeout=10, token=None):
+        self.token = OCR_QUEUE_TOKEN if token is None else token
+        self.sock = socket.create_connection(parse_address(address), timeout=connect_timeout)
+        # Requests like take and results block on the broker side, not here
+        self.sock.settimeout(None)
+        self.stream = self.sock.makefile("rwb")
+        self.lock = threading.Lock()
+
+    def request(self, header, body=b""):
+        with self.lock:
+            send_message(self.stream, {**header, "token": self.token}, body)
+            reply, reply_body = read_message(self.stream)
+        if "error" in reply:
+            raise RuntimeError(f"OCR broker: {reply['error']}")
+        return reply, reply_body
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            self.sock.close()
+
+
+class LocalRun:
+    def __init__(self, ocr_page, cpu_plan, pdf_bytes, page_nums):
+        # Workers report their pids, so cancel can find them
+        self.tracker = WorkerTracker()
+        self.executor = ProcessPoolExecutor(
+            max_workers=cpu_plan["processes"], initializer=announce_worker,
+            initargs=self.tracker.initargs(limit_ocr_threads, (cpu_plan["threads"],)),
+        )
+        # Pages of a profiled request are sampled in the workers too
+        profile = current_profile()
+        self.futures = {
+            submit_profiled(self.executor, ocr_page, (page_num, pdf_bytes), profile): page_num
+            for page_num in page_nums
+        }
+
+    def results(self):
+        """Yields (page_num, ocr_data) as pages finish, ocr_data None if a page failed"""
+        for future in as_completed(self.futures):
+            page_num = self.futures[future]
+            try:
+                yield future.result()
+            except Exception as e:
+                print(f"✗ Error on page {page_num + 1}: {str(e)}")
+                yield page_num, None
+
+    def cancel(self):
+        """Drops queued pages and kills busy workers so the CPUs are freed right away"""
+        workers = self.tracker.processes()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        for process in workers:
+            try:
+                process.terminate()
+            except psutil.Error:
+                continue
+
+    def close(self, wait=True):
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+
+
+class LocalQueue:
+    """
+    OCRs pages in a process pool on this machine
+    ocr_page((page_num, pdf_bytes)) -> (page_num, ocr_data) runs in the workers,
+    plan_workers(pages) returns the cpu_budget plan for a run
+    """
+
+    name = "local"
+
+    def __init__(self, ocr_page, plan_workers):
+        self.ocr_page = ocr_page
+        self.plan_workers = plan_workers
+
+    def start(self, pdf_bytes, page_nums):
+        cpu_plan = self.plan_workers(len(page_nums))
+        print(f"Using {cpu_plan['processes']} local workers for {len(page_nums)} pages")
+        return LocalRun(self.ocr_page, cpu_plan, pdf_bytes, page_nums)
+
+    def stats(self):
+        return {"backend": self.name}
+
+
+class BrokerRun:
+    def __init__(self, address, pdf_bytes, page_nums):
+        self.client = BrokerClient(address)
+        self.run_id = uuid.uuid4().hex
+        self.pending = set(page_nums)
+        self.cancelled = False
+        self.client.request({"op": "submit", "run": self.run_id, "pages": list(page_nums)}, pdf_bytes)
+
+    def results(self):
+        """Yields (page_num, ocr_data) as workers post them"""
+        last_result = time.time()
+        while self.pending and not self.cancelled:
+            reply, _ = self.client.request({"op": "results", "run": self.run_id, "timeout": 1})
+            for result in reply["results"]:
+                if result["page"] in self.pending:
+                    self.pending.discard(result["page"])
+                    last_result = time.time()
+                    yield result["page"], result["data"]
+            if self.pending and time.time() - last_result > OCR_QUEUE_TIMEOUT:
+                raise RuntimeError(f"No OCR worker answered for {OCR_QUEUE_TIMEOUT}s "
+                                   f"({len(self.pending)} pages outstanding)")
+
+    def cancel(self):
+        # results() notices within one poll; close() then drops the run on the broker
+        self.cancelled = True
+
+    def close(self, wait=True):
+        try:
+            self.client.request({"op": "drop", "run": self.run_id})
+        except (OSError, RuntimeError) as e:
+            print(f"✗ Could not drop OCR run {self.run_id[:8]}: {str(e)}")
+        finally:
+            self.client.close()
+
+
+class BrokerQueue:
+    """OCRs pages on ocr_worker.py processes through an ocr_broker.py at address"""
+
+    name = "broker"
+
+    def __init__(self, address):
+        self.address = address
+        parse_address(address)
+        if not OCR_QUEUE_TOKEN:
+            raise ValueError("OCR_QUEUE points at a broker but OCR_QUEUE_TOKEN is not set")
+
+    def start(self, pdf_bytes, page_nums):
+        print(f"Queueing {len(page_nums)} pages on OCR broker {self.address}")
+        return BrokerRun(self.address, pdf_bytes, page_nums)
+
+    def stats(self):
+        try:
+            client = BrokerClient(self.address, connect_timeout=2)
+            try:
+                reply, _ = client.request({"op": "stats"})
+            finally:
+                client.close()
+        except (OSError, RuntimeError) as e:
+            return {"backend": self.name, "address": self.address, "error": str(e)}
+        return {"backend": self.name, "address": self.address, **reply}
+
+
+def open_queue(spec, ocr_page, plan_workers):
+    """Queue backend for an OCR_QUEUE value"""
+    if spec == "local":
+        return LocalQueue(ocr_page, plan_workers)
+    return BrokerQueue(spec)
@@ -0,0 +1,314 @@
+"""
+Cross-process OCR cache backed by SQLite
+
+OCR_CACHE in app3.py is per process, so under gunicorn every worker OCRs
+and holds its own copy of each document. This store keeps one copy of the
+OCR data on disk that every worker process reads:
+
+    documents(file_hash, total_pages, created_at)
+    pages(file_hash, page_num, data)      one compact JSON row per page
+    document_hits(file_hash, hits, last_used)
+                                          cache use, to warm hot documents on boot
+    store_meta(name, value)               "generation", bumped by every clear()
+                                          and delete_document()
+
+Pages are read lazily through StoredPages, which keeps only the last
+STORE_DECODED_PAGES decoded pages, so a process holds a small window of
+each document it searches rather than a full copy. OcrDocumentCache bounds
+how many documents (handles) a process keeps open at all. A handle
+remembers the generation it was opened in; once another process clears the
+store, is_current() turns false and the caller drops the handle instead of
+reading pages that are gone. The database runs in WAL mode so readers never
+block the writer.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from text_normalize import page_norms
+
+# Only the fields the matchers read are stored, "norm" being the normalized words
+STORED_FIELDS = ("text", "norm", "conf", "left", "top", "width", "height")
+# Decoded pages kept per open document, enough for a page break and a result window
+STORE_DECODED_PAGES = int(os.getenv("STORE_DECODED_PAGES", 16))
+# Documents a process keeps in OCR_CACHE
+OCR_CACHE_DOCUMENTS = int(os.getenv("OCR_CACHE_DOCUMENTS", 64))
+
+
+def encode_page(ocr_data):
+    if ocr_data is None:
+        return None
+    compact = {field: ocr_data.get(field, []) for field in STORED_FIELDS}
+    compact["norm"] = page_norms(ocr_data)
+    return json.dumps(compact, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def decode_page(blob):
+    if blob is None:
+        return None
+    return json.loads(blob)
+
+
+class StoredPages:
+    """
+    Read-only list-like view over the pages of one stored document
+    Iteration streams rows in page order, indexing reads a single row. The
+    most recently used max_decoded pages stay decoded on the handle.
+    """
+
+    def __init__(self, store, file_hash, total_pages, generation, max_decoded=STORE_DECODED_PAGES):
+        self.store = store
+        self.file_hash = file_hash
+        self.total_pages = total_pages
+        self.generation = generation
+        self.max_decoded = max_decoded
+        self.decoded = OrderedDict()
+        self.lock = threading.Lock()
+
+    def remember(self, page_num, ocr_data):
+        if self.max_decoded <= 0:
+            return
+        with self.lock:
+            self.decoded[page_num] = ocr_data
+            self.decoded.move_to_end(page_num)
+            while len(self.decoded) > self.max_decoded:
+                self.decoded.popitem(last=False)
+
+    def __len__(self):
+        return self.total_pages
+
+    def is_current(self):
+        """False once the store was cleared after this handle was opened"""
+        return self.store.generation() == self.generation
+
+    def __getitem__(self, page_num):
+        if page_num < 0:
+            page_num += self.total_pages
+        if not 0 <= page_num < self.total_pages:
+            raise IndexError(page_num)
+        with self.lock:
+            if page_num in self.decoded:
+                self.decoded.move_to_end(page_num)
+                return self.decoded[page_num]
+        ocr_data = self.store.get_page(self.file_hash, page_num)
+        self.remember(page_num, ocr_data)
+        return ocr_data
+
+    def prefetch(self):
+        """Reads every row once so the document's pages sit in the OS page cache"""
+        for _ in self.store.iter_page_rows(self.file_hash):
+            pass
+
+    def __iter__(self):
+        rows = self.store.iter_page_rows(self.file_hash)
+        expected = 0
+        for page_num, blob in rows:
+            # Pages that failed OCR have no row
+            while expected < page_num:
+                yield None
+                expected += 1
+            ocr_data = decode_page(blob)
+            self.remember(page_num, ocr_data)
+            yield ocr_data
+            expected += 1
+        while expected < self.total_pages:
+            yield None
+            expected += 1
+
+
+class OcrDocumentCache:
+    """
+    Per-process map from file hash to cached document ({"pages", "total_pages"}),
+    least recently used documents dropped beyond max_documents
+    Dropped documents are reopened from the store or index file on next use.
+    """
+
+    def __init__(self, max_documents=OCR_CACHE_DOCUMENTS):
+        self.max_documents = max_documents
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, file_hash, default=None):
+        with self.lock:
+            if file_hash not in self.entries:
+                return default
+            self.entries.move_to_end(file_hash)
+            return self.entries[file_hash]
+
+    def __setitem__(self, file_hash, document):
+        with self.lock:
+            self.entries[file_hash] = document
+            self.entries.move_to_end(file_hash)
+            while len(self.entries) > max(1, self.max_documents):
+                self.entries.popitem(last=False)
+
+    def pop(self, file_hash, default=None):
+        with self.lock:
+            return self.entries.pop(file_hash, default)
+
+    def __contains__(self, file_hash):
+        with self.lock:
+            return file_hash in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def keys(self):
+        with self.lock:
+            return list(self.entries)
+
+    def values(self):
+        with self.lock:
+            return list(self.entries.values())
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class OcrStore:
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        with self.connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    file_hash TEXT PRIMARY KEY,
+                    total_pages INTEGER NOT NULL,
+                    created_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS pages (
+                    file_hash TEXT NOT NULL,
+                    page_num INTEGER NOT NULL,
+                    data BLOB,
+                    PRIMARY KEY (file_hash, page_num)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS document_hits (
+                    file_hash TEXT PRIMARY KEY,
+                    hits INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS store_meta (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                );
+            """)
+
+    def connect(self):
+        """One connection per thread; sqlite3 connections must not be shared"""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def generation(self):
+        row = self.connect().execute("SELECT value FROM store_meta WHERE name = 'generation'").fetchone()
+        return row[0] if row else 0
+
+    def get_document(self, file_hash):
+        """Returns {"pages": StoredPages, "total_pages": int} or None"""
+        conn = self.connect()
+        # One read transaction, so the generation belongs to the row we read
+        with conn:
+            conn.execute("BEGIN")
+            generation = self.generation()
+            row = conn.execute(
+                "SELECT total_pages FROM documents WHERE file_hash = ?", (file_hash,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"pages": StoredPages(self, file_hash, row[0], generation), "total_pages": row[0]}
+
+    def get_page(self, file_hash, page_num):
+        row = self.connect().execute(
+            "SELECT data FROM pages WHERE file_hash = ? AND page_num = ?", (file_hash, page_num)
+        ).fetchone()
+        return decode_page(row[0]) if row else None
+
+    def iter_page_rows(self, file_hash):
+        return self.connect().execute(
+            "SELECT page_num, data FROM pages WHERE file_hash = ? ORDER BY page_num", (file_hash,)
+        )
+
+    def put_document(self, file_hash, ocr_pages):
+        """Stores a whole document in one transaction; the documents row marks it complete"""
+        conn = self.connect()
+        with conn:
+            conn.execute("DELETE FROM pages WHERE file_hash = ?", (file_hash,))
+            conn.executemany(
+                "INSERT INTO pages (file_hash, page_num, data) VALUES (?, ?, ?)",
+                (
+                    (file_hash, page_num, encode_page(ocr_data))
+                    for page_num, ocr_data in enumerate(ocr_pages)
+                    if ocr_data is not None
+                ),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO documents (file_hash, total_pages, created_at) VALUES (?, ?, ?)",
+                (file_hash, len(ocr_pages), time.time()),
+            )
+
+    def touch(self, file_hash):
+        """Records one use of a cached document (from any tier)"""
+        conn = self.connect()
+        with conn:
+            conn.execute(
+                "INSERT INTO document_hits (file_hash, hits, last_used) VALUES (?, 1, ?) "
+                "ON CONFLICT (file_hash) DO UPDATE SET hits = hits + 1, last_used = excluded.last_used",
+                (file_hash, time.time()),
+            )
+
+    def hot_documents(self, limit):
+        """File hashes of the most recently used documents, most recent first"""
+        return [row[0] for row in self.connect().execute(
+            "SELECT file_hash FROM document_hits ORDER BY last_used DESC, hits DESC LIMIT ?", (limit,)
+        )]
+
+    def delete_document(self, file_hash):
+        """Removes one document, returns True if it was stored"""
+        conn = self.connect()
+        with conn:
+            deleted = conn.execute("DELETE FROM documents WHERE file_hash = ?", (file_hash,)).rowcount
+            conn.execute("DELETE FROM pages WHERE file_hash = ?", (file_hash,))
+            conn.execute("DELETE FROM document_hits WHERE file_hash = ?", (file_hash,))
+            # Handles other processes hold on this document must not outlive it
+            conn.execute(
+                "INSERT INTO store_meta (name, value) VALUES ('generation', 1) "
+                "ON CONFLICT (name) DO UPDATE SET value = value + 1"
+            )
+        return deleted > 0
+
+    def clear(self):
+        """Removes every document, returns how many there were"""
+        conn = self.connect()
+        with conn:
+            count = conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+            conn.execute("DELETE FROM pages")
+            conn.execute("DELETE FROM documents")
+            conn.execute("DELETE FROM document_hits")
+            conn.execute(
+                "INSERT INTO store_meta (name, value) VALUES ('generation', 1) "
+                "ON CONFLICT (name) DO UPDATE SET value = value + 1"
+            )
+        return count
+
+    def stats(self):
+        row = self.connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(total_pages), 0) FROM documents"
+        ).fetchone()
+        return {"cached_files": row[0], "total_cached_pages": row[1]}
+
+
+def open_store(upload_folder):
+    """Opens the store configured by OCR_STORE / OCR_STORE_PATH, or None when disabled"""
+    if os.getenv("OCR_STORE", "on") == "off":
+        return None
+    path = os.getenv("OCR_STORE_PATH", os.path.join(upload_folder, "ocr_cache.sqlite3"))
+    return OcrStore(path)
@@ -0,0 +1,137 @@
+"""
+Stateless OCR worker for an ocr_broker.py fleet
+
+Usage:  python ocr_worker.py [tcp://broker-host:7070] [--workers N]
+
+Takes page jobs from the broker (OCR_QUEUE when no address is given), runs
+process_page_ocr on them in a RecyclingPool and posts the ocr_data back.
+One thread per worker process holds its own broker connection, so a host
+with N workers OCRs N pages at once. The only state is a small cache of the
+PDFs of recent runs, so workers can be added, stopped or killed at any
+time; pages a dead worker had taken are requeued by the broker when their
+lease runs out. While a page is being OCRed its lease is renewed every
+third of the lease, so slow pages are not OCRed twice.
+
+For a local fleet: start ocr_broker.py, a few ocr_worker.py processes and
+the server with OCR_QUEUE=tcp://localhost:7070.
+"""
+
+import argparse
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import wait
+
+from cpu_budget import available_cpus, limit_ocr_threads, plan_ocr_workers
+from ocr_page import process_page_ocr
+from ocr_queue import OCR_QUEUE, BrokerClient
+from worker_pool import RecyclingPool
+
+# PDFs kept per worker host; jobs of one run mostly arrive back to back
+DOCUMENT_CACHE_SIZE = 4
+RECONNECT_DELAY = 2
+
+
+class DocumentCache:
+    """PDF bytes of recent runs, fetched from the broker on first use"""
+
+    def __init__(self, size=DOCUMENT_CACHE_SIZE):
+        self.size = size
+        self.documents = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, client, run_id):
+        """The run's PDF, or None when the broker no longer has the run"""
+        with self.lock:
+            if run_id in self.documents:
+                self.documents.move_to_end(run_id)
+                return self.documents[run_id]
+        reply, pdf_bytes = client.request({"op": "document", "run": run_id})
+        if reply.get("missing"):
+            return None
+        with self.lock:
+            self.documents[run_id] = pdf_bytes
+            while len(self.documents) > self.size:
+                self.documents.popitem(last=False)
+        return pdf_bytes
+
+
+def work(address, worker_id, executor, documents, stop):
+    """Take, OCR, post, until stop is set; reconnects when the broker goes away"""
+    client = None
+    while not stop.is_set():
+        try:
+            if client is None:
+                client = BrokerClient(address)
+                print(f"✓ {worker_id} connected to {address}")
+            job, _ = client.request({"op": "take", "worker": worker_id, "timeout": 5})
+            if "run" not in job:
+                continue
+            pdf_bytes = documents.get(client, job["run"])
+            if pdf_bytes is None:
+                continue  # run was dropped (cancelled or finished elsewhere)
+            future = executor.submit(process_page_ocr, (job["page"], pdf_bytes))
+            # Keep the page leased while it is OCRed; a failed renewal reconnects
+            # like any broker error and the page is requeued when the lease runs out
+            renew_every = max(1, job.get("lease", 300) / 3)
+            while not wait([future], timeout=renew_every).done:
+                client.request({"op": "renew", "run": job["run"], "page": job["page"], "worker": worker_id})
+            try:
+                _, ocr_data = future.result()
+            except Exception as e:
+                print(f"✗ Run {job['run'][:8]} page {job['page'] + 1}: {str(e)}")
+                ocr_data = None
+            client.request({"op": "result", "run": job["run"], "page": job["page"], "data": ocr_data})
+        except (OSError, ConnectionError, RuntimeError) as e:
+            print(f"✗ {worker_id}: {str(e)}, reconnecting in {RECONNECT_DELAY}s")
+            if client is not None:
+                client.close()
+                client = None
+            stop.wait(RECONNECT_DELAY)
+    if client is not None:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR pages for an ocr_broker.py")
+    parser.add_argument("address", nargs="?", default=OCR_QUEUE,
+                        help="broker address, tcp://host:port (default: OCR_QUEUE)")
+    parser.add_argument("--workers", type=int, default=available_cpus()[0],
+                        help="most OCR worker processes (default: CPUs available)")
+    args = parser.parse_args()
+    if args.address == "local":
+        parser.error("no broker address given and OCR_QUEUE is not set")
+
+    # A worker host only ever OCRs, so plan for more pages than workers
+    cpu_plan = plan_ocr_workers(args.workers * 2, args.workers)
+    print(f"Using {cpu_plan['processes']} workers x {cpu_plan['threads']} Tesseract threads "
+          f"({cpu_plan['cpus']} CPUs, {cpu_plan['cpu_source']})")
+
+    stop = threading.Event()
+    documents = DocumentCache()
+    host = f"{socket.gethostname()}:{os.getpid()}"
+    with RecyclingPool(
+        max_workers=cpu_plan["processes"], initializer=limit_ocr_threads, initargs=(cpu_plan["threads"],)
+    ) as executor:
+        threads = [
+            threading.Thread(
+                target=work, args=(args.address, f"{host}/{slot}", executor, documents, stop), daemon=True
+            )
+            for slot in range(cpu_plan["processes"])
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print("Stopping after the current pages...")
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+
+if __name__ == "__main__":
+    main()
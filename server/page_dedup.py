@@ -0,0 +1,246 @@
+"""
+Blank and near-duplicate page detection before OCR
+
+Every page is rendered once as a small grayscale thumbnail. From it we take
+  - an ink ratio from the histogram, to mark blank pages as empty without OCR
+  - a 256-bit difference hash, to spot pages that look the same
+
+A thumbnail cannot tell two filled-in forms apart (a different invoice
+number moves no more than a couple of dHash bits), so a look-alike is only a
+candidate. OCR is reused only when the pages' content keys are equal too: a
+hash of the page's content stream and of everything the page draws with
+(images, form XObjects, fonts), following object references by content
+rather than by xref number so equal pages of different files get the same key.
+
+Scanned pages (an image and no fonts) are the exception: two scans of the
+same sheet never have equal bytes, so their keys always differ, and the
+hash alone decides. The same goes for a page whose key cannot be computed
+(a damaged object). Renders of equal content can differ by a few bits of
+anti-aliasing, which DUPLICATE_MAX_DISTANCE absorbs.
+
+Pages that match another page of the same document this way are OCRed
+once. A PageOcrIndex also remembers OCR results across documents, so
+repeated boilerplate pages are only OCRed once per process. Set PAGE_DEDUP=off to OCR every page.
+"""
+
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import fitz  # PyMuPDF
+import numpy as np
+from PIL import Image
+
+from preprocess import empty_ocr_data
+
+PAGE_DEDUP = os.getenv("PAGE_DEDUP", "on") != "off"
+THUMBNAIL_DPI = 36
+HASH_SIZE = 16                     # 16x16 difference hash = 256 bits
+# Gray levels a pixel must beat its neighbour by, so paper and sensor noise
+# on flat areas does not flip hash bits
+HASH_MARGIN = 2
+BLANK_THUMB_INK_RATIO = float(os.getenv("BLANK_THUMB_INK_RATIO", 0.002))
+DUPLICATE_MAX_DISTANCE = int(os.getenv("DUPLICATE_MAX_DISTANCE", 4))
+OBJECT_REFERENCE = re.compile(r"(\d+) 0 R\b")
+PAGE_INDEX_SIZE = int(os.getenv("PAGE_INDEX_SIZE", 5000))
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def difference_hash(gray):
+    """256-bit dHash of a grayscale array: is each pixel clearly brighter than its right neighbour"""
+    small = np.asarray(
+        Image.fromarray(gray).resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR), dtype=np.int16
+    )
+    bits = (small[:, 1:] > small[:, :-1] + HASH_MARGIN).flatten()
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+
+def thumbnail_is_blank(gray):
+    """
+    Blank when almost no pixels are clearly darker than the paper
+    The paper level is the most common gray value, so tinted scans still work
+    """
+    histogram = np.bincount(gray.ravel(), minlength=256)
+    paper = int(histogram.argmax())
+    ink = histogram[:max(0, paper - 60)].sum()
+    return ink / max(1, gray.size) < BLANK_THUMB_INK_RATIO
+
+
+class ContentHasher:
+    """
+    Content keys of the pages of one document
+    Objects are hashed with their references replaced by the hash of the
+    referenced object, memoized per xref.
+    """
+
+    def __init__(self, pdf):
+        self.pdf = pdf
+        self.digests = {}
+
+    def object_digest(self, xref):
+        if xref in self.digests:
+            return self.digests[xref]
+        # Placeholder for reference cycles (annotations point back at their page)
+        self.digests[xref] = b"cycle"
+        digest = hashlib.blake2b(digest_size=16)
+        source = self.pdf.xref_object(xref, compressed=True)
+        digest.update(OBJECT_REFERENCE.sub(lambda ref: self.object_digest(int(ref.group(1))).hex(), source).encode())
+        if self.pdf.xref_is_stream(xref):
+            digest.update(self.pdf.xref_stream_raw(xref) or b"")
+        self.digests[xref] = digest.digest()
+        return self.digests[xref]
+
+    def page_key(self, page):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{tuple(page.rect)} {page.rotation}".encode())
+        digest.update(page.read_contents())
+        # (resource name, object) pairs: the content stream draws by name
+        resources = [(image[7], image[0]) for image in page.get_images(full=True)]
+        resources += [(image[7] + "/smask", image[1]) for image in page.get_images(full=True) if image[1]]
+        resources += [(xobject[1], xobject[0]) for xobject in page.get_xobjects()]
+        resources += [(font[4], font[0]) for font in page.get_fonts(full=True)]
+        for name, xref in sorted(resources):
+            if xref > 0:
+                digest.update(name.encode() + self.object_digest(xref))
+        return digest.hexdigest()
+
+
+def page_fingerprint(page, hasher):
+    """
+    Returns {"blank": bool, "phash": int, "key": content key or None,
+             "scanned": bool} for a fitz page
+    """
+    pix = page.get_pixmap(dpi=THUMBNAIL_DPI, colorspace=fitz.csGRAY)
+    gray = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+    try:
+        key = hasher.page_key(page)
+    except Exception:
+        key = None
+    return {
+        "blank": bool(thumbnail_is_blank(gray)),
+        "phash": difference_hash(np.ascontiguousarray(gray)),
+        "key": key,
+        "scanned": not page.get_fonts() and bool(page.get_images()),
+    }
+
+
+class PageOcrIndex:
+    """
+    Bounded LRU maps from page to (dHash, OCR data)
+    A page with a content key matches an entry with the same key and a hash
+    within DUPLICATE_MAX_DISTANCE bits. Scanned and keyless pages are kept
+    apart and match the closest such entry by hash alone.
+    """
+
+    def __init__(self, max_entries=PAGE_INDEX_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        # Scanned and keyless pages, {dHash: OCR data}
+        self.by_phash = OrderedDict()
+        self.lock = threading.Lock()
+
+    def lookup(self, phash, key, scanned=False):
+        with self.lock:
+            if key is None or scanned:
+                distance, closest = min(
+                    ((hamming(phash, known), known) for known in self.by_phash), default=(None, None)
+                )
+                if closest is None or distance > DUPLICATE_MAX_DISTANCE:
+                    return None
+                self.by_phash.move_to_end(closest)
+                return self.by_phash[closest]
+
+            entry = self.entries.get(key)
+            if entry is None or hamming(phash, entry[0]) > DUPLICATE_MAX_DISTANCE:
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def add(self, phash, key, ocr_data, scanned=False):
+        with self.lock:
+            if key is None or scanned:
+                entries, entry_key, value = self.by_phash, phash, ocr_data
+            else:
+                entries, entry_key, value = self.entries, key, (phash, ocr_data)
+            entries[entry_key] = value
+            entries.move_to_end(entry_key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries) + len(self.by_phash)
+
+
+def plan_document(pdf_bytes, index=None):
+    """
+    Decides which pages of a document actually need OCR
+    Returns {"to_ocr": [page_num], "resolved": {page_num: ocr_data},
+             "same_as": {page_num: representative page_num}, "phashes": [int],
+             "keys": [content key], "scanned": [bool]}
+    """
+    pdf = fitz.open(stream=pdf_bytes, filetype="pdf")
+    total_pages = len(pdf)
+    plan = {
+        "to_ocr": [], "resolved": {}, "same_as": {},
+        "phashes": [None] * total_pages, "keys": [None] * total_pages, "scanned": [False] * total_pages,
+    }
+
+    if not PAGE_DEDUP:
+        pdf.close()
+        plan["to_ocr"] = list(range(total_pages))
+        return plan
+
+    representatives = PageOcrIndex(max_entries=total_pages or 1)
+    hasher = ContentHasher(pdf)
+    for page_num in range(total_pages):
+        fingerprint = page_fingerprint(pdf[page_num], hasher)
+        phash, key, scanned = fingerprint["phash"], fingerprint["key"], fingerprint["scanned"]
+        plan["phashes"][page_num] = phash
+        plan["keys"][page_num] = key
+        plan["scanned"][page_num] = scanned
+
+        if fingerprint["blank"]:
+            plan["resolved"][page_num] = empty_ocr_data()
+            continue
+
+        known = index.lookup(phash, key, scanned) if index is not None else None
+        if known is not None:
+            plan["resolved"][page_num] = known
+            continue
+
+        # Within the document the index stores representative page numbers
+        representative = representatives.lookup(phash, key, scanned)
+        if representative is not None:
+            plan["same_as"][page_num] = representative
+            continue
+
+        representatives.add(phash, key, page_num, scanned)
+        plan["to_ocr"].append(page_num)
+
+    pdf.close()
+    print(f"✓ Page plan: {len(plan['to_ocr'])} to OCR, {len(plan['resolved'])} resolved, "
+          f"{len(plan['same_as'])} duplicate of another page")
+    return plan
+
+
+def finish_document(ocr_pages, plan, index=None):
+    """
+    Fills skipped pages of ocr_pages in place from the plan
+    and remembers newly OCRed pages in the index
+    """
+    for page_num, ocr_data in plan["resolved"].items():
+        ocr_pages[page_num] = ocr_data
+    for page_num, representative in plan["same_as"].items():
+        ocr_pages[page_num] = ocr_pages[representative]
+    if index is not None:
+        for page_num in plan["to_ocr"]:
+            if ocr_pages[page_num] is not None and plan["phashes"][page_num] is not None:
+                index.add(
+                    plan["phashes"][page_num], plan["keys"][page_num], ocr_pages[page_num], plan["scanned"][page_num]
+                )
+    return ocr_pages
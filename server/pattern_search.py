@@ -0,0 +1,248 @@
+"""
+Regex and wildcard search over the OCR words of a page
+
+Reviewers look for shapes rather than phrases: invoice numbers
+(`INV-\\d{6}`), every form of a word (`contract*`). Two pattern syntaxes
+sit next to the fuzzy phrase matcher in phrase_matcher.py:
+
+  regex     Python regular expression, case-insensitive
+  wildcard  `*` matches any run of non-space characters, `?` one character,
+            spaces match any whitespace; the pattern is anchored to word
+            boundaries, so `contract*` finds "contracts" but not
+            "subcontract"
+
+A page is searched as its confident OCR words joined by single spaces, and
+each regex hit is snapped back to the whole words it overlaps, so patterns
+can span words (`payment\\s+terms`) and highlights look like phrase hits.
+Matches are exact, there is no OCR error tolerance as in the phrase matcher.
+
+Patterns come from users, so they run on the `regex` module rather than
+`re`: a search gets PATTERN_TIMEOUT seconds in total, and a pattern that
+backtracks catastrophically fails with PatternError instead of holding the
+GIL (and every other request) for minutes.
+
+Before any regex runs, literal_pieces pulls the text every match must
+contain out of the pattern ("inv" for `INV-\\d{6}`). Pages whose normalized
+words do not contain every piece are skipped, through the corpus index when
+the document is indexed (see CorpusIndex.pages_containing) and by a word
+scan otherwise. Patterns the scanner cannot reason about (top-level `|`,
+verbose mode) are run on every page.
+"""
+
+import os
+import re
+import time
+from bisect import bisect_right
+
+import regex
+
+from text_normalize import normalize_text
+
+PATTERN_MODES = ("regex", "wildcard")
+MAX_PATTERN_LENGTH = 200
+PATTERN_TIMEOUT = float(os.getenv("PATTERN_TIMEOUT", 2))
+# Shorter pieces are in nearly every page and prune nothing
+MIN_PIECE_LENGTH = 2
+
+QUANTIFIER = re.compile(r"\*|\+|\?|\{(\d*)(?:,(\d*))?\}")
+ESCAPE = re.compile(
+    r"\\(x[0-9a-fA-F]{2}|u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8}|[NpP]\{[^}]*\}|0[0-7]{0,2}|[1-9][0-9]?|.)", re.S
+)
+
+
+class PatternError(ValueError):
+    pass
+
+
+def compile_pattern(search_text, mode):
+    """Compiled pattern for a search in `mode`, PatternError when it is not usable"""
+    if mode not in PATTERN_MODES:
+        raise PatternError(f"unknown search mode: {mode}")
+    if len(search_text) > MAX_PATTERN_LENGTH:
+        raise PatternError(f"pattern longer than {MAX_PATTERN_LENGTH} characters")
+
+    if mode == "wildcard":
+        parts = []
+        for token in re.findall(r"\*|\?|\s+|[^*?\s]+", search_text.strip()):
+            if token == "*":
+                parts.append(r"\S*")
+            elif token == "?":
+                parts.append(r"\S")
+            elif token.isspace():
+                parts.append(r"\s+")
+            else:
+                parts.append(re.escape(token))
+        source = r"(?<!\w)" + "".join(parts) + r"(?!\w)"
+    else:
+        source = search_text
+
+    try:
+        return regex.compile(source, regex.IGNORECASE)
+    except regex.error as e:
+        raise PatternError(f"invalid pattern: {e}") from None
+
+
+def class_end(pattern, i):
+    """Index after the character class opening at pattern[i]"""
+    i += 1
+    if pattern[i : i + 1] == "^":
+        i += 1
+    # A "]" right after the opening bracket is a literal
+    if pattern[i : i + 1] == "]":
+        i += 1
+    while i < len(pattern) and pattern[i] != "]":
+        i += 2 if pattern[i] == "\\" else 1
+    return i + 1
+
+
+def regex_fragments(pattern):
+    """
+    Literal substrings every match of a regex must contain
+    Conservative: groups, classes and escapes like \\d end a fragment, and a
+    character made optional by its quantifier is dropped.
+    """
+    fragments = []
+    current = ""
+    # Whether current ends with the character a quantifier would apply to
+    quantifiable = False
+    depth = 0
+    i = 0
+
+    def cut():
+        nonlocal current, quantifiable
+        if current:
+            fragments.append(current)
+        current = ""
+        quantifiable = False
+
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == "\\":
+            escape = ESCAPE.match(pattern, i)
+            i = escape.end() if escape else len(pattern)
+            literal = escape.group(1) if escape else ""
+            if depth == 0 and len(literal) == 1 and not literal.isalnum():
+                current += literal
+                quantifiable = True
+            else:
+                cut()
+            continue
+        if ch == "[":
+            i = class_end(pattern, i)
+            cut()
+            continue
+        if ch == "(":
+            depth += 1
+            cut()
+        elif ch == ")":
+            depth = max(0, depth - 1)
+            cut()
+        elif depth > 0:
+            pass
+        elif ch == "|":
+            # Any alternative may match, no text is required
+            return []
+        elif ch in ".^$":
+            cut()
+        elif ch == "{" and not QUANTIFIER.match(pattern, i):
+            # A fuzzy constraint ({e<=1}) may delete the character before it
+            if quantifiable:
+                current = current[:-1]
+            cut()
+            close = pattern.find("}", i)
+            i = close + 1 if close != -1 else len(pattern)
+            continue
+        else:
+            quantifier = QUANTIFIER.match(pattern, i)
+            if quantifier:
+                i = quantifier.end()
+                # Lazy and possessive forms
+                if pattern[i : i + 1] in ("?", "+"):
+                    i += 1
+                if quantifiable:
+                    minimum = {"*": 0, "?": 0, "+": 1}.get(quantifier.group(0))
+                    if minimum is None:
+                        minimum = int(quantifier.group(1) or 0)
+                    if minimum == 0:
+                        current = current[:-1]
+                cut()
+                continue
+            current += ch
+            quantifiable = True
+        i += 1
+
+    cut()
+    return fragments
+
+
+def literal_pieces(search_text, mode, pattern):
+    """
+    Normalized text every match contains, as pieces of single words
+    Empty when nothing useful is known about the matches.
+    """
+    if mode == "wildcard":
+        fragments = re.split(r"[*?]", search_text)
+    elif pattern.flags & regex.VERBOSE:
+        fragments = []
+    else:
+        fragments = regex_fragments(search_text)
+
+    pieces = []
+    for fragment in fragments:
+        for piece in normalize_text(fragment).split():
+            if len(piece) >= MIN_PIECE_LENGTH and piece not in pieces:
+                pieces.append(piece)
+    return pieces
+
+
+def has_pieces(words, pieces):
+    """True when every piece is part of one of the page's normalized words"""
+    return all(any(piece in word["norm"] for word in words) for piece in pieces)
+
+
+def find_pattern_spans(words, pattern, pieces=(), deadline=None):
+    """
+    Pattern hits on one page, snapped to whole words
+    Returns spans {"start": first word index, "count": words, "score": 100},
+    the shape phrase_matcher returns. PatternError once time.time() passes
+    deadline (default: PATTERN_TIMEOUT from now).
+    """
+    if deadline is None:
+        deadline = time.time() + PATTERN_TIMEOUT
+    if not words or not has_pieces(words, pieces):
+        return []
+
+    starts = []
+    offset = 0
+    for word in words:
+        starts.append(offset)
+        offset += len(word["text"]) + 1
+    text = " ".join(word["text"] for word in words)
+
+    spans = []
+    last_end = -1
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        raise PatternError(f"pattern search took longer than {PATTERN_TIMEOUT:g}s")
+    try:
+        # concurrent: the GIL is released while matching
+        hits = list(pattern.finditer(text, timeout=remaining, concurrent=True))
+    except TimeoutError:
+        raise PatternError(f"pattern search took longer than {PATTERN_TIMEOUT:g}s") from None
+
+    for hit in hits:
+        if hit.end() == hit.start():
+            continue
+        first = bisect_right(starts, hit.start()) - 1
+        last = bisect_right(starts, hit.end() - 1) - 1
+        # A hit starting on the separator space belongs to the next word
+        if hit.start() >= starts[first] + len(words[first]["text"]):
+            first += 1
+        # Two hits inside one word give one highlight
+        if first <= last_end:
+            first = last_end + 1
+        if first > last:
+            continue
+        spans.append({"start": first, "count": last - first + 1, "score": 100})
+        last_end = last
+    return spans
@@ -0,0 +1,251 @@
+"""
+Phrase matching over the OCR words of one page
+
+Two strategies, picked with MATCH_MODE:
+
+  words   The original matcher: query word j must fuzzy-match OCR word i + j
+          (RapidFuzz ratio >= MATCH_THRESHOLD). Fails when Tesseract splits
+          a word ("infor mation") or merges two ("ofthe").
+
+  align   (default) Character-level alignment. Spaces are dropped from both
+          the query and the page's word stream, and Myers' bit-parallel
+          approximate matcher finds every place the query occurs with at
+          most (100 - MATCH_THRESHOLD)% edits, in one O(n * m / wordsize)
+          pass. Hits are snapped to whole OCR words through a char -> word
+          map and re-checked against the threshold, so a query never
+          matches the middle of a longer word. The edit budget covers the
+          whole phrase, so each query word is then re-checked on its own
+          against the text it aligned to: "licensor agrees" must not match
+          "Licensee agrees" just because "agrees" is exact. Dropping the
+          spaces would also let a word match across a word break ("there"
+          in "the red"), so every OCR word a hit spans beyond the query's
+          word count costs WORD_BREAK_PENALTY points. A query word split
+          in two by OCR still matches, at a lower score, while "there" no
+          longer matches "the red". Breaks after a line-end hyphen are free.
+
+Both return spans {"start": first word index, "count": words, "score": 0-100}.
+Numbers are matched exactly: a fuzzy score only counts when the digits and
+separators of the two words agree, so "3.2" never matches "32" or "3.5".
+
+Words are compared by their normalized form (word["norm"], see
+text_normalize.py) and the query is normalized the same way. Hyphens are
+dropped by normalization, so in align mode a word hyphenated at the end of
+a line joins the next one ("pro-" / "cessing"). Matches that run from the bottom of
+one page onto the next are found by boundary_spans, which aligns the query
+over the seam between one page's last words and the next page's first
+words, so no page has to be OCRed or matched again.
+"""
+
+import os
+
+from rapidfuzz import fuzz
+from rapidfuzz.distance import Levenshtein
+
+from text_normalize import NOT_SIGN, normalize_text, number_part
+
+MATCH_MODE = os.getenv("MATCH_MODE", "align")
+MATCH_THRESHOLD = 80
+# Score lost per extra OCR word a match spans beyond the query's words
+WORD_BREAK_PENALTY = 15
+
+
+def word_score(text, query_word):
+    """RapidFuzz ratio of two normalized words, 0 when their numbers differ"""
+    if number_part(text) != number_part(query_word):
+        return 0
+    return fuzz.ratio(text, query_word)
+
+
+def word_spans(words, search_text, threshold=MATCH_THRESHOLD):
+    """Word-by-word fuzzy matching, one query word per OCR word"""
+    spans = []
+    search_words = normalize_text(search_text).split()
+
+    for i in range(len(words)):
+        match_scores = []
+
+        for j, search_word in enumerate(search_words):
+            if i + j < len(words):
+                score = word_score(words[i + j]["norm"], search_word)
+                if score >= threshold:
+                    match_scores.append(score)
+                else:
+                    break
+
+        if search_words and len(match_scores) == len(search_words):
+            spans.append({
+                "start": i,
+                "count": len(search_words),
+                "score": sum(match_scores) / len(match_scores),
+            })
+
+    return spans
+
+
+def myers_search(pattern, text, max_edits):
+    """
+    Myers' bit-vector approximate string matching
+    Yields (end index in text, edit distance) wherever the pattern ends with
+    at most max_edits edits. Python ints serve as arbitrarily wide bit vectors.
+    """
+    m = len(pattern)
+    if m == 0:
+        return
+    mask = (1 << m) - 1
+    high = 1 << (m - 1)
+
+    peq = {}
+    for i, ch in enumerate(pattern):
+        peq[ch] = peq.get(ch, 0) | (1 << i)
+
+    pv, mv, score = mask, 0, m
+    for j, ch in enumerate(text):
+        eq = peq.get(ch, 0)
+        xv = eq | mv
+        xh = ((((eq & pv) + pv) & mask) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        if ph & high:
+            score += 1
+        elif mh & high:
+            score -= 1
+        ph = (ph << 1) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+        if score <= max_edits:
+            yield j, score
+
+
+def best_end_positions(hits):
+    """Keeps the lowest-distance end of each run of consecutive hits"""
+    best = []
+    run_end = None
+    for j, distance in hits:
+        if run_end is not None and j == run_end + 1:
+            if distance < best[-1][1]:
+                best[-1] = (j, distance)
+        else:
+            best.append((j, distance))
+        run_end = j
+    return best
+
+
+def words_match(snapped, query_words, threshold=MATCH_THRESHOLD):
+    """
+    True when every query word fuzzy-matches the part of snapped it aligns to
+    snapped is the matched text without spaces. Characters inserted between
+    two query words belong to neither; the first and last word own anything
+    before and after the alignment.
+    """
+    pattern = "".join(query_words)
+    # Index in snapped of each pattern character, and of the end of the pattern
+    position = [0] * (len(pattern) + 1)
+    for tag, src_start, src_end, dest_start, dest_end in Levenshtein.opcodes(pattern, snapped):
+        for k in range(src_end - src_start):
+            if tag == "delete":
+                position[src_start + k] = dest_start
+            else:
+                position[src_start + k] = dest_start + k * (dest_end - dest_start) // (src_end - src_start)
+    position[0] = 0
+    position[len(pattern)] = len(snapped)
+
+    start = 0
+    for query_word in query_words:
+        end = start + len(query_word)
+        if word_score(snapped[position[start]:position[end]], query_word) < threshold:
+            return False
+        start = end
+    return True
+
+
+def word_breaks(words, first, last):
+    """Word breaks inside words[first:last + 1], not counting line-end hyphens"""
+    return sum(1 for word in words[first:last] if not word.get("text", "").endswith(("-", NOT_SIGN)))
+
+
+def aligned_spans(words, search_text, threshold=MATCH_THRESHOLD):
+    """Character-level alignment robust to OCR word splits and merges"""
+    query_words = normalize_text(search_text).split()
+    pattern = "".join(query_words)
+    if not pattern or not words:
+        return []
+
+    # Page stream without separators, plus a map from each char to its word
+    pieces = [w["norm"] for w in words]
+    stream = "".join(pieces)
+    char_to_word = []
+    word_start = []
+    for index, piece in enumerate(pieces):
+        word_start.append(len(char_to_word))
+        char_to_word.extend([index] * len(piece))
+
+    max_edits = len(pattern) * (100 - threshold) // 100
+    reversed_pattern = pattern[::-1]
+
+    spans = {}
+    for end, distance in best_end_positions(myers_search(pattern, stream, max_edits)):
+        # Find where this occurrence starts by matching backwards from its end
+        window_start = max(0, end - len(pattern) - max_edits + 1)
+        backwards = stream[window_start:end + 1][::-1]
+        starts = list(myers_search(reversed_pattern, backwards, distance))
+        if not starts:
+            continue
+        offset, _ = min(starts, key=lambda hit: (hit[1], hit[0]))
+        start = end - offset
+
+        first, last = char_to_word[start], char_to_word[end]
+        snapped = stream[word_start[first]:word_start[last] + len(pieces[last])]
+        extra_breaks = max(0, word_breaks(words, first, last) - (len(query_words) - 1))
+        score = fuzz.ratio(snapped, pattern) - WORD_BREAK_PENALTY * extra_breaks
+        if score >= threshold and words_match(snapped, query_words, threshold):
+            key = (first, last - first + 1)
+            spans[key] = max(score, spans.get(key, 0))
+
+    # Overlapping candidates describe the same occurrence, keep the best one
+    result = []
+    for (first, count), score in sorted(spans.items(), key=lambda item: (-item[1], item[0])):
+        if all(first + count <= s["start"] or s["start"] + s["count"] <= first for s in result):
+            result.append({"start": first, "count": count, "score": score})
+    return sorted(result, key=lambda s: s["start"])
+
+
+def find_phrase_spans(words, search_text, mode=None):
+    """Matches search_text against a page's words with the configured strategy"""
+    if (mode or MATCH_MODE) == "words":
+        return word_spans(words, search_text)
+    return aligned_spans(words, search_text)
+
+
+def seam_window(search_text):
+    """
+    How many words at each side of a page break can belong to one match
+    Every OCR word has at least one character, so a match never spans more
+    words than the query has characters plus allowed edits.
+    """
+    chars = len("".join(normalize_text(search_text).split()))
+    return chars + chars * (100 - MATCH_THRESHOLD) // 100
+
+
+def boundary_spans(tail_words, head_words, search_text, mode=None):
+    """
+    Matches that start in tail_words (end of one page) and finish in
+    head_words (start of the next page)
+    Returns [{"score", "tail_start", "tail_count", "head_count"}]; the head
+    part always starts at head_words[0].
+    """
+    if not tail_words or not head_words:
+        return []
+
+    seam = len(tail_words)
+    results = []
+    for span in find_phrase_spans(tail_words + head_words, search_text, mode):
+        end = span["start"] + span["count"]
+        if span["start"] < seam < end:
+            results.append({
+                "score": span["score"],
+                "tail_start": span["start"],
+                "tail_count": seam - span["start"],
+                "head_count": end - seam,
+            })
+    return results
@@ -0,0 +1,145 @@
+"""
+Page image preprocessing between rendering and OCR
+
+Runs on the grayscale page render with NumPy:
+  - blank:     skip OCR entirely for pages with (almost) no ink
+  - threshold: adaptive (local mean) binarization to a 1-bit image
+  - deskew:    projection-profile skew estimate and rotation
+
+Steps are picked with OCR_PREPROCESS (comma separated, "off" disables all).
+Deskewing rotates the image, so box coordinates from Tesseract must be
+mapped back with unrotate_ocr_boxes before they are used for highlights.
+"""
+
+import os
+
+import numpy as np
+from PIL import Image
+
+OCR_PREPROCESS = os.getenv("OCR_PREPROCESS", "blank,threshold,deskew")
+PREPROCESS_STEPS = set() if OCR_PREPROCESS == "off" else {s.strip() for s in OCR_PREPROCESS.split(",") if s.strip()}
+
+THRESHOLD_WINDOW = int(os.getenv("THRESHOLD_WINDOW", 31))   # pixels at 300 DPI
+THRESHOLD_OFFSET = int(os.getenv("THRESHOLD_OFFSET", 10))   # gray levels below local mean
+BLANK_INK_RATIO = float(os.getenv("BLANK_INK_RATIO", 0.001))
+MAX_SKEW_DEGREES = float(os.getenv("MAX_SKEW_DEGREES", 5))
+SKEW_STEP_DEGREES = 0.25
+MIN_SKEW_DEGREES = 0.2
+
+
+def adaptive_threshold(gray, window, offset):
+    """
+    Local mean thresholding using an integral image
+    Returns a boolean array, True where the pixel is ink
+    """
+    half = window // 2
+    padded = np.pad(gray.astype(np.int64), half + 1, mode="edge")
+    integral = padded.cumsum(axis=0).cumsum(axis=1)
+
+    h, w = gray.shape
+    top, left = 0, 0
+    bottom, right = top + window, left + window
+    window_sum = (
+        integral[bottom:bottom + h, right:right + w]
+        - integral[top:top + h, right:right + w]
+        - integral[bottom:bottom + h, left:left + w]
+        + integral[top:top + h, left:left + w]
+    )
+    local_mean = window_sum / (window * window)
+    return gray < (local_mean - offset)
+
+
+def ink_ratio(ink):
+    """Fraction of pixels that are ink"""
+    return float(ink.mean()) if ink.size else 0.0
+
+
+def estimate_skew(ink):
+    """
+    Estimates page skew in degrees from the ink mask
+    Picks the angle whose row projection profile is sharpest
+    """
+    # Work on a 4x downsample, text lines survive and it is 16x cheaper
+    small = ink[::4, ::4]
+    ys, xs = np.nonzero(small)
+    if len(ys) < 50:
+        return 0.0
+
+    best_angle, best_score = 0.0, -1.0
+    height = small.shape[0]
+    for angle in np.arange(-MAX_SKEW_DEGREES, MAX_SKEW_DEGREES + SKEW_STEP_DEGREES, SKEW_STEP_DEGREES):
+        theta = np.deg2rad(angle)
+        rows = np.round(ys * np.cos(theta) - xs * np.sin(theta)).astype(np.int64)
+        rows -= rows.min()
+        profile = np.bincount(rows, minlength=height)
+        score = float(np.square(np.diff(profile)).sum())
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+
+    return best_angle
+
+
+def preprocess_page(img, dpi=300):
+    """
+    Preprocesses a grayscale ("L") PIL page image for OCR
+    Returns (image or None if blank, info dict with "blank" and "skew")
+    """
+    info = {"blank": False, "skew": 0.0}
+    if not PREPROCESS_STEPS:
+        return img, info
+
+    gray = np.asarray(img, dtype=np.uint8)
+    window = max(3, int(THRESHOLD_WINDOW * dpi / 300) | 1)
+    ink = adaptive_threshold(gray, window, THRESHOLD_OFFSET)
+
+    if "blank" in PREPROCESS_STEPS and ink_ratio(ink) < BLANK_INK_RATIO:
+        info["blank"] = True
+        return None, info
+
+    if "deskew" in PREPROCESS_STEPS:
+        angle = estimate_skew(ink)
+        if abs(angle) >= MIN_SKEW_DEGREES:
+            info["skew"] = angle
+
+    if "threshold" in PREPROCESS_STEPS:
+        out = Image.fromarray(np.where(ink, 0, 255).astype(np.uint8)).convert("1")
+        fill = 1
+    else:
+        out = img
+        fill = 255
+
+    if info["skew"]:
+        out = out.rotate(info["skew"], resample=Image.NEAREST, expand=False, fillcolor=fill)
+
+    return out, info
+
+
+def empty_ocr_data():
+    """image_to_data shaped result for a page without text"""
+    return {key: [] for key in ("level", "page_num", "block_num", "par_num", "line_num",
+                                "word_num", "left", "top", "width", "height", "conf", "text")}
+
+
+def unrotate_ocr_boxes(ocr_data, angle, width, height):
+    """
+    Maps word boxes found on a deskewed image back onto the original page
+    PIL rotates counter-clockwise about the center, so undo it clockwise
+    """
+    if not angle:
+        return ocr_data
+
+    theta = np.deg2rad(angle)
+    cos_t, sin_t = np.cos(theta), np.sin(theta)
+    cx, cy = width / 2, height / 2
+
+    for i in range(len(ocr_data["text"])):
+        w, h = ocr_data["width"][i], ocr_data["height"][i]
+        x = ocr_data["left"][i] + w / 2 - cx
+        y = ocr_data["top"][i] + h / 2 - cy
+        # Inverse of PIL's counter-clockwise rotation in image coordinates (y down)
+        ox = x * cos_t - y * sin_t
+        oy = x * sin_t + y * cos_t
+        ocr_data["left"][i] = int(round(ox + cx - w / 2))
+        ocr_data["top"][i] = int(round(oy + cy - h / 2))
+
+    return ocr_data
@@ -0,0 +1,325 @@
+"""
+Opt-in request profiling
+
+A request that carries the admin token (PROFILE_TOKEN, sent as the
+X-Profile-Token header or the `profile` query parameter) is profiled:
+
+  - a sampling profiler records the handler thread's Python stack every
+    PROFILE_INTERVAL_MS, and the same runs inside every pool worker for the
+    pages of that request (submit_profiled)
+  - stage() blocks record named stage timings (render, preprocess,
+    tesseract, ...) per page and in the handler
+
+When the request ends the samples are written as a speedscope file
+(https://www.speedscope.app, one sampled timeline per thread and one
+evented timeline of stages per page) plus a JSON summary of the stage
+timings. The response carries X-Profile-Id; GET /profiles/<id> downloads the
+speedscope file, ?format=stages the summary. The newest PROFILE_KEEP
+profiles are kept.
+
+Without PROFILE_TOKEN profiling is off, and stage() costs one attribute
+lookup per stage.
+"""
+
+import functools
+import hmac
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from flask import make_response, request
+
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", 5)) / 1000
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", 20))
+PROFILE_FORMATS = {"speedscope": ".speedscope.json", "stages": ".stages.json"}
+
+# Per thread: the RequestProfile being recorded and the stage list stage() appends to
+_active = threading.local()
+
+
+@contextmanager
+def stage(name):
+    """Times the block as a named stage when the current thread is being profiled"""
+    stages = getattr(_active, "stages", None)
+    if stages is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        stages.append((name, start, time.time()))
+
+
+def current_profile():
+    """The RequestProfile of the request this thread is handling, or None"""
+    return getattr(_active, "profile", None)
+
+
+class StackSampler:
+    """Records the Python stack of one thread every `interval` seconds from a daemon thread"""
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        # {(function, file, first line): index}, insertion order is index order
+        self.frames = {}
+        # [(time, [frame index, outermost first])]
+        self.samples = []
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                key = (code.co_name, code.co_filename, code.co_firstlineno)
+                stack.append(self.frames.setdefault(key, len(self.frames)))
+                frame = frame.f_back
+            if stack:
+                stack.reverse()
+                self.samples.append((time.time(), stack))
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        return {"frames": list(self.frames), "samples": self.samples}
+
+
+def profiled_call(fn, task, interval):
+    """
+    Pool worker side of submit_profiled: runs fn(task) under a sampler
+    Returns (fn's result, worker profile)
+    """
+    stages = _active.stages = []
+    sampler = StackSampler(threading.get_ident(), interval).start()
+    start = time.time()
+    try:
+        result = fn(task)
+    finally:
+        end = time.time()
+        samples = sampler.stop()
+        _active.stages = None
+    return result, {"pid": os.getpid(), "page": task[0], "start": start, "end": end, "stages": stages, **samples}
+
+
+def submit_profiled(executor, fn, task, profile=None):
+    """
+    executor.submit(fn, task), with the worker sampled for profile when one is given
+    The returned future resolves to fn's result either way.
+    """
+    if profile is None:
+        return executor.submit(fn, task)
+    inner = executor.submit(profiled_call, fn, task, profile.interval)
+    future = Future()
+
+    def unwrap(done):
+        try:
+            result, worker = done.result()
+        except BaseException as e:
+            future.set_exception(e)
+            return
+        profile.add_worker(worker)
+        future.set_result(result)
+
+    inner.add_done_callback(unwrap)
+    return future
+
+
+def event_order(event):
+    """Sort key for speedscope open/close events: closes before opens at equal times, outer stages around inner"""
+    at, kind, start, end = event
+    return (at, 1, -end) if kind == "O" else (at, 0, -start)
+
+
+class RequestProfile:
+    def __init__(self, name, folder, interval=PROFILE_INTERVAL):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.folder = folder
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.stages = []
+        self.workers = []
+        self.sampler = None
+        self.started_at = None
+        self.finished_at = None
+        self.handler = None
+
+    def add_worker(self, worker):
+        with self.lock:
+            self.workers.append(worker)
+
+    def __enter__(self):
+        self.started_at = time.time()
+        _active.profile = self
+        _active.stages = self.stages
+        self.sampler = StackSampler(threading.get_ident(), self.interval).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.handler = self.sampler.stop()
+        self.finished_at = time.time()
+        _active.profile = None
+        _active.stages = None
+        try:
+            self.save()
+        except OSError as e:
+            print(f"✗ Could not save profile {self.id[:8]}: {str(e)}")
+        return False
+
+    def to_speedscope(self):
+        frames = []
+        frame_ids = {}
+
+        def frame_id(key):
+            if key not in frame_ids:
+                frame_ids[key] = len(frames)
+                name, file, line = key
+                frames.append({"name": name, "file": file, "line": line} if file else {"name": name})
+            return frame_ids[key]
+
+        def sampled(name, recorded, start):
+            keys = recorded["frames"]
+            samples, weights = [], []
+            previous = start
+            for at, stack in recorded["samples"]:
+                samples.append([frame_id(keys[i]) for i in stack])
+                weights.append(round((at - previous) * 1000, 3))
+                previous = at
+            return {
+                "type": "sampled", "name": name, "unit": "milliseconds",
+                # On the request's time axis, like the stage timelines
+                "startValue": round((start - self.started_at) * 1000, 3),
+                "endValue": round((previous - self.started_at) * 1000, 3),
+                "samples": samples, "weights": weights,
+            }
+
+        def evented(name, stages, end):
+            events = []
+            for stage_name, start, stop in stages:
+                events.append((start, "O", start, stop, stage_name))
+                events.append((stop, "C", start, stop, stage_name))
+            events.sort(key=lambda event: event_order(event[:4]))
+            return {
+                "type": "evented", "name": name, "unit": "milliseconds",
+                "startValue": 0, "endValue": round((end - self.started_at) * 1000, 3),
+                "events": [
+                    {"type": kind, "frame": frame_id((f"stage: {stage_name}", None, None)),
+                     "at": round((at - self.started_at) * 1000, 3)}
+                    for at, kind, _, _, stage_name in events
+                ],
+            }
+
+        profiles = [sampled(f"handler (pid {os.getpid()})", self.handler, self.started_at)]
+        if self.stages:
+            profiles.append(evented("handler stages", self.stages, self.finished_at))
+        for worker in sorted(self.workers, key=lambda worker: worker["page"]):
+            label = f"page {worker['page'] + 1} (pid {worker['pid']})"
+            profiles.append(sampled(label, worker, worker["start"]))
+            if worker["stages"]:
+                profiles.append(evented(f"{label} stages", worker["stages"], worker["end"]))
+
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "pdf-highlighter profiling",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+    def stage_summary(self):
+        def timings(stages):
+            totals = {}
+            for name, start, end in stages:
+                totals[name] = round(totals.get(name, 0) + end - start, 4)
+            return totals
+
+        return {
+            "id": self.id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration": round(self.finished_at - self.started_at, 4),
+            "handler": timings(self.stages),
+            "pages": [
+                {
+                    "page": worker["page"] + 1,
+                    "pid": worker["pid"],
+                    "duration": round(worker["end"] - worker["start"], 4),
+                    "stages": timings(worker["stages"]),
+                }
+                for worker in sorted(self.workers, key=lambda worker: worker["page"])
+            ],
+        }
+
+    def save(self):
+        os.makedirs(self.folder, exist_ok=True)
+        for kind, document in (("speedscope", self.to_speedscope()), ("stages", self.stage_summary())):
+            with open(os.path.join(self.folder, self.id + PROFILE_FORMATS[kind]), "w", encoding="utf-8") as f:
+                json.dump(document, f, separators=(",", ":"))
+        prune_profiles(self.folder)
+        print(f"✓ Profile {self.id[:8]} saved ({len(self.workers)} worker pages, "
+              f"{self.finished_at - self.started_at:.2f}s)")
+
+
+def prune_profiles(folder, keep=PROFILE_KEEP):
+    """Deletes all but the newest `keep` profiles"""
+    paths = [os.path.join(folder, name) for name in os.listdir(folder) if name.endswith(PROFILE_FORMATS["stages"])]
+    paths.sort(key=os.path.getmtime, reverse=True)
+    for path in paths[keep:]:
+        profile_id = os.path.basename(path)[: -len(PROFILE_FORMATS["stages"])]
+        for suffix in PROFILE_FORMATS.values():
+            try:
+                os.remove(os.path.join(folder, profile_id + suffix))
+            except OSError:
+                pass
+
+
+def profile_authorized():
+    """True when the request carries the admin profiling token"""
+    if not PROFILE_TOKEN:
+        return False
+    token = request.headers.get("X-Profile-Token") or request.args.get("profile") or ""
+    return hmac.compare_digest(token.encode("utf-8"), PROFILE_TOKEN.encode("utf-8"))
+
+
+def profile_path(folder, profile_id, kind):
+    """Path of a saved profile artifact, or None for unknown ids and formats"""
+    if kind not in PROFILE_FORMATS or not re.fullmatch(r"[0-9a-f]{32}", profile_id):
+        return None
+    path = os.path.join(folder, profile_id + PROFILE_FORMATS[kind])
+    return path if os.path.exists(path) else None
+
+
+def profiled(folder):
+    """Route decorator: profiles requests that carry the admin token, others run untouched"""
+
+    def decorate(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not profile_authorized():
+                return view(*args, **kwargs)
+            # request.path, not full_path: the query may hold the token
+            profile = RequestProfile(f"{request.method} {request.path}", folder)
+            with profile:
+                response = make_response(view(*args, **kwargs))
+            response.headers["X-Profile-Id"] = profile.id
+            return response
+
+        return wrapper
+
+    return decorate
@@ -0,0 +1,104 @@
+"""
+Compact encodings for /search responses
+
+The default response stays the nested JSON built by search_pdf. Clients
+that send a matching Accept header get a columnar layout instead, where
+every highlight box is one row across parallel arrays:
+
+    Accept: application/vnd.pdf-highlighter.columnar+json
+    Accept: application/msgpack          (columnar, needs msgpack installed)
+
+Columnar JSON is gzip-compressed when the client accepts it.
+"""
+
+import gzip
+import json
+
+from flask import Response, jsonify, request
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+COLUMNAR_JSON_MIMETYPE = "application/vnd.pdf-highlighter.columnar+json"
+MSGPACK_MIMETYPE = "application/msgpack"
+GZIP_MIN_BYTES = 1024
+
+MATCH_FIELDS = ("matched_text", "context", "word_index", "word_count", "match_id", "continued")
+
+
+def to_columnar(results):
+    """
+    Flattens the nested matches of a search result into parallel arrays
+    Boxes reference their match through the "match" column
+    """
+    groups = [
+        (page_entry["page"], match_group)
+        for page_entry in results["matches"]
+        for match_group in page_entry["locations"]
+    ]
+    fields = [field for field in MATCH_FIELDS if any(field in group for _, group in groups)]
+
+    matches = {"page": [page for page, _ in groups]}
+    for field in fields:
+        matches[field] = [group.get(field) for _, group in groups]
+
+    boxes = {"match": [], "left": [], "top": [], "width": [], "height": []}
+    for match_id, (_, match_group) in enumerate(groups):
+        # Multi-line matches carry one box per line, single-box matches are the box
+        for box in match_group.get("locations", [match_group]):
+            boxes["match"].append(match_id)
+            boxes["left"].append(box["left"])
+            boxes["top"].append(box["top"])
+            boxes["width"].append(box["width"])
+            boxes["height"].append(box["height"])
+
+    compact = {key: value for key, value in results.items() if key != "matches"}
+    compact["format"] = "columnar"
+    compact["match_columns"] = matches
+    compact["box_columns"] = boxes
+    return compact
+
+
+def accepts_exactly(accept_mimetypes, mimetype):
+    """
+    True when the client named this mimetype explicitly
+    Wildcards like */* must not opt a browser into the compact formats
+    """
+    return any(value == mimetype and quality > 0 for value, quality in accept_mimetypes)
+
+
+def encode_search_results(results, accept_mimetypes, accept_encoding):
+    """
+    Encodes search results in the compact format the client asked for
+    Returns (body, mimetype, headers), or None for the regular nested JSON
+    """
+    if msgpack is not None and accepts_exactly(accept_mimetypes, MSGPACK_MIMETYPE):
+        return msgpack.packb(to_columnar(results), use_bin_type=True), MSGPACK_MIMETYPE, {}
+
+    if accepts_exactly(accept_mimetypes, COLUMNAR_JSON_MIMETYPE):
+        body = json.dumps(to_columnar(results), separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        if len(body) >= GZIP_MIN_BYTES and "gzip" in accept_encoding:
+            return gzip.compress(body, compresslevel=5), COLUMNAR_JSON_MIMETYPE, {"Content-Encoding": "gzip"}
+        return body, COLUMNAR_JSON_MIMETYPE, {}
+
+    return None
+
+
+def make_search_response(results):
+    """
+    Picks the response encoding for search results from the Accept headers
+    Falls back to the regular nested JSON
+    """
+    encoded = encode_search_results(
+        results, request.accept_mimetypes, request.headers.get("Accept-Encoding", "")
+    )
+    if encoded is None:
+        response = jsonify(results)
+    else:
+        body, mimetype, headers = encoded
+        response = Response(body, mimetype=mimetype, headers=headers)
+
+    response.headers["Vary"] = "Accept, Accept-Encoding"
+    return response
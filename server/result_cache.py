@@ -0,0 +1,69 @@
+"""
+Per-process LRU cache of search results
+
+Users re-run the same query on the same document (switching tabs, reloading
+the viewer). Results are kept by (file hash, normalized query, match
+parameters), so a repeat search skips the matcher entirely. Entries of a
+document are dropped when its OCR data is replaced or the file re-uploaded.
+Set RESULT_CACHE_SIZE=0 to disable.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from text_normalize import normalize_text
+
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 256))
+
+
+def result_key(file_hash, search_text, *params):
+    """Queries that normalize to the same text share an entry"""
+    return (file_hash, " ".join(normalize_text(search_text).split()), *params)
+
+
+class SearchResultCache:
+    """
+    Bounded map from result_key to matches grouped by page
+    ({page_num: [match]}), least recently used entries evicted first
+    """
+
+    def __init__(self, max_entries=RESULT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            pages = self.entries.get(key)
+            if pages is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return pages
+
+    def put(self, key, pages):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = pages
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, file_hash):
+        """Drops every entry of one document"""
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == file_hash]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,154 @@
+"""
+Priority-aware page scheduling for the shared OCR pool
+
+Submitting every page straight to a ProcessPoolExecutor is FIFO: one large
+document queues all its pages ahead of everyone else. PageScheduler keeps
+the pages itself and hands the pool at most `slots` at a time. Each time a
+page finishes the next one is picked by
+
+  1. priority class, INTERACTIVE (pages a user is looking at) before
+     SEARCH (the rest of a search) before BACKGROUND (documents OCRed
+     ahead of their first search, e.g. right after upload)
+  2. round-robin across users within the class
+  3. round-robin across each user's documents
+
+so the rest of a long search yields to interactive pages between any two
+pages, background work only uses slots no search is waiting for, and no
+user or document can starve the others. Everything runs on the event
+loop thread, so no locking is needed.
+"""
+
+import asyncio
+from collections import OrderedDict, deque
+
+INTERACTIVE = 0
+SEARCH = 1
+BACKGROUND = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", SEARCH: "search", BACKGROUND: "background"}
+# Upper bound for page ranges when the page count is not known yet
+MAX_PAGE_NUMBER = 100000
+
+
+def parse_page_range(text, total_pages=None, strict=False):
+    """
+    "1-3,7" -> {0, 1, 2, 6} (0-based page numbers)
+    Malformed parts are ignored, or raise ValueError when strict; pages past
+    total_pages (or MAX_PAGE_NUMBER when it is not given) are dropped
+    """
+    limit = MAX_PAGE_NUMBER if total_pages is None else total_pages
+    pages = set()
+    for part in (text or "").split(","):
+        bounds = part.strip().split("-", 1)
+        try:
+            first = int(bounds[0])
+            last = int(bounds[1]) if len(bounds) == 2 else first
+        except ValueError:
+            first = last = 0
+        if first < 1 or last < first:
+            if strict:
+                raise ValueError(f"invalid page range: {part.strip()!r}")
+            # Lenient: "0-3" still means pages 1-3
+            first = max(1, first)
+        pages.update(range(first - 1, min(last, limit)))
+    return pages
+
+
+class PageScheduler:
+    def __init__(self, executor, slots):
+        self.executor = executor
+        self.slots = slots
+        self.running = 0
+        # {priority: {user: {document: deque of tasks}}}, dict order is the round-robin order
+        self.queues = {priority: OrderedDict() for priority in PRIORITY_NAMES}
+
+    async def submit(self, priority, user, document, key, fn, *args):
+        """
+        Queues fn(*args) and waits for its result
+        key identifies the task within its document, for promote()
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.enqueue(priority, user, document, {"key": key, "fn": fn, "args": args, "future": future})
+        self.dispatch()
+        return await future
+
+    def enqueue(self, priority, user, document, task):
+        documents = self.queues[priority].setdefault(user, OrderedDict())
+        documents.setdefault(document, deque()).append(task)
+
+    def promote(self, document, keys, priority=INTERACTIVE):
+        """
+        Moves queued tasks of a document into a more urgent class, e.g. the
+        visible pages of a search that joined an in-flight OCR run
+        keys=None moves every task of the document; returns how many moved
+        """
+        moved = 0
+        for lower in range(priority + 1, max(PRIORITY_NAMES) + 1):
+            for user, documents in list(self.queues[lower].items()):
+                tasks = documents.get(document)
+                if not tasks:
+                    continue
+                for task in [task for task in tasks if keys is None or task["key"] in keys]:
+                    tasks.remove(task)
+                    self.enqueue(priority, user, document, task)
+                    moved += 1
+                self.prune(lower, user, document)
+        if moved:
+            self.dispatch()
+        return moved
+
+    def prune(self, priority, user, document):
+        documents = self.queues[priority][user]
+        if not documents[document]:
+            del documents[document]
+        if not documents:
+            del self.queues[priority][user]
+
+    def next_task(self):
+        for priority in sorted(self.queues):
+            users = self.queues[priority]
+            if not users:
+                continue
+            # Take from the first user's first document, then rotate both to the back
+            user, documents = next(iter(users.items()))
+            document, tasks = next(iter(documents.items()))
+            task = tasks.popleft()
+            documents.move_to_end(document)
+            users.move_to_end(user)
+            self.prune(priority, user, document)
+            return task
+        return None
+
+    def dispatch(self):
+        loop = asyncio.get_running_loop()
+        while self.running < self.slots:
+            task = self.next_task()
+            if task is None:
+                return
+            if task["future"].cancelled():
+                continue
+            self.running += 1
+            pool_future = loop.run_in_executor(self.executor, task["fn"], *task["args"])
+            pool_future.add_done_callback(lambda done, task=task: self.finished(task, done))
+
+    def finished(self, task, pool_future):
+        self.running -= 1
+        future = task["future"]
+        if pool_future.cancelled():
+            future.cancel()
+        elif not future.cancelled():
+            if pool_future.exception() is not None:
+                future.set_exception(pool_future.exception())
+            else:
+                future.set_result(pool_future.result())
+        self.dispatch()
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "queued": {
+                PRIORITY_NAMES[priority]: sum(
+                    len(tasks) for documents in users.values() for tasks in documents.values()
+                )
+                for priority, users in self.queues.items()
+            },
+        }
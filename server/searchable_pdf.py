@@ -0,0 +1,104 @@
+"""
+Searchable PDF output
+
+A scanned upload plus its OCR words becomes a PDF with an invisible text
+layer: every word is written with PyMuPDF in render mode 3 (no fill, no
+stroke) over the spot Tesseract found it, so viewers can select and search
+the text natively. Words go through a TextWriter with an embedded Unicode
+font; characters the font lacks (CJK, ...) are taken from MuPDF's fallback
+font, so no text is lost to a single-byte encoding. The font is sized so
+its ascender-to-descender height is the word box and stretched to the box
+width, so the text selects exactly the word Tesseract found.
+
+The same file also serves as a durable OCR result: the OCR data itself is
+embedded as a JSON attachment (OCR_ATTACHMENT), and read_text_layer returns
+it, so a document whose cache entry is gone is rebuilt without Tesseract.
+The visible text layer is never parsed back; it cannot be, losslessly.
+"""
+
+import json
+import os
+
+import fitz  # PyMuPDF
+
+SEARCHABLE_PDF = os.getenv("SEARCHABLE_PDF", "off") == "on"
+TEXT_LAYER_FONT = fitz.Font("helv")
+OCR_ATTACHMENT = "ocr_data.json"
+
+
+def searchable_path(searchable_folder, file_hash):
+    return os.path.join(searchable_folder, f"{file_hash}.pdf")
+
+
+def add_text_layer(page, ocr_data, dpi, min_confidence):
+    """Writes the confident OCR words of one page as invisible text; returns how many"""
+    scale = 72 / dpi
+    # OCR boxes are in the rendered (rotated) page, text goes in unrotated page space
+    derotate = page.derotation_matrix
+    ascender, descender = TEXT_LAYER_FONT.ascender, TEXT_LAYER_FONT.descender
+    written = 0
+
+    for i, text in enumerate(ocr_data["text"]):
+        text = str(text).strip()
+        if not text or int(float(ocr_data["conf"][i])) <= min_confidence:
+            continue
+        width = ocr_data["width"][i] * scale
+        height = ocr_data["height"][i] * scale
+        if width <= 0 or height <= 0:
+            continue
+
+        # The font's ascender-to-descender height spans the box
+        fontsize = height / (ascender - descender)
+        baseline = fitz.Point(ocr_data["left"][i] * scale, ocr_data["top"][i] * scale + ascender * fontsize)
+        origin = baseline * derotate
+        writer = fitz.TextWriter(page.rect)
+        _, end = writer.append(origin, text, font=TEXT_LAYER_FONT, fontsize=fontsize)
+        advance = end.x - origin.x
+        # Stretch along the reading direction so the selectable text covers the word box,
+        # then turn it upright in the displayed (rotated) page
+        morph = fitz.Matrix(width / advance, 1) if advance > 0 else fitz.Identity
+        writer.write_text(page, render_mode=3, morph=(origin, morph * fitz.Matrix(page.rotation)))
+        written += 1
+
+    return written
+
+
+def write_searchable_pdf(pdf_bytes, ocr_pages, out_path, dpi, min_confidence):
+    """
+    Saves the original pages with an OCR text layer, and the OCR data as an
+    attachment, to out_path
+    Written to a temp file and renamed, so readers never see a partial file
+    """
+    pdf = fitz.open(stream=pdf_bytes, filetype="pdf")
+    words = 0
+    try:
+        for page_num, ocr_data in enumerate(ocr_pages):
+            if ocr_data:
+                words += add_text_layer(pdf[page_num], ocr_data, dpi, min_confidence)
+        stored = json.dumps({"dpi": dpi, "pages": ocr_pages}, separators=(",", ":")).encode("utf-8")
+        pdf.embfile_add(OCR_ATTACHMENT, stored, filename=OCR_ATTACHMENT, desc="OCR data")
+        tmp_path = f"{out_path}.tmp{os.getpid()}"
+        pdf.save(tmp_path, garbage=3, deflate=True)
+    finally:
+        pdf.close()
+    os.replace(tmp_path, out_path)
+    print(f"✓ Searchable PDF written ({len(ocr_pages)} pages, {words} words)")
+
+
+def read_text_layer(path, dpi):
+    """
+    OCR data per page stored with a searchable PDF, with boxes in pixels of
+    a render at dpi like process_page_ocr produces
+    None when the file carries no OCR data for this dpi (written by an
+    older version, or at another OCR_DPI)
+    """
+    pdf = fitz.open(path)
+    try:
+        if OCR_ATTACHMENT not in pdf.embfile_names():
+            return None
+        stored = json.loads(pdf.embfile_get(OCR_ATTACHMENT))
+    finally:
+        pdf.close()
+    if stored.get("dpi") != dpi:
+        return None
+    return stored["pages"]
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+# app3 creates its upload folder (tmp_uploads) in the working directory on import
+os.chdir(tempfile.mkdtemp(prefix="pdf-highlighter-tests-"))
@@ -0,0 +1,20 @@
+import app
+
+
+def test_context_uses_the_texts_the_search_kept(monkeypatch):
+    monkeypatch.setattr(app, "CONTEXT_PAGE_CACHE_SIZE", 2)
+    monkeypatch.setattr(app, "SEARCHED_PAGE_TEXTS", type(app.SEARCHED_PAGE_TEXTS)())
+    monkeypatch.setattr(app, "ocr_page_texts", lambda *key: ["ocr"])
+
+    for page_num in range(3):
+        app.remember_page_texts("doc.pdf", 1.0, page_num, [f"page{page_num}"])
+
+    assert app.get_page_texts("doc.pdf", 1.0, 2) == ["page2"]
+    # Evicted, and a changed mtime means a re-upload: both are OCRed again
+    assert app.get_page_texts("doc.pdf", 1.0, 0) == ["ocr"]
+    assert app.get_page_texts("doc.pdf", 2.0, 2) == ["ocr"]
+
+
+def test_build_context_extends_to_sentence_boundaries():
+    texts = "Intro. The quick brown fox jumps. Tail".split()
+    assert app.build_context(texts, 3, 1) == "Intro. The quick brown fox jumps. Tail"
@@ -0,0 +1,80 @@
+import io
+import os
+
+import pytest
+
+import app3
+
+
+def page(word):
+    return {"text": [word], "conf": [90], "left": [0], "top": [0], "width": [5], "height": [5]}
+
+
+@pytest.fixture
+def client():
+    app3.clear_cache()
+    return app3.app.test_client()
+
+
+def upload(client, file_name, content):
+    path = os.path.join(app3.UPLOAD_FOLDER, file_name)
+    if os.path.exists(path):
+        os.remove(path)
+    client.post("/upload-chunk", data={
+        "chunk": (io.BytesIO(content), file_name), "index": "0", "total": "1", "fileName": file_name,
+    })
+    return client.post("/upload-complete", data={"fileName": file_name})
+
+
+def test_reupload_with_same_name_and_size_drops_cached_ocr(client):
+    upload(client, "report.pdf", b"first")
+    file_hash = app3.get_file_cache_key(os.path.join(app3.UPLOAD_FOLDER, "report.pdf"), "report.pdf")
+    app3.store_ocr_in_cache(file_hash, [page("stale")], 1, "report.pdf")
+    assert app3.get_ocr_from_cache(file_hash) is not None
+
+    response = upload(client, "report.pdf", b"other")
+
+    assert response.status_code == 200
+    assert app3.get_file_cache_key(os.path.join(app3.UPLOAD_FOLDER, "report.pdf"), "report.pdf") == file_hash
+    assert file_hash not in app3.OCR_CACHE
+    assert app3.get_ocr_from_cache(file_hash) is None
+    assert not app3.CORPUS.has_document(file_hash)
+
+
+def test_context_reads_the_cached_page(client):
+    upload(client, "notes.pdf", b"notes")
+    file_hash = app3.get_file_cache_key(os.path.join(app3.UPLOAD_FOLDER, "notes.pdf"), "notes.pdf")
+    words = "one two three four five six seven eight nine ten eleven twelve".split()
+    ocr_data = {
+        "text": words, "conf": [90] * len(words), "left": [0] * len(words), "top": [0] * len(words),
+        "width": [5] * len(words), "height": [5] * len(words),
+    }
+    app3.store_ocr_in_cache(file_hash, [None, ocr_data], 2)
+
+    def context(page, word_index, word_count):
+        return client.post("/context", data={
+            "fileName": "notes.pdf", "page": page, "word_index": word_index, "word_count": word_count,
+        })
+
+    response = context("2", "6", "1")
+    assert response.status_code == 200
+    assert response.get_json()["context"] == "two three four five six seven eight nine ten eleven twelve"
+    assert context("1", "0", "1").status_code == 400
+    assert context("3", "0", "1").status_code == 400
+    assert context("2", "11", "2").status_code == 400
+    assert context("2", "x", "1").status_code == 400
+
+    app3.drop_cached_document(file_hash)
+    assert context("2", "6", "1").status_code == 404
+
+
+def test_corpus_search_limit_is_validated(client, monkeypatch):
+    monkeypatch.setattr(app3, "CORPUS_MAX_LIMIT", 5)
+    seen = []
+    monkeypatch.setattr(app3, "search_corpus", lambda text, limit: seen.append(limit) or ([], 0, False))
+
+    for limit in ("abc", "0", "-3"):
+        assert client.post("/corpus-search", data={"search_text": "x", "limit": limit}).status_code == 400
+    assert client.post("/corpus-search", data={"search_text": "x", "limit": "500"}).status_code == 200
+    assert client.post("/corpus-search", data={"search_text": "x"}).status_code == 200
+    assert seen == [5, 5]
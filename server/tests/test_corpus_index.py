@@ -0,0 +1,70 @@
+import random
+import string
+
+from rapidfuzz import fuzz
+
+from corpus_index import FUZZY_THRESHOLD, CorpusIndex
+
+
+def page(*texts):
+    return {"text": list(texts), "conf": [90] * len(texts)}
+
+
+def make_index(tmp_path):
+    return CorpusIndex(str(tmp_path / "corpus.sqlite3"))
+
+
+def test_similar_tokens_finds_every_fuzzy_match(tmp_path):
+    rng = random.Random(7)
+    words = {"".join(rng.choice("abcdefgh") for _ in range(rng.randint(1, 14))) for _ in range(1000)}
+    index = make_index(tmp_path)
+    index.add_document("doc", "doc.pdf", [page(*sorted(words))], 0)
+
+    def misread(word):
+        chars = list(word)
+        for _ in range(rng.randint(0, 2)):
+            position = rng.randrange(len(chars) + 1)
+            edit = rng.choice("insert delete replace")
+            if edit == "insert":
+                chars.insert(position, rng.choice("abcdefgh"))
+            elif chars and position < len(chars):
+                if edit == "delete":
+                    del chars[position]
+                else:
+                    chars[position] = rng.choice("abcdefgh")
+        return "".join(chars) or "a"
+
+    queries = [misread(word) for word in rng.sample(sorted(words), 200)] + ["aab", "a", "abcdeabcdeab"]
+    for query in queries:
+        expected = {w for w in words if fuzz.ratio(query, w) >= FUZZY_THRESHOLD}
+        assert set(index.similar_tokens(query)) == expected
+
+
+def test_removing_a_document_prunes_its_grams(tmp_path):
+    index = make_index(tmp_path)
+    index.add_document("a", "a.pdf", [page("invoice")], 0)
+    index.add_document("b", "b.pdf", [page("invoice", "receipt")], 0)
+    index.remove_document("b")
+
+    conn = index.connect()
+    assert {row[0] for row in conn.execute("SELECT DISTINCT token FROM vocab_grams")} == {"invoice"}
+    assert index.similar_tokens("receipt") == []
+
+
+def test_candidate_pages_are_capped_per_document_and_in_all(tmp_path):
+    index = make_index(tmp_path)
+    index.add_document("big", "big.pdf", [page("total", "due")] * 5 + [page("total")], 0)
+    index.add_document("small", "small.pdf", [page("total", "due", "due")], 0)
+
+    pages, truncated = index.candidate_pages("Total due", per_document=10, limit=10)
+    assert not truncated
+    assert pages[0][:2] == ("small", 0)
+    assert sorted(p[:2] for p in pages[1:]) == [("big", n) for n in range(5)]
+
+    pages, truncated = index.candidate_pages("total due", per_document=2, limit=10)
+    assert truncated
+    assert [p[:2] for p in pages] == [("small", 0), ("big", 0), ("big", 1)]
+
+    pages, truncated = index.candidate_pages("total due", per_document=10, limit=3)
+    assert truncated and len(pages) == 3
+    assert index.candidate_pages("total missing", 10, 10) == ([], False)
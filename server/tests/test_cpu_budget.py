@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+
+import pytest
+
+import cpu_budget
+
+
+@pytest.fixture
+def machine(monkeypatch):
+    def configure(cpus, ram_gb):
+        monkeypatch.setattr(cpu_budget, "available_cpus", lambda: (cpus, "test"))
+        monkeypatch.setattr(cpu_budget.psutil, "virtual_memory", lambda: SimpleNamespace(total=ram_gb * 1024 ** 3))
+        monkeypatch.setattr(cpu_budget, "MAX_OCR_THREADS", 4)
+    return configure
+
+
+def test_many_pages_one_thread_per_worker(machine):
+    machine(cpus=8, ram_gb=64)
+    plan = cpu_budget.plan_ocr_workers(100, 16)
+    assert (plan["processes"], plan["threads"]) == (7, 1)
+
+
+def test_one_page_gets_spare_cpus_as_threads(machine):
+    machine(cpus=8, ram_gb=64)
+    plan = cpu_budget.plan_ocr_workers(1, 16)
+    assert (plan["processes"], plan["threads"]) == (1, 4)
+
+
+def test_ram_capped_workers_use_leftover_cpus(machine):
+    machine(cpus=16, ram_gb=4)
+    plan = cpu_budget.plan_ocr_workers(100, 16)
+    assert (plan["processes"], plan["threads"]) == (8, 1)
+    machine(cpus=16, ram_gb=2)
+    plan = cpu_budget.plan_ocr_workers(100, 16)
+    assert (plan["processes"], plan["threads"]) == (4, 3)
+
+
+def test_max_workers_cap_uses_leftover_cpus(machine):
+    machine(cpus=16, ram_gb=64)
+    plan = cpu_budget.plan_ocr_workers(100, 4)
+    assert (plan["processes"], plan["threads"]) == (4, 3)
@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+import app3
+import ingest
+
+
+class Invalidated(Exception):
+    pass
+
+
+@pytest.fixture
+def uploads(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "UPLOAD_FOLDER", str(tmp_path / "uploads"))
+    os.makedirs(ingest.UPLOAD_FOLDER)
+    hashed = []
+    digest = ingest.file_digest
+    monkeypatch.setattr(ingest, "file_digest", lambda path: hashed.append(path) or digest(path))
+    app3.clear_cache()
+    return hashed
+
+
+def write(path, content):
+    with open(path, "wb") as f:
+        f.write(content)
+    return str(path)
+
+
+def test_unchanged_copy_is_not_hashed(tmp_path, uploads):
+    source = write(tmp_path / "a.pdf", b"same bytes")
+    dest, changed = ingest.copy_to_uploads(source, replace=False)
+    assert not changed and open(dest, "rb").read() == b"same bytes"
+
+    assert ingest.copy_to_uploads(source, replace=False) == (dest, False)
+    assert ingest.copy_to_uploads(source, replace=True) == (dest, False)
+    assert uploads == []
+
+
+def test_touched_file_is_hashed_and_replaced_when_different(tmp_path, uploads):
+    source = write(tmp_path / "a.pdf", b"old bytes")
+    dest, _ = ingest.copy_to_uploads(source, replace=False)
+    os.utime(source, ns=(1, 1))
+    assert ingest.copy_to_uploads(source, replace=False) == (dest, False)
+    assert len(uploads) == 2
+
+    write(source, b"new bytes")
+    assert ingest.copy_to_uploads(source, replace=False) == (None, False)
+    assert ingest.copy_to_uploads(source, replace=True) == (dest, True)
+    assert open(dest, "rb").read() == b"new bytes"
+
+
+def test_cached_upload_of_same_size_is_skipped_without_hashing(tmp_path, uploads):
+    source = write(tmp_path / "a.pdf", b"old bytes")
+    dest, _ = ingest.copy_to_uploads(source, replace=False)
+    app3.store_ocr_in_cache(app3.get_file_cache_key(dest, "a.pdf"), [None], 1)
+    write(source, b"new bytes")
+
+    assert ingest.copy_to_uploads(source, replace=False) == (dest, False)
+    assert uploads == []
+
+
+def test_replace_drops_the_old_content_from_the_cache(tmp_path, uploads, monkeypatch):
+    source = write(tmp_path / "a.pdf", b"old bytes")
+    dest, _ = ingest.copy_to_uploads(source, replace=False)
+    file_hash = app3.get_file_cache_key(dest, "a.pdf")
+    app3.store_ocr_in_cache(file_hash, [None], 1)
+    write(source, b"new bytes")
+    # The bytes are not a PDF; stop right after the invalidation
+    def read_pdf(path):
+        raise Invalidated
+
+    monkeypatch.setattr(ingest, "read_pdf", read_pdf)
+    with pytest.raises(Invalidated):
+        ingest.prepare(source, replace=True)
+    assert open(dest, "rb").read() == b"new bytes"
+    assert app3.get_ocr_from_cache(file_hash) is None
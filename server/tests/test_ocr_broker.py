@@ -0,0 +1,95 @@
+"""Loopback broker and worker: token auth, a page round-trip, lease expiry and run cleanup"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import ocr_queue
+import ocr_worker
+from ocr_broker import Broker, BrokerServer
+from ocr_queue import BrokerClient, BrokerRun
+
+TOKEN = "test-token"
+
+
+def fake_ocr(page_data):
+    page_num, pdf_bytes = page_data
+    return page_num, {"text": [pdf_bytes.decode()], "page": page_num}
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    monkeypatch.setattr(ocr_queue, "OCR_QUEUE_TOKEN", TOKEN)
+    server = BrokerServer(("127.0.0.1", 0), TOKEN, Broker(lease_seconds=1, retries=2, run_ttl=60))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, "tcp://127.0.0.1:%d" % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def test_bad_token_is_rejected(broker):
+    _, address = broker
+    client = BrokerClient(address, token="wrong")
+    try:
+        with pytest.raises(RuntimeError, match="unauthorized"):
+            client.request({"op": "stats"})
+    finally:
+        client.close()
+
+
+def test_page_round_trip_through_a_worker(broker, monkeypatch):
+    _, address = broker
+    monkeypatch.setattr(ocr_worker, "process_page_ocr", fake_ocr)
+    stop = threading.Event()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        worker = threading.Thread(
+            target=ocr_worker.work, args=(address, "w1", executor, ocr_worker.DocumentCache(), stop), daemon=True
+        )
+        worker.start()
+        run = BrokerRun(address, b"pdf", [0])
+        try:
+            results = list(run.results())
+        finally:
+            run.close()
+            stop.set()
+            worker.join(timeout=10)
+    assert results == [(0, {"text": ["pdf"], "page": 0})]
+
+
+def test_expired_lease_requeues_the_page(broker):
+    _, address = broker
+    run = BrokerRun(address, b"pdf", [3])
+    taker = BrokerClient(address)
+    try:
+        job, _ = taker.request({"op": "take", "worker": "dead", "timeout": 1})
+        assert job["page"] == 3
+        # The first worker never answers; after the 1s lease the page goes to the next one
+        job, _ = taker.request({"op": "take", "worker": "alive", "timeout": 5})
+        assert job["page"] == 3
+        stats, _ = taker.request({"op": "stats"})
+        assert stats["requeued"] == 1
+    finally:
+        taker.close()
+        run.close()
+
+
+def test_run_is_dropped_when_its_connection_closes(broker):
+    server, address = broker
+    run = BrokerRun(address, b"pdf", [0, 1])
+    assert len(server.broker.runs) == 1
+    run.client.close()
+    deadline = time.time() + 5
+    while server.broker.runs and time.time() < deadline:
+        time.sleep(0.05)
+    assert not server.broker.runs
+
+
+def test_idle_run_expires():
+    broker = Broker(run_ttl=0.1)
+    broker.submit("r1", [0], b"pdf")
+    time.sleep(0.2)
+    broker.handle({"op": "stats"}, b"")
+    assert "r1" not in broker.runs
@@ -0,0 +1,58 @@
+import os
+
+from ocr_store import OcrDocumentCache, OcrStore
+
+
+def page(word):
+    return {"text": [word], "conf": [90], "left": [0], "top": [0], "width": [5], "height": [5]}
+
+
+def make_store(tmp_path, pages):
+    store = OcrStore(os.path.join(tmp_path, "store.sqlite3"))
+    store.put_document("doc", pages)
+    return store
+
+
+def test_stored_pages_read_lazily_and_keep_few_decoded(tmp_path):
+    store = make_store(tmp_path, [page(f"w{i}") for i in range(10)] + [None])
+    pages = store.get_document("doc")["pages"]
+    pages.max_decoded = 3
+
+    assert [p["text"][0] if p else None for p in pages] == [f"w{i}" for i in range(10)] + [None]
+    assert len(pages.decoded) == 3
+    assert pages[4]["text"] == ["w4"]
+    assert pages[-1] is None
+    assert len(pages.decoded) <= 3
+
+
+def test_clear_makes_open_handles_stale(tmp_path):
+    store = make_store(tmp_path, [page("a")])
+    pages = store.get_document("doc")["pages"]
+    assert pages.is_current()
+    store.clear()
+    assert not pages.is_current()
+    assert store.get_document("doc") is None
+
+
+def test_document_cache_evicts_least_recently_used():
+    cache = OcrDocumentCache(max_documents=2)
+    cache["a"] = {"total_pages": 1}
+    cache["b"] = {"total_pages": 1}
+    cache.get("a")
+    cache["c"] = {"total_pages": 1}
+    assert "a" in cache and "c" in cache and "b" not in cache
+    assert len(cache) == 2
+
+
+def test_delete_document_removes_rows_and_stales_handles(tmp_path):
+    store = make_store(tmp_path, [page("a")])
+    store.put_document("other", [page("b")])
+    store.touch("doc")
+    pages = store.get_document("doc")["pages"]
+
+    assert store.delete_document("doc")
+    assert not pages.is_current()
+    assert store.get_document("doc") is None
+    assert store.hot_documents(10) == []
+    assert store.get_document("other")["pages"][0]["text"] == ["b"]
+    assert not store.delete_document("doc")
@@ -0,0 +1,58 @@
+import io
+
+import fitz
+import numpy as np
+from PIL import Image
+
+from page_dedup import PageOcrIndex, plan_document
+
+
+def scan_png(seed, label):
+    """A 'scanned' page image: the same text block with per-scan sensor noise"""
+    rng = np.random.default_rng(seed)
+    image = np.full((400, 300), 245, dtype=np.uint8)
+    for row, width in enumerate([220, 180, 240, 200, 160]):
+        image[60 + row * 40:75 + row * 40, 30:30 + width] = 20
+    image[320:340, 30:30 + 40 * label] = 20
+    image = np.clip(image.astype(int) + rng.integers(-3, 4, image.shape), 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def build_pdf(pages):
+    pdf = fitz.open()
+    for kind, value in pages:
+        page = pdf.new_page(width=300, height=400)
+        if kind == "scan":
+            page.insert_image(page.rect, stream=value)
+        else:
+            page.insert_text((30, 60), value, fontsize=14)
+    return pdf.tobytes()
+
+
+def test_rescans_of_one_sheet_are_ocred_once():
+    pdf_bytes = build_pdf([("scan", scan_png(1, 1)), ("scan", scan_png(2, 1)), ("scan", scan_png(3, 5))])
+    plan = plan_document(pdf_bytes)
+    assert plan["scanned"] == [True, True, True]
+    assert plan["keys"][0] != plan["keys"][1]
+    assert plan["to_ocr"] == [0, 2]
+    assert plan["same_as"] == {1: 0}
+
+
+def test_text_pages_need_equal_content_keys():
+    pdf_bytes = build_pdf([("text", "Invoice 1001"), ("text", "Invoice 1001"), ("text", "Invoice 1007")])
+    plan = plan_document(pdf_bytes)
+    assert plan["scanned"] == [False, False, False]
+    assert plan["same_as"] == {1: 0}
+    assert plan["to_ocr"] == [0, 2]
+
+
+def test_index_matches_keyless_pages_by_hash_alone():
+    index = PageOcrIndex()
+    index.add(0b1111, None, "ocr")
+    assert index.lookup(0b0111, None) == "ocr"
+    assert index.lookup(0b1111 << 40, None) is None
+    index.add(0b1111, "key", "keyed")
+    assert index.lookup(0b0011, "key") == "keyed"
+    assert index.lookup(0b1111, "other") is None
@@ -0,0 +1,49 @@
+from phrase_matcher import aligned_spans, boundary_spans, word_spans
+from text_normalize import normalize_text, normalize_words
+
+
+def page(text):
+    texts = text.split()
+    return [{"text": t, "norm": norm} for t, norm in zip(texts, normalize_words(texts))]
+
+
+def matched(spans, words):
+    return [" ".join(w["text"] for w in words[s["start"]:s["start"] + s["count"]]) for s in spans]
+
+
+def test_split_and_merged_words_still_match():
+    words = page("the infor mation ofthe year")
+    assert matched(aligned_spans(words, "information"), words) == ["infor mation"]
+    assert matched(aligned_spans(words, "of the year"), words) == ["ofthe year"]
+
+
+def test_word_does_not_match_across_a_word_break():
+    words = page("paint the red car over there")
+    assert matched(aligned_spans(words, "there"), words) == ["there"]
+    assert aligned_spans(page("the red car"), "there") == []
+
+
+def test_line_end_hyphen_joins_without_penalty():
+    spans = aligned_spans(page("new pro- cessing step"), "processing")
+    assert [(s["start"], s["count"], s["score"]) for s in spans] == [(1, 2, 100)]
+
+
+def test_every_query_word_must_match_on_its_own():
+    assert aligned_spans(page("the Licensee agrees"), "licensor agrees") == []
+    words = page("the licensor agrees")
+    assert matched(aligned_spans(words, "licensor agrees"), words) == ["licensor agrees"]
+
+
+def test_numbers_match_exactly():
+    assert normalize_text("3.2,") == "3.2"
+    assert normalize_text("1,000.50") == "1,000.50"
+    words = page("version 32 then 3.2, not 3.5")
+    for spans in (aligned_spans(words, "3.2"), word_spans(words, "3.2")):
+        assert matched(spans, words) == ["3.2,"]
+
+
+def test_boundary_spans_cross_the_seam():
+    tail, head = page("end of the"), page("quarterly report")
+    assert boundary_spans(tail, head, "the quarterly") == [
+        {"score": 100, "tail_start": 2, "tail_count": 1, "head_count": 1}
+    ]
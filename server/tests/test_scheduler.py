@@ -0,0 +1,71 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from scheduler import BACKGROUND, INTERACTIVE, SEARCH, PageScheduler, parse_page_range
+
+
+def run_order(queue):
+    """Queues (priority, user, document, key) while the only slot is busy, returns the order they ran in"""
+    order = []
+
+    async def main():
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            scheduler = PageScheduler(executor, 1)
+            gate = threading.Event()
+            blocker = asyncio.ensure_future(scheduler.submit(SEARCH, "x", "x", 0, gate.wait))
+            tasks = [
+                asyncio.ensure_future(scheduler.submit(priority, user, document, key, order.append, key))
+                for priority, user, document, key in queue
+            ]
+            await asyncio.sleep(0)
+            gate.set()
+            await asyncio.gather(blocker, *tasks)
+
+    asyncio.run(main())
+    return order
+
+
+def test_classes_run_in_priority_order():
+    order = run_order([
+        (BACKGROUND, "a", "d1", "bg"),
+        (SEARCH, "a", "d2", "search"),
+        (INTERACTIVE, "a", "d2", "visible"),
+    ])
+    assert order == ["visible", "search", "bg"]
+
+
+def test_users_and_documents_take_turns():
+    order = run_order([
+        (SEARCH, "a", "big", "a1"),
+        (SEARCH, "a", "big", "a2"),
+        (SEARCH, "a", "other", "o1"),
+        (SEARCH, "b", "small", "b1"),
+    ])
+    assert order == ["a1", "b1", "o1", "a2"]
+
+
+def test_promote_moves_background_pages_up():
+    scheduler = PageScheduler(None, 0)
+    for key in range(3):
+        scheduler.enqueue(BACKGROUND, "a", "doc", {"key": key})
+    scheduler.enqueue(BACKGROUND, "a", "other", {"key": 0})
+
+    asyncio.run(promote(scheduler))
+    assert scheduler.stats()["queued"] == {"interactive": 1, "search": 2, "background": 1}
+    assert scheduler.next_task()["key"] == 1
+
+
+async def promote(scheduler):
+    assert scheduler.promote("doc", {1}) == 1
+    assert scheduler.promote("doc", None, SEARCH) == 2
+
+
+def test_parse_page_range():
+    assert parse_page_range("1-3,7") == {0, 1, 2, 6}
+    assert parse_page_range("0-2, x, 9", total_pages=5) == {0, 1}
+    assert parse_page_range(None) == set()
+    with pytest.raises(ValueError):
+        parse_page_range("3-1", strict=True)
@@ -0,0 +1,68 @@
+"""
+Normalized word forms for matching
+
+OCR text and queries are reduced to the same comparable form once:
+
+  - NFKC, which also expands compatibility ligatures (ﬁ -> fi, ﬂ -> fl)
+  - case folding (ß -> ss)
+  - remaining ligatures NFKC keeps (æ, œ) spelled out
+  - diacritics removed (café -> cafe)
+  - punctuation, soft hyphens and other format characters dropped, so
+    "processing," "“processing”" and "pro-" + "cessing" line up
+  - except decimal and thousands separators between two digits, so "3.2"
+    stays apart from "32"
+
+Normalized forms are computed when a page is OCRed and cached next to the
+text ("norm" in the OCR data), so searches never re-normalize the document.
+Highlights snap to whole OCR words, so word i of the normalized forms is the
+map back to word i of the original text.
+"""
+
+import unicodedata
+
+LIGATURES = str.maketrans({"æ": "ae", "œ": "oe", "ĳ": "ij", "ø": "o", "đ": "d", "ł": "l"})
+NOT_SIGN = "¬"   # common OCR read of a line-end hyphen
+NUMBER_SEPARATORS = ".,"
+
+
+def is_dropped(ch):
+    category = unicodedata.category(ch)
+    return category.startswith("P") or category in ("Cf", "Mn") or ch == NOT_SIGN
+
+
+def is_number_separator(chars, i):
+    return (
+        chars[i] in NUMBER_SEPARATORS
+        and 0 < i < len(chars) - 1
+        and chars[i - 1].isdigit()
+        and chars[i + 1].isdigit()
+    )
+
+
+def normalize_text(text):
+    """Comparable form of one word (or a whole query, spaces are kept)"""
+    text = unicodedata.normalize("NFKC", str(text)).casefold().translate(LIGATURES)
+    decomposed = unicodedata.normalize("NFKD", text)
+    kept = (ch for i, ch in enumerate(decomposed) if not is_dropped(ch) or is_number_separator(decomposed, i))
+    return unicodedata.normalize("NFC", "".join(kept))
+
+
+def number_part(norm):
+    """Digits and separators of a normalized word, which fuzzy matching must not change"""
+    return "".join(ch for ch in norm if ch.isdigit() or ch in NUMBER_SEPARATORS)
+
+
+def normalize_words(texts):
+    """Normalized forms of a page's OCR words, stored as the "norm" column"""
+    return [normalize_text(text) for text in texts]
+
+
+def page_norms(ocr_data):
+    """
+    The cached "norm" column of a page's OCR data, computed on the fly for
+    data cached before normalization was stored
+    """
+    norms = ocr_data.get("norm")
+    if norms is None or len(norms) != len(ocr_data["text"]):
+        norms = normalize_words(ocr_data["text"])
+    return norms
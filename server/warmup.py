@@ -0,0 +1,101 @@
+"""
+Warm start on server boot
+
+Right after a restart every first search pays for cold state: worker
+processes that still have to start and import fitz/pytesseract/rapidfuzz,
+Tesseract's language data not yet in the page cache, and an empty OCR_CACHE.
+start_warmup runs named steps in a background thread so the server can
+accept connections immediately, and WarmupState reports progress. /health
+answers 503 until every step has finished, so load balancers only route
+traffic to warm instances.
+
+Set WARMUP=off to skip the steps and report ready straight away.
+"""
+
+import os
+import threading
+import time
+
+WARMUP = os.getenv("WARMUP", "on") != "off"
+WARM_DOCUMENTS = int(os.getenv("WARM_DOCUMENTS", 20))
+
+
+class WarmupState:
+    def __init__(self):
+        self.ready = threading.Event()
+        self.lock = threading.Lock()
+        self.steps = {}
+        self.started_at = None
+        self.finished_at = None
+
+    def as_dict(self):
+        finished = self.finished_at or time.time()
+        return {
+            "ready": self.ready.is_set(),
+            "elapsed": f"{finished - self.started_at:.2f}s" if self.started_at else None,
+            "steps": dict(self.steps),
+        }
+
+
+def run_steps(state, steps):
+    """Runs (name, fn) steps in order; a failing step is reported, not fatal"""
+    for name, step in steps:
+        state.steps[name] = {"status": "running"}
+        step_start = time.time()
+        try:
+            detail = step()
+            state.steps[name] = {"status": "done", "time": f"{time.time() - step_start:.2f}s"}
+            if detail is not None:
+                state.steps[name]["detail"] = detail
+            print(f"✓ Warmup {name} done in {time.time() - step_start:.2f}s")
+        except Exception as e:
+            state.steps[name] = {"status": "failed", "error": str(e)}
+            print(f"✗ Warmup {name} failed: {str(e)}")
+    state.finished_at = time.time()
+    state.ready.set()
+
+
+def start_warmup(state, steps):
+    """
+    Runs the steps in a daemon thread and returns it
+    Only the first call starts anything, later calls return None
+    """
+    with state.lock:
+        if state.started_at is not None:
+            return None
+        state.started_at = time.time()
+    if not WARMUP:
+        state.finished_at = state.started_at
+        state.ready.set()
+        return None
+    thread = threading.Thread(target=run_steps, args=(state, steps), name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def warm_ocr_engine():
+    """
+    Runs Tesseract once on a tiny image, loading its language data into the
+    page cache
+    """
+    import pytesseract
+    from PIL import Image, ImageDraw
+
+    img = Image.new("L", (200, 60), 255)
+    ImageDraw.Draw(img).text((10, 20), "warm", fill=0)
+    pytesseract.image_to_data(img, lang="eng", config="--psm 7 --oem 3", output_type=pytesseract.Output.DICT)
+
+
+def warm_worker():
+    """Per-worker warm task, returns the worker's pid"""
+    warm_ocr_engine()
+    return os.getpid()
+
+
+def warm_pool(executor, size):
+    """
+    Starts every worker of a ProcessPoolExecutor and runs the OCR engine
+    in each; returns how many distinct workers answered
+    """
+    futures = [executor.submit(warm_worker) for _ in range(size)]
+    return len({future.result() for future in futures})
@@ -0,0 +1,271 @@
+"""
+Self-healing process pool for long-running servers
+
+MuPDF rendering and Tesseract fragment memory, so a worker that lives for
+thousands of pages keeps growing. RecyclingPool wraps ProcessPoolExecutor
+and replaces the whole pool (a new "generation") when
+
+  - its workers have run WORKER_MAX_TASKS tasks each on average, or
+  - any worker's RSS is above WORKER_MAX_RSS_MB (checked via psutil after
+    every task)
+
+The old generation is shut down without waiting: its workers finish the
+pages they already have and exit, while new pages go to fresh workers.
+
+When a worker dies (segfault, OOM kill) ProcessPoolExecutor fails every
+pending future with BrokenProcessPool, and cannot say which task killed it.
+Workers report each task as they start it (WorkerTracker), so
+  - tasks that had not started yet go to the new generation as if nothing
+    happened
+  - tasks that were running are suspects: they are retried one at a time on
+    a separate single-worker pool, where a crash can only be their own. Only
+    there a crash counts against the task, and a task fails after
+    PAGE_RETRIES crashes
+so one poison page fails alone instead of taking the whole search with it.
+"""
+
+import itertools
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import psutil
+
+WORKER_MAX_TASKS = int(os.getenv("WORKER_MAX_TASKS", 200))
+WORKER_MAX_RSS_MB = int(os.getenv("WORKER_MAX_RSS_MB", 1024))
+PAGE_RETRIES = int(os.getenv("PAGE_RETRIES", 2))
+
+# Worker side: where this worker reports to, set by announce_worker
+_channel = None
+
+
+def announce_worker(channel, initializer=None, initargs=()):
+    """Pool initializer: reports the worker's pid, then runs the real initializer"""
+    global _channel
+    _channel = channel
+    channel.put(("worker", os.getpid()))
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def tracked_call(task_id, fn, args, kwargs):
+    """Worker side of RecyclingPool.submit: reports the task as started, then runs it"""
+    # SimpleQueue.put writes to the pipe before returning, so the report
+    # survives the worker dying inside fn
+    _channel.put(("started", task_id))
+    return fn(*args, **kwargs)
+
+
+class WorkerTracker:
+    """
+    Pids and started tasks reported by the workers of one ProcessPoolExecutor
+    Create the executor with initializer=announce_worker and
+    initargs=tracker.initargs(initializer, initargs).
+    """
+
+    def __init__(self):
+        self.channel = multiprocessing.SimpleQueue()
+        self.pids = set()
+        self.started = set()
+        self.lock = threading.Lock()
+
+    def initargs(self, initializer=None, initargs=()):
+        return (self.channel, initializer, initargs)
+
+    def drain(self):
+        with self.lock:
+            while not self.channel.empty():
+                kind, value = self.channel.get()
+                (self.pids if kind == "worker" else self.started).add(value)
+
+    def was_started(self, task_id):
+        self.drain()
+        return task_id in self.started
+
+    def processes(self):
+        """psutil.Process of every live worker"""
+        self.drain()
+        return [child for child in psutil.Process().children() if child.pid in self.pids]
+
+
+class RecyclingPool(Executor):
+    def __init__(self, max_workers, max_tasks=WORKER_MAX_TASKS, max_rss_mb=WORKER_MAX_RSS_MB,
+                 retries=PAGE_RETRIES, initializer=None, initargs=()):
+        self.max_workers = max_workers
+        self.initializer = initializer
+        self.initargs = initargs
+        self.max_tasks = max_tasks
+        self.max_rss = max_rss_mb * 1024 * 1024
+        self.retries = retries
+        self.lock = threading.Lock()
+        self.closed = False
+        self.generation = 0
+        self.task_ids = itertools.count()
+        self.executor, self.tracker = self.new_executor()
+        self.tasks_done = 0
+        # Suspects of a crash, run one at a time on their own executor
+        self.isolated = deque()
+        self.isolating = False
+        self.isolation_executor = None
+        self.stats = {"generations": 1, "recycled_tasks": 0, "recycled_rss": 0, "crashes": 0, "retries": 0}
+
+    def new_executor(self):
+        tracker = WorkerTracker()
+        executor = ProcessPoolExecutor(
+            max_workers=self.max_workers, initializer=announce_worker,
+            initargs=tracker.initargs(self.initializer, self.initargs),
+        )
+        return executor, tracker
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = Future()
+        self._submit(future, fn, args, kwargs, attempt=0)
+        return future
+
+    def _submit(self, future, fn, args, kwargs, attempt):
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            executor, tracker, generation = self.executor, self.tracker, self.generation
+        task_id = next(self.task_ids)
+        try:
+            inner = executor.submit(tracked_call, task_id, fn, args, kwargs)
+        except BrokenProcessPool:
+            # Broken between our lock and submit, the task never started
+            inner = Future()
+            inner.set_exception(BrokenProcessPool("pool broke before the task started"))
+        except RuntimeError:
+            # Replaced and shut down between our lock and submit: use the new generation
+            if self.closed:
+                raise
+            self._submit(future, fn, args, kwargs, attempt)
+            return
+        inner.add_done_callback(
+            lambda done: self._finished(future, done, generation, tracker, task_id, fn, args, kwargs, attempt)
+        )
+
+    def _finished(self, future, inner, generation, tracker, task_id, fn, args, kwargs, attempt):
+        if inner.cancelled():
+            future.cancel()
+            return
+        error = inner.exception()
+        if isinstance(error, BrokenProcessPool) and not self.closed:
+            self._replace(generation, "crashes")
+            if not tracker.was_started(task_id):
+                # Queued behind the crash, not part of it
+                self._submit(future, fn, args, kwargs, attempt)
+                return
+            if attempt < self.retries:
+                self._isolate(future, fn, args, kwargs, attempt + 1)
+                return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(inner.result())
+            self._check_health(generation)
+
+    def _isolate(self, future, fn, args, kwargs, attempt):
+        with self.lock:
+            self.stats["retries"] += 1
+            self.isolated.append((future, fn, args, kwargs, attempt))
+        self._run_isolated()
+
+    def _run_isolated(self):
+        """Starts the next suspect unless one is running"""
+        with self.lock:
+            if self.isolating or not self.isolated or self.closed:
+                return
+            self.isolating = True
+            item = self.isolated.popleft()
+            if self.isolation_executor is None:
+                self.isolation_executor = ProcessPoolExecutor(
+                    max_workers=1, initializer=self.initializer, initargs=self.initargs
+                )
+            executor = self.isolation_executor
+        future, fn, args, kwargs, attempt = item
+        print(f"⟳ Retrying a task that was running when a worker crashed, on its own (attempt {attempt + 1})")
+        try:
+            inner = executor.submit(fn, *args, **kwargs)
+        except BrokenProcessPool:
+            inner = Future()
+            inner.set_exception(BrokenProcessPool("pool broke before the task started"))
+        inner.add_done_callback(lambda done: self._isolated_finished(item, done, executor))
+
+    def _isolated_finished(self, item, inner, executor):
+        future, fn, args, kwargs, attempt = item
+        error = None if inner.cancelled() else inner.exception()
+        crashed = isinstance(error, BrokenProcessPool)
+        retry = False
+        with self.lock:
+            self.isolating = False
+            if crashed:
+                # The only task on this executor, so the crash was its own
+                self.stats["crashes"] += 1
+                if self.isolation_executor is executor:
+                    self.isolation_executor = None
+                retry = attempt < self.retries and not self.closed
+                if retry:
+                    self.stats["retries"] += 1
+                    self.isolated.appendleft((future, fn, args, kwargs, attempt + 1))
+        if crashed:
+            executor.shutdown(wait=False)
+        if inner.cancelled():
+            future.cancel()
+        elif error is not None and not retry:
+            future.set_exception(error)
+        elif error is None:
+            future.set_result(inner.result())
+        self._run_isolated()
+
+    def _check_health(self, generation):
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.tasks_done += 1
+            tracker = self.tracker
+            reason = "recycled_tasks" if self.tasks_done >= self.max_tasks * self.max_workers else None
+        if reason is None:
+            for process in tracker.processes():
+                try:
+                    if process.memory_info().rss > self.max_rss:
+                        reason = "recycled_rss"
+                        break
+                except psutil.Error:
+                    continue
+        if reason is not None:
+            self._replace(generation, reason)
+
+    def _replace(self, generation, reason):
+        """Starts a new generation unless another thread already replaced this one"""
+        with self.lock:
+            if generation != self.generation or self.closed:
+                return
+            old = self.executor
+            self.executor, self.tracker = self.new_executor()
+            self.generation += 1
+            self.tasks_done = 0
+            self.stats["generations"] += 1
+            self.stats[reason] += 1
+        print(f"⟳ OCR pool generation {self.generation} started ({reason.replace('_', ' ')})")
+        old.shutdown(wait=False)
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self.lock:
+            self.closed = True
+            executor = self.executor
+            isolation_executor = self.isolation_executor
+            waiting = list(self.isolated)
+            self.isolated.clear()
+        for future, *_ in waiting:
+            future.cancel()
+        executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+        if isolation_executor is not None:
+            isolation_executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+    def worker_pids(self):
+        with self.lock:
+            tracker = self.tracker
+        return [process.pid for process in tracker.processes()]